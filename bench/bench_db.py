@@ -0,0 +1,258 @@
+"""
+Synthetic-data benchmarks for the EXC-bot database and report paths.
+
+Builds a throwaway database per (staff, years) case with a realistic attendance history
+(and its event log) ending today and its planned shift calendar (optionally alongside other
+groups of the same size), then times the code paths behind /clockin and /clockout, /check,
+/staff, /status, /report, /analytics, the absence sweep and /rebuild through the same
+Database/HotState layer the bot uses. Each path also gets one extra run under tracemalloc
+to record its peak Python allocation.
+
+    python bench/bench_db.py                                  # 50 and 500 staff, 1 year
+    python bench/bench_db.py --staff 50 500 5000 --years 1 5  # full matrix (slow)
+    python bench/bench_db.py --groups 1 20                    # same team among 19 other groups
+    python bench/bench_db.py --out bench_results.json         # machine-readable results
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, Iterator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main as bot  # noqa: E402
+
+STATUS_WEIGHTS = [("Clocked Out", 85), ("Sick", 5), ("Off", 5), ("Absent", 5)]
+
+
+def _rows(group_id: int, staff: int, days: int, end_day: int, seed: int) -> Iterator[tuple]:
+    rnd = random.Random(seed)
+    statuses = [s for s, w in STATUS_WEIGHTS for _ in range(w)]
+    start_min = bot.minute_of_day(bot.hhmm_to_dt(bot.SHIFT_START))
+    end_min = bot.minute_of_day(bot.hhmm_to_dt(bot.SHIFT_END))
+    for day in range(end_day - days + 1, end_day + 1):
+        for uid in range(1, staff + 1):
+            status = rnd.choice(statuses)
+            if status != "Clocked Out":
+                yield group_id, uid, f"Staff {uid}", day, None, None, status, 0, 0
+                continue
+            cin = start_min + int(rnd.gauss(0, 8))
+            cout = end_min + int(rnd.gauss(10, 15))
+            yield group_id, uid, f"Staff {uid}", day, cin, cout, status, max(0, cin - start_min), max(0, cout - end_min)
+
+
+def generate(path: str, staff: int, years: int, seed: int = 1, groups: int = 1) -> int:
+    """
+    Create a migrated DB at `path` holding `years` of history for `staff` people in each of
+    `groups` groups (GROUP_ID first); returns the row count.
+    """
+    db = bot.Database(path)
+    days = 365 * years
+    today = bot.today_day()
+
+    def fill(conn: Any) -> int:
+        bot.migrate(conn)
+        for i in range(groups):
+            gid = bot.GROUP_ID - i
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO groups(group_id, shift_start, shift_end, absent_swept_through, calendar_through)
+                VALUES (?,?,?,?,?)
+                """,
+                (gid, bot.SHIFT_START, bot.SHIFT_END, today, today + bot.SHIFT_CALENDAR_DAYS - 1),
+            )
+            conn.executemany(
+                "INSERT INTO staff(group_id, user_id, full_name) VALUES (?, ?, ?)",
+                ((gid, uid, f"Staff {uid}") for uid in range(1, staff + 1)),
+            )
+            conn.executemany(
+                """
+                INSERT INTO attendance(group_id, user_id, full_name, day, clock_in, clock_out, status,
+                                       late_minutes, overtime_minutes)
+                VALUES (?,?,?,?,?,?,?,?,?)
+                """,
+                _rows(gid, staff, days, today, seed + i),
+            )
+            # the event log that attendance is projected from, as if migrated from these rows
+            conn.execute(
+                f"""
+                INSERT INTO events(group_id, user_id, day, kind, {bot._ATTENDANCE_ROW}, at)
+                SELECT group_id, user_id, day, 'import', {bot._ATTENDANCE_ROW}, 0 FROM attendance WHERE group_id = ?
+                """,
+                (gid,),
+            )
+            bot._build_calendar(conn, gid, today - days + 1, today + bot.SHIFT_CALENDAR_DAYS - 1)
+        return conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+
+    n = db.write_sync(fill)
+    db.write_sync(lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)"))
+    db.close()
+    return n
+
+
+async def _measure(fn: Callable[[], Awaitable[Any]], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    await fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times.sort()
+    return {
+        "min_ms": round(times[0] * 1000, 3),
+        "median_ms": round(times[len(times) // 2] * 1000, 3),
+        "max_ms": round(times[-1] * 1000, 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+async def run_case(path: str, staff: int, repeat: int, workdir: str) -> Dict[str, Dict[str, float]]:
+    db = bot.Database(path)
+    month = bot.gmt5_now().strftime("%Y-%m")
+    today = bot.today_day()
+    year_start = today - 364
+    uid = max(1, staff // 2)
+    gid = bot.GROUP_ID
+    results: Dict[str, Dict[str, float]] = {}
+
+    async def check() -> None:
+        await db.month_summary(gid, uid, month)
+
+    async def check_days() -> None:
+        await db.month_summary(gid, uid, month)
+        await db.month_attendance(gid, uid, month, limit=bot.PAGE_SIZE)
+
+    async def staff_page() -> None:
+        await db.staff_page(gid, uid, False, bot.PAGE_SIZE)
+
+    async def status_cold() -> None:
+        await bot.HotState(db, gid).today_page(limit=bot.PAGE_SIZE)
+
+    warm = bot.HotState(db, gid)
+    await warm.today_page(limit=bot.PAGE_SIZE)
+
+    async def status_warm() -> None:
+        await warm.today_page(limit=bot.PAGE_SIZE)
+
+    def report(start: int, fmt: str) -> Callable[[], Awaitable[Any]]:
+        async def run() -> None:
+            out = os.path.join(workdir, f"report.{fmt}")
+            await db.export_report(gid, start, today, fmt, out)
+            os.remove(out)
+
+        return run
+
+    cache = bot.ReportCache(db, os.path.join(workdir, "report_cache"), 1, 10)
+    await cache.get(gid, year_start, today, "csv.gz")  # built once in a worker process, then served
+
+    async def report_cached() -> None:
+        await cache.get(gid, year_start, today, "csv.gz")
+
+    def analytics(start: int, chart: bool) -> Callable[[], Awaitable[Any]]:
+        async def run() -> None:
+            await db.analytics(gid, start, today, "bench", os.path.join(workdir, "analytics.png") if chart else None)
+
+        return run
+
+    async def sweep_noop() -> None:
+        # every (staff, day) already has a row: measures the set-based scan alone
+        await db.mark_absent(gid, today - 29, today)
+
+    async def clock_write() -> None:
+        # one clock-in and clock-out: two event appends, each refolding the day into attendance
+        await db.clock_in(gid, uid, "Bench", today, 600, 0)
+        await db.clock_out(gid, uid, today, 1000, 0)
+
+    cases = [
+        ("check", check),
+        ("check_days", check_days),
+        ("staff_page", staff_page),
+        ("status_cold", status_cold),
+        ("status_warm", status_warm),
+        ("absent_sweep_30d_noop", sweep_noop),
+        ("report_month_xlsx", report(bot.month_days(month)[0], "xlsx")),
+        ("report_month_csv", report(bot.month_days(month)[0], "csv")),
+        ("report_year_csv_gz", report(year_start, "csv.gz")),
+        ("report_year_cached", report_cached),
+        ("analytics_year", analytics(year_start, False)),
+        ("analytics_year_chart", analytics(year_start, True)),
+        ("clock_write", clock_write),  # last: it changes this month's data, so cached reports go stale
+    ]
+    for name, fn in cases:
+        slow = name.startswith(("report", "analytics"))
+        results[name] = await _measure(fn, max(1, repeat // 5) if slow else repeat)
+        print(f"  {name:<24} median {results[name]['median_ms']:>10.2f} ms   peak {results[name]['peak_kb']:>10.1f} KB")
+
+    # absence sweep that actually inserts: staff x 30 future days (measured once, it mutates the DB)
+    t0 = time.perf_counter()
+    inserted = await db.mark_absent(gid, today + 1, today + 30)
+    results["absent_sweep_30d_insert"] = {"ms": round((time.perf_counter() - t0) * 1000, 3), "rows": inserted}
+    print(f"  {'absent_sweep_30d_insert':<24} {results['absent_sweep_30d_insert']['ms']:>17.2f} ms   rows {inserted}")
+
+    # replaying the live event log into attendance (measured once, it rewrites the projection)
+    t0 = time.perf_counter()
+    rebuilt, drifted = await db.rebuild_attendance(gid)
+    results["rebuild_projection"] = {"ms": round((time.perf_counter() - t0) * 1000, 3), "rows": rebuilt}
+    print(f"  {'rebuild_projection':<24} {results['rebuild_projection']['ms']:>17.2f} ms   rows {rebuilt}"
+          f"{f'  DRIFTED {drifted}' if drifted else ''}")
+
+    await cache.close()
+    db.close()
+    return results
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--staff", type=int, nargs="+", default=[50, 500], help="team sizes to benchmark")
+    ap.add_argument("--years", type=int, nargs="+", default=[1], help="history lengths in years")
+    ap.add_argument("--groups", type=int, nargs="+", default=[1], help="groups sharing the DB (queries hit one)")
+    ap.add_argument("--repeat", type=int, default=20, help="timed runs per query path")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write JSON results to this file")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="exc_bench_")
+    report: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "sqlite": bot.sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cases": [],
+    }
+    try:
+        for groups in args.groups:
+            for years in args.years:
+                for staff in args.staff:
+                    path = os.path.join(workdir, f"bench_{groups}_{staff}_{years}.db")
+                    t0 = time.perf_counter()
+                    rows = generate(path, staff, years, args.seed, groups)
+                    gen_s = time.perf_counter() - t0
+                    print(f"{groups} group(s) x {staff} staff x {years}y: {rows} rows, "
+                          f"{os.path.getsize(path) / 1e6:.1f} MB (generated in {gen_s:.1f}s)")
+                    results = asyncio.run(run_case(path, staff, args.repeat, workdir))
+                    case: Dict[str, Any] = {"groups": groups, "staff": staff, "years": years, "rows": rows,
+                                            "results": results}
+                    report["cases"].append(case)
+                    os.remove(path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
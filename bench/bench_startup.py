@@ -0,0 +1,160 @@
+"""
+Cold-start benchmark and import-regression guard for the EXC-bot.
+
+Each run starts a fresh interpreter in a throwaway directory and times `import main`,
+build_app(), init_db() and a first round of the everyday read paths (/status, /staff,
+/check) through the same Database/HotState layer the bot uses, then records peak RSS.
+The run fails if any part of the report/analytics stack (pandas, numpy, xlsxwriter,
+openpyxl, matplotlib) was loaded by then, or if the medians exceed the given budgets.
+Finally it times the first /report and /analytics build, which is where that stack
+is now paid for.
+
+    python bench/bench_startup.py                                # 5 cold starts, default budgets
+    python bench/bench_startup.py --max-import-ms 600 --max-rss-mb 70
+    python bench/bench_startup.py --importtime 15                # also list the slowest imports
+    python bench/bench_startup.py --out startup_results.json     # machine-readable results
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("pandas", "numpy", "xlsxwriter", "openpyxl", "matplotlib")
+
+PROBE = r"""
+import asyncio, json, os, resource, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import main as bot
+t1 = time.perf_counter()
+bot.BOT_TOKEN = "123456:STARTUP-BENCH"
+bot.build_app()
+t2 = time.perf_counter()
+bot.init_db()
+t3 = time.perf_counter()
+
+
+async def everyday() -> None:
+    gid = bot.GROUP_ID
+    await bot.groups.state(gid).today_page(limit=bot.PAGE_SIZE)
+    await bot.db.staff_page(gid, limit=bot.PAGE_SIZE)
+    await bot.db.month_summary(gid, 1, bot.gmt5_now().strftime("%Y-%m"))
+
+
+asyncio.run(everyday())
+t4 = time.perf_counter()
+scale = 1 << 20 if sys.platform == "darwin" else 1024  # ru_maxrss: bytes on macOS, KB on Linux
+rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+loaded = sorted(m for m in sys.argv[2].split(",") if m in sys.modules)
+
+
+def first_heavy(conn) -> None:
+    day = bot.today_day()
+    bot.write_report(conn, bot.GROUP_ID, day - 30, day, "xlsx", "probe.xlsx")
+    bot.build_analytics(conn, bot.GROUP_ID, day - 30, day, "probe")
+
+
+asyncio.run(bot.db.read(first_heavy))
+t5 = time.perf_counter()
+bot.db.close()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "build_app_ms": (t2 - t1) * 1000,
+    "init_db_ms": (t3 - t2) * 1000,
+    "everyday_ms": (t4 - t3) * 1000,
+    "ready_ms": (t4 - t0) * 1000,
+    "rss_mb": rss_mb,
+    "first_report_ms": (t5 - t4) * 1000,
+    "heavy_loaded": loaded,
+}))
+"""
+
+
+def probe(workdir: str) -> Dict[str, Any]:
+    """One cold start in a fresh interpreter; returns the probe's measurements."""
+    out = subprocess.run([sys.executable, "-c", PROBE, ROOT, ",".join(HEAVY)], cwd=workdir,
+                         capture_output=True, text=True)
+    if out.returncode:
+        raise SystemExit(f"startup probe failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_offenders(workdir: str, top: int) -> List[Dict[str, Any]]:
+    """The `top` slowest modules (cumulative µs) under `python -X importtime -c 'import main'`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import main"],
+                         cwd=workdir, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if m:
+            rows.append({"module": m.group(4), "depth": len(m.group(3)) // 2, "cumulative_us": int(m.group(2))})
+    # only top-level entries of each package, so a parent and its children are not double counted
+    rows = [r for r in rows if r["depth"] <= 1]
+    return sorted(rows, key=lambda r: r["cumulative_us"], reverse=True)[:top]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5, help="cold starts to take the median over")
+    ap.add_argument("--max-import-ms", type=float, default=1000.0, help="fail above this median `import main` time")
+    ap.add_argument("--max-rss-mb", type=float, default=100.0, help="fail above this median peak RSS once ready")
+    ap.add_argument("--importtime", type=int, default=0, metavar="N", help="also list the N slowest imports")
+    ap.add_argument("--out", help="write JSON results to this file")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="exc_startup_")
+    report: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+    try:
+        for _ in range(args.runs):
+            for name in os.listdir(workdir):  # every run starts on an empty database
+                os.remove(os.path.join(workdir, name))
+            report["runs"].append(probe(workdir))
+        if args.importtime:
+            report["import_offenders"] = import_offenders(workdir, args.importtime)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    runs = report["runs"]
+    median = {k: round(statistics.median(r[k] for r in runs), 2) for k in runs[0] if k != "heavy_loaded"}
+    report["median"] = median
+    print(f"{args.runs} cold start(s), medians:")
+    for key, value in median.items():
+        print(f"  {key:<18} {value:>10.2f} {'MB' if key == 'rss_mb' else 'ms'}")
+    for row in report.get("import_offenders", []):
+        print(f"  import {row['module']:<30} {row['cumulative_us'] / 1000:>8.1f} ms")
+
+    failures = []
+    heavy = sorted({m for r in runs for m in r["heavy_loaded"]})
+    if heavy:
+        failures.append(f"report stack loaded before first use: {', '.join(heavy)}")
+    if median["import_ms"] > args.max_import_ms:
+        failures.append(f"import main {median['import_ms']:.0f} ms > {args.max_import_ms:.0f} ms budget")
+    if median["rss_mb"] > args.max_rss_mb:
+        failures.append(f"peak RSS {median['rss_mb']:.1f} MB > {args.max_rss_mb:.1f} MB budget")
+    report["failures"] = failures
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.out}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,108 @@
 import os
 import re
+import csv
+import gzip
 import io
+import shutil
+import asyncio
+import bisect
+import calendar
+import functools
+import itertools
+import secrets
 import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import BrokenExecutor, Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
 
-import pandas as pd
-from telegram import Update, InputFile
-from telegram.constants import ParseMode, ChatMemberStatus
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, Message, Update
+from telegram.constants import ParseMode, ChatMemberStatus, ChatType
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import (
+    Application, BaseRateLimiter, BaseUpdateProcessor, CallbackQueryHandler, ChatMemberHandler, CommandHandler, ContextTypes,
+    MessageHandler, TypeHandler, filters,
+)
+from telegram.request import HTTPXRequest
+
+# The report/analytics stack (pandas, numpy, xlsxwriter, matplotlib and the report worker
+# pool) is imported inside the functions that use it, so startup and everyday commands
+# never load it. bench/bench_startup.py checks this and times the cold start.
 
 # -------------------- CONFIG --------------------
 BOT_TOKEN = ""  # <-- Replace with your bot token
-GROUP_ID = -1003463796946          # <-- main group id where staff operate
-LOG_CHANNEL_ID = -1003395196772    # <-- channel/group id where logs are posted
+GROUP_ID = -1003463796946          # <-- default group: registered on startup, used for commands sent in private chat
+LOG_CHANNEL_ID = -1003395196772    # <-- log channel of the default group and of groups registered with /setup
 BOT_ADMINS = [2119444261, 624102836]  # <-- list of user ids treated as bot admins
+BOT_API_URL = "https://api.telegram.org/bot"        # Bot API base URL (point at a local server for testing)
+BOT_FILE_URL = "https://api.telegram.org/file/bot"  # Bot API file download base URL
+WEBHOOK_URL = ""       # public base URL Telegram posts updates to, e.g. https://bot.example.com (empty = long polling)
+WEBHOOK_LISTEN = "0.0.0.0"  # interface the built-in webhook server binds to
+WEBHOOK_PORT = 8443         # port the built-in webhook server listens on
+WEBHOOK_PATH = "exc-bot"    # URL path of the webhook endpoint
+WEBHOOK_SECRET = ""    # secret token Telegram must send with each update (empty = random per start)
 DB_FILE = "exc_bot.db"
-SHIFT_START = "19:45"  # shift start time (HH:MM)
-SHIFT_END = "23:00"    # shift end time (HH:MM)
+DB_READERS = 4         # number of read connections (WAL lets them run alongside the writer)
+BACKUP_PAGES_PER_STEP = 256  # DB pages copied per SQLite backup step
+BACKUP_DIR = "backups"       # where scheduled backups are kept
+BACKUP_INTERVAL_HOURS = 0    # hours between scheduled backups (0 = disabled)
+BACKUP_KEEP = 7              # scheduled backups kept in BACKUP_DIR (older ones are deleted)
+BACKUP_CHAT_ID = 0           # chat that also receives each scheduled backup (0 = keep on disk only)
+ARCHIVE_DIR = "archive"      # per-month archive files of attendance moved out of the live table
+ARCHIVE_KEEP_MONTHS = 6      # closed months kept in the live table before archival (0 = never archive)
+ARCHIVE_AT = "04:30"         # daily time (GMT+5) at which due months are archived
+SHIFT_START = "19:45"  # default shift start time for new groups (HH:MM)
+SHIFT_END = "23:00"    # default shift end time for new groups (HH:MM; at or before start = ends next day)
+SHIFT_CALENDAR_DAYS = 14  # days ahead (including today) the shift calendar is materialized
+LOG_DIGEST_WINDOW = 5.0  # seconds to batch attendance log entries into one message (0 = one message per event)
+MAX_MESSAGE_LEN = 4096   # Telegram's per-message text limit
+PAGE_SIZE = 20           # rows per page of /staff, /status and /check days (Prev/Next buttons page through)
+ADMIN_CACHE_TTL = 600    # seconds before the group's admin list is fetched again
+ADMIN_CACHE_RETRY = 30   # seconds before a failed admin list fetch is retried (the previous list is used meanwhile)
+ABSENT_SWEEP_DELAY = 30  # minutes after a group's shift end before that day is swept for absences
+ABSENT_SWEEP_INTERVAL = 15  # minutes between absence sweep passes over all groups
+REPORT_CHUNK_ROWS = 5000  # rows fetched from SQLite per batch while exporting /report
+REPORT_WORKERS = 2       # worker processes building /report files
+REPORT_CACHE_DIR = "report_cache"  # finished /report files, reused until their data changes
+REPORT_CACHE_FILES = 50  # cached report files kept (oldest are deleted first)
+ANALYTICS_TOP = 5        # staff listed per ranking in /analytics
+ROSTER_MAX_BYTES = 1_000_000  # largest roster file /roster accepts
+BACKFILL_MAX_DAYS = 366  # longest range /backfill marks in one go
+CONCURRENT_UPDATES = 64  # updates processed at once (each user's updates still run in order)
+WORKERS = 0              # worker processes updates are sharded across by group (0 = handle them all in this process)
+WORKER_STOP_TIMEOUT = 30  # seconds a worker gets to finish its queued updates on shutdown before it is killed
+RATE_GLOBAL_PER_SEC = 30  # outbound messages per second across all chats (0 = unlimited)
+RATE_GROUP_PER_MIN = 20   # outbound messages per minute into one group or channel (0 = unlimited)
+RATE_CHAT_PER_SEC = 1     # outbound messages per second into one private chat (0 = unlimited)
+SEND_MAX_RETRIES = 5      # times a send answered with flood control (429) is requeued before it fails
+HEAVY_CONCURRENCY = 2    # heavy admin commands (/report, /analytics, /backup) allowed to run at once
+METRICS_LISTEN = "127.0.0.1"  # interface the Prometheus metrics endpoint binds to
+METRICS_PORT = 9108      # port serving GET /metrics in Prometheus text format (0 = disabled)
+METRICS_SAMPLES = 5000   # latest handler latencies kept per command for /metrics percentiles
+
+# every setting above; the worker processes of a sharded bot are given these values
+CONFIG_KEYS = (
+    "BOT_TOKEN", "GROUP_ID", "LOG_CHANNEL_ID", "BOT_ADMINS", "BOT_API_URL", "BOT_FILE_URL", "WEBHOOK_URL",
+    "WEBHOOK_LISTEN", "WEBHOOK_PORT", "WEBHOOK_PATH", "WEBHOOK_SECRET", "DB_FILE", "DB_READERS",
+    "BACKUP_PAGES_PER_STEP", "BACKUP_DIR", "BACKUP_INTERVAL_HOURS", "BACKUP_KEEP", "BACKUP_CHAT_ID",
+    "ARCHIVE_DIR", "ARCHIVE_KEEP_MONTHS", "ARCHIVE_AT", "SHIFT_START", "SHIFT_END", "SHIFT_CALENDAR_DAYS",
+    "LOG_DIGEST_WINDOW", "MAX_MESSAGE_LEN", "PAGE_SIZE", "ADMIN_CACHE_TTL", "ADMIN_CACHE_RETRY",
+    "ABSENT_SWEEP_DELAY", "ABSENT_SWEEP_INTERVAL", "REPORT_CHUNK_ROWS", "REPORT_WORKERS", "REPORT_CACHE_DIR",
+    "REPORT_CACHE_FILES", "ANALYTICS_TOP", "ROSTER_MAX_BYTES", "BACKFILL_MAX_DAYS", "CONCURRENT_UPDATES",
+    "WORKERS", "WORKER_STOP_TIMEOUT", "RATE_GLOBAL_PER_SEC", "RATE_GROUP_PER_MIN", "RATE_CHAT_PER_SEC",
+    "SEND_MAX_RETRIES", "HEAVY_CONCURRENCY", "METRICS_LISTEN", "METRICS_PORT", "METRICS_SAMPLES",
+)
 
 # -------------------- TIME HELPERS --------------------
+GMT5 = timezone(timedelta(hours=5))
+
+
 def gmt5_now() -> datetime:
     """Return now adjusted to GMT+5 as timezone-aware datetime."""
     return datetime.now(timezone.utc) + timedelta(hours=5)
@@ -30,53 +113,1996 @@ def today_str() -> str:
     return gmt5_now().strftime("%Y-%m-%d")
 
 
-def hhmm_to_dt(hhmm: str, ref: Optional[datetime] = None) -> datetime:
-    """Convert HH:MM to a datetime on the same day as ref (or now)."""
-    ref_dt = ref or gmt5_now()
-    hh, mm = map(int, hhmm.split(":"))
-    return ref_dt.replace(hour=hh, minute=mm, second=0, microsecond=0)
+def hhmm_to_dt(hhmm: str, ref: Optional[datetime] = None) -> datetime:
+    """Convert HH:MM to a datetime on the same day as ref (or now)."""
+    ref_dt = ref or gmt5_now()
+    hh, mm = map(int, hhmm.split(":"))
+    return ref_dt.replace(hour=hh, minute=mm, second=0, microsecond=0)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def date_to_day(date_s: str) -> int:
+    """Convert YYYY-MM-DD to a day number (days since 1970-01-01), as stored in the DB."""
+    return (datetime.strptime(date_s, "%Y-%m-%d") - EPOCH).days
+
+
+def day_to_date(day: int) -> str:
+    """Convert a stored day number back to YYYY-MM-DD."""
+    return (EPOCH + timedelta(days=day)).strftime("%Y-%m-%d")
+
+
+def today_day() -> int:
+    """Return today's day number in GMT+5."""
+    return date_to_day(today_str())
+
+
+def minute_of_day(dt: datetime) -> int:
+    """Return minutes after midnight for dt, as stored in clock_in/clock_out."""
+    return dt.hour * 60 + dt.minute
+
+
+def day_and_minute(dt: datetime) -> Tuple[int, int]:
+    """Return (day number, minutes after midnight) for a GMT+5 datetime."""
+    return date_to_day(dt.strftime("%Y-%m-%d")), minute_of_day(dt)
+
+
+def hhmm_minutes(hhmm: str) -> int:
+    """Convert HH:MM to minutes after midnight."""
+    hh, mm = map(int, hhmm.split(":"))
+    return hh * 60 + mm
+
+
+def shift_minutes(start: str, end: str) -> Tuple[int, int]:
+    """
+    Return a shift's (start, end) in minutes after midnight of the day it starts on.
+    An end at or before the start means the shift runs past midnight (end > 1440).
+    """
+    s, e = hhmm_minutes(start), hhmm_minutes(end)
+    return s, e + 1440 if e <= s else e
+
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def weekday_of(day: int) -> int:
+    """Weekday (Monday = 0) of a day number; day 0 (1970-01-01) was a Thursday."""
+    return (day + 3) % 7
+
+
+def fmt_minutes(minutes: Optional[int]) -> Optional[str]:
+    """Format stored minutes after midnight as HH:MM, wrapping past midnight (None stays None)."""
+    if minutes is None:
+        return None
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+
+
+def month_bounds(month: str) -> Tuple[str, str]:
+    """Return the first and last date (YYYY-MM-DD) of a YYYY-MM month."""
+    y, m = map(int, month.split("-"))
+    return f"{month}-01", f"{month}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def month_days(month: str) -> Tuple[int, int]:
+    """Return the first and last day number of a YYYY-MM month."""
+    start, end = month_bounds(month)
+    return date_to_day(start), date_to_day(end)
+
+
+def last_closed_day(end_minute: int, delay_minutes: int = 0) -> int:
+    """
+    Return the latest day number (GMT+5) whose shift, ending `end_minute` minutes after
+    that day's midnight (over 1440 for overnight shifts), ended at least delay_minutes ago.
+    """
+    now = gmt5_now() - timedelta(minutes=end_minute + delay_minutes)
+    return date_to_day(now.strftime("%Y-%m-%d"))
+
+
+def last_shift_start() -> datetime:
+    """Return when the current (or, before SHIFT_START, the previous) default shift started (GMT+5)."""
+    now = datetime.now(GMT5)
+    start = hhmm_to_dt(SHIFT_START, now)
+    return start if start <= now else start - timedelta(days=1)
+
+
+def escape_md(t: str) -> str:
+    """Escape Markdown special chars for Telegram messages (v2 style)."""
+    if not t:
+        return ""
+    return re.sub(r'([_\*\[\]\(\)\~\>\#\+\-\=\|\{\}\.\!])', r'\\\1', t)
+
+
+# -------------------- METRICS --------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# metric name -> (label name, Prometheus type, help text)
+METRIC_FAMILIES = {
+    "exc_handler_seconds": ("command", "histogram", "Command handler latency."),
+    "exc_handler_errors_total": ("command", "counter", "Command handlers that raised."),
+    "exc_sql_seconds": ("statement", "histogram", "SQL statement execution time."),
+    "exc_sql_errors_total": ("statement", "counter", "SQL statements that raised."),
+    "exc_api_seconds": ("method", "histogram", "Bot API request latency."),
+    "exc_api_errors_total": ("method", "counter", "Bot API requests that failed or were rejected."),
+    "exc_api_retry_after_total": ("method", "counter", "Bot API requests answered with 429 (retry_after)."),
+    "exc_report_cache_total": ("result", "counter", "Report requests served from cache (hit), built (miss) or joined to a build (shared)."),
+    "exc_send_wait_seconds": ("priority", "histogram", "Time outbound messages waited in the send queue."),
+    "exc_send_requeued_total": ("method", "counter", "Sends requeued after a flood-control (429) answer."),
+}
+
+
+class Histogram:
+    """Latency counts per LATENCY_BUCKETS bucket (last slot is +Inf) plus their sum."""
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+class Metrics:
+    """
+    In-process histograms and counters for command handlers, SQL statements and Bot API
+    calls. Observations arrive from the event loop and the DB threads alike, so every
+    update takes one lock. Handler latencies are also kept as timestamped samples (the
+    latest `samples` per command) for the percentiles /metrics reports.
+    """
+
+    def __init__(self, samples: int) -> None:
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+        self._max_samples = samples
+
+    def observe(self, metric: str, label: str, seconds: float) -> None:
+        with self._lock:
+            hist = self._histograms.get((metric, label))
+            if hist is None:
+                hist = self._histograms[(metric, label)] = Histogram()
+            hist.observe(seconds)
+
+    def inc(self, metric: str, label: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[(metric, label)] = self._counters.get((metric, label), 0) + n
+
+    def sample(self, command: str, seconds: float) -> None:
+        """Keep a handler latency for percentile queries."""
+        with self._lock:
+            samples = self._samples.get(command)
+            if samples is None:
+                samples = self._samples[command] = deque(maxlen=self._max_samples)
+            samples.append((time.time(), seconds))
+
+    def percentiles(self, since: float) -> List[Tuple[str, int, float, float, float]]:
+        """Return (command, count, p50, p95, p99) for handler samples taken at or after `since`."""
+        with self._lock:
+            recent = {cmd: [s for t, s in samples if t >= since] for cmd, samples in self._samples.items()}
+        out = []
+        for cmd, values in sorted(recent.items()):
+            if values:
+                values.sort()
+                out.append((cmd, len(values), _percentile(values, 50), _percentile(values, 95), _percentile(values, 99)))
+        return out
+
+    def total(self, metric: str) -> Tuple[int, float]:
+        """Return (count, sum) of a metric across all labels (sum is 0 for counters)."""
+        with self._lock:
+            if METRIC_FAMILIES[metric][1] == "counter":
+                return sum(v for (m, _), v in self._counters.items() if m == metric), 0.0
+            hists = [h for (m, _), h in self._histograms.items() if m == metric]
+            return sum(sum(h.counts) for h in hists), sum(h.sum for h in hists)
+
+    def render(self) -> str:
+        """Render everything in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {k: (list(h.counts), h.sum) for k, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines: List[str] = []
+        for metric, (label, kind, help_text) in METRIC_FAMILIES.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            if kind == "counter":
+                for (m, value), n in sorted(counters.items()):
+                    if m == metric:
+                        lines.append(f'{metric}{{{label}="{_label_value(value)}"}} {n}')
+                continue
+            for (m, value), (counts, total) in sorted(histograms.items()):
+                if m != metric:
+                    continue
+                lv = _label_value(value)
+                running = 0
+                for le, n in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    running += n
+                    lines.append(f'{metric}_bucket{{{label}="{lv}",le="{le}"}} {running}')
+                lines.append(f'{metric}_sum{{{label}="{lv}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{{label}="{lv}"}} {running}')
+        return "\n".join(lines) + "\n"
+
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics(METRICS_SAMPLES)
+
+
+def _sql_statement(sql: str) -> str:
+    """Label for a SQL statement: its leading keyword (SELECT, INSERT, PRAGMA, ...)."""
+    words = sql.split(None, 1)
+    return words[0].upper() if words else "EMPTY"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that records each statement's execution time in `metrics`."""
+
+    def _timed(self, run: Callable[..., Any], sql: str, *args: Any) -> Any:
+        label = _sql_statement(sql)
+        t0 = time.perf_counter()
+        try:
+            return run(sql, *args)
+        except Exception:
+            metrics.inc("exc_sql_errors_total", label)
+            raise
+        finally:
+            metrics.observe("exc_sql_seconds", label, time.perf_counter() - t0)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "TimedCursor":
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> "TimedCursor":
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str, /) -> "TimedCursor":
+        return self._timed(super().executescript, sql_script)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including conn.execute shortcuts) are TimedCursors."""
+
+    def cursor(self, factory: Callable[..., sqlite3.Cursor] = TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str, /) -> sqlite3.Cursor:
+        return self.cursor().executescript(sql_script)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency, failures and 429 answers per Bot API method."""
+
+    async def do_request(self, url: str, method: str, *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        # API calls are POST .../bot<token>/<method>; GETs are file downloads
+        label = url.rsplit("/", 1)[-1] if method == "POST" else "download"
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrics.inc("exc_api_errors_total", label)
+            raise
+        finally:
+            metrics.observe("exc_api_seconds", label, time.perf_counter() - t0)
+        if code == 429:
+            metrics.inc("exc_api_retry_after_total", label)
+        if code >= 400:
+            metrics.inc("exc_api_errors_total", label)
+        return code, payload
+
+
+def timed(command: str, handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]):
+    """Record the handler's latency (and whether it raised) under `command`."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        t0 = time.perf_counter()
+        try:
+            await handler(update, context)
+        except Exception:
+            metrics.inc("exc_handler_errors_total", command)
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            metrics.observe("exc_handler_seconds", command, elapsed)
+            metrics.sample(command, elapsed)
+
+    return wrapper
+
+
+def command(name: str, handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]) -> CommandHandler:
+    """CommandHandler for /name whose callback is timed into `metrics`."""
+    return CommandHandler(name, timed(name, handler))
+
+
+class MetricsEndpoint:
+    """Minimal HTTP server answering GET /metrics with metrics.render(); anything else is 404."""
+
+    def __init__(self) -> None:
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass  # skip headers
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, ctype, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", metrics.render().encode()
+            else:
+                status, ctype, body = "404 Not Found", "text/plain", b"not found\n"
+            head = f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+metrics_endpoint = MetricsEndpoint()
+
+
+# -------------------- DB SETUP --------------------
+@dataclass
+class RosterDiff:
+    """Staff changes applied by a roster sync: (user_id, name), renames as (user_id, old, new)."""
+
+    added: List[Tuple[int, str]]
+    renamed: List[Tuple[int, str, str]]
+    removed: List[Tuple[int, str]]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.renamed or self.removed)
+
+
+class Database:
+    """
+    Async data-access layer over SQLite.
+    All writes go through one dedicated writer thread and reads run on a small pool of
+    reader threads, each with its own connection. WAL mode lets readers see the last
+    committed state while the writer commits, so no query ever runs on the event loop.
+    Long maintenance jobs (backups) get a thread of their own so they hold up neither.
+    """
+
+    def __init__(self, path: str, readers: int = 4) -> None:
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._maint = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-maint")
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    # ---- connection / execution plumbing ----
+    def _connection(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, factory=TimedConnection)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _run_write(self, fn: Callable[..., Any], args: tuple) -> Any:
+        conn = self._connection()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _run_read(self, fn: Callable[..., Any], args: tuple) -> Any:
+        return fn(self._connection(), *args)
+
+    async def write(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(conn, *args) on the writer thread inside one transaction."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_write, fn, args)
+
+    async def read(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(conn, *args) on a reader thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, fn, args)
+
+    def write_sync(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Blocking variant of write() for use outside the event loop (startup)."""
+        return self._writer.submit(self._run_write, fn, args).result()
+
+    def _snapshot(self, dest: str, pages: int) -> int:
+        """
+        Copy the database to `dest` gzip-compressed with the SQLite backup API, `pages`
+        pages per step. The source connection pins one read snapshot for the whole copy,
+        so concurrent commits neither restart the backup nor wait for it (WAL).
+        Returns the compressed size in bytes.
+        """
+        raw = f"{dest}.tmp"
+        src = sqlite3.connect(self.path, timeout=30)
+        try:
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # starts the read transaction
+            dst = sqlite3.connect(raw)
+            try:
+                src.backup(dst, pages=pages)
+            finally:
+                dst.close()
+            src.rollback()
+        finally:
+            src.close()
+        try:
+            with open(raw, "rb") as f, gzip.open(dest, "wb", compresslevel=6) as out:
+                shutil.copyfileobj(f, out, 1 << 20)
+        finally:
+            os.remove(raw)
+        return os.path.getsize(dest)
+
+    async def backup(self, dest: str, pages: int = BACKUP_PAGES_PER_STEP) -> int:
+        """Write a consistent, gzip-compressed online snapshot to `dest` on the maintenance thread. Returns its size."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._maint, self._snapshot, dest, pages)
+
+    def close(self) -> None:
+        """Wait for pending work and close every connection."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self._maint.shutdown(wait=True)
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+    # ---- groups ----
+    async def load_groups(self) -> List[tuple]:
+        """
+        Return every groups row as
+        (group_id, title, log_channel_id, shift_start, shift_end, absent_swept_through, calendar_through).
+        """
+        return await self.read(
+            lambda conn: conn.execute(
+                """
+                SELECT group_id, title, log_channel_id, shift_start, shift_end, absent_swept_through, calendar_through
+                FROM groups
+                """
+            ).fetchall()
+        )
+
+    async def save_group(self, group_id: int, title: Optional[str], log_channel_id: Optional[int],
+                         shift_start: str, shift_end: str) -> int:
+        """
+        Insert or update a group's configuration (its sweep progress is left alone) and
+        re-plan its shift calendar from today. Returns the calendar's last day.
+        """
+
+        def q(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                """
+                INSERT INTO groups(group_id, title, log_channel_id, shift_start, shift_end)
+                VALUES (?,?,?,?,?)
+                ON CONFLICT(group_id) DO UPDATE SET
+                    title=excluded.title, log_channel_id=excluded.log_channel_id,
+                    shift_start=excluded.shift_start, shift_end=excluded.shift_end
+                """,
+                (group_id, title, log_channel_id, shift_start, shift_end),
+            )
+            return _replan_calendar(conn, group_id)
+
+        return await self.write(q)
+
+    # ---- shift schedules ----
+    async def load_shifts(self) -> List[tuple]:
+        """Return every shift definition as (group_id, user_id, weekday, start_minute, end_minute)."""
+        return await self.read(
+            lambda conn: conn.execute(
+                "SELECT group_id, user_id, weekday, start_minute, end_minute FROM shifts"
+            ).fetchall()
+        )
+
+    async def save_shift(self, group_id: int, user_id: int, weekday: int,
+                         start: Optional[int], end: Optional[int]) -> int:
+        """
+        Define a shift (start/end None = day off) for a staff member (user_id 0 = whole
+        group) on a weekday (-1 = every day), then re-plan the group's calendar from today.
+        Returns the calendar's last day.
+        """
+
+        def q(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                "INSERT OR REPLACE INTO shifts(group_id, user_id, weekday, start_minute, end_minute) VALUES (?,?,?,?,?)",
+                (group_id, user_id, weekday, start, end),
+            )
+            return _replan_calendar(conn, group_id)
+
+        return await self.write(q)
+
+    async def delete_shift(self, group_id: int, user_id: int, weekday: int) -> int:
+        """Remove a shift definition and re-plan the group's calendar from today. Returns the calendar's last day."""
+
+        def q(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                "DELETE FROM shifts WHERE group_id=? AND user_id=? AND weekday=?", (group_id, user_id, weekday)
+            )
+            return _replan_calendar(conn, group_id)
+
+        return await self.write(q)
+
+    async def extend_calendar(self, group_id: int, through: int) -> Optional[int]:
+        """
+        Materialize the group's shift calendar for every day after its last planned day up
+        to `through`. Returns the first day added, or None when nothing was missing.
+        """
+
+        def q(conn: sqlite3.Connection) -> Optional[int]:
+            row = conn.execute("SELECT calendar_through FROM groups WHERE group_id=?", (group_id,)).fetchone()
+            start = row[0] + 1 if row and row[0] is not None else today_day()
+            if start > through:
+                return None
+            _build_calendar(conn, group_id, start, through)
+            conn.execute("UPDATE groups SET calendar_through=? WHERE group_id=?", (through, group_id))
+            return start
+
+        return await self.write(q)
+
+    # ---- staff ----
+    async def staff_name(self, group_id: int, user_id: int) -> Optional[str]:
+        """Return the staff member's name in the group, or None if not registered."""
+
+        def q(conn: sqlite3.Connection) -> Optional[str]:
+            row = conn.execute(
+                "SELECT full_name FROM staff WHERE group_id=? AND user_id=?", (group_id, user_id)
+            ).fetchone()
+            return row[0] if row else None
+
+        return await self.read(q)
+
+    async def staff_page(self, group_id: int, cursor: Optional[int] = None, backward: bool = False,
+                         limit: int = -1) -> Tuple[List[Tuple[int, str]], int]:
+        """
+        Return (up to `limit` of the group's (user_id, full_name) ordered by name, total staff).
+        Keyset paging: the rows after user `cursor` in that order (before it when `backward`),
+        seeking on idx_staff_name; no rows if `cursor` is no longer on staff.
+        """
+
+        def q(conn: sqlite3.Connection) -> Tuple[List[Tuple[int, str]], int]:
+            total = conn.execute("SELECT COUNT(*) FROM staff WHERE group_id=?", (group_id,)).fetchone()[0]
+            if cursor is None:
+                rows = conn.execute(
+                    "SELECT user_id, full_name FROM staff WHERE group_id=? ORDER BY full_name, user_id LIMIT ?",
+                    (group_id, limit),
+                ).fetchall()
+                return rows, total
+            op, order = ("<", "DESC") if backward else (">", "ASC")
+            rows = conn.execute(
+                f"""
+                SELECT user_id, full_name FROM staff
+                WHERE group_id=? AND (full_name, user_id) {op} (SELECT full_name, user_id FROM staff WHERE group_id=? AND user_id=?)
+                ORDER BY full_name {order}, user_id {order} LIMIT ?
+                """,
+                (group_id, group_id, cursor, limit),
+            ).fetchall()
+            return rows[::-1] if backward else rows, total
+
+        return await self.read(q)
+
+    async def add_staff(self, group_id: int, user_id: int, full_name: str) -> None:
+        """Register a staff member and plan their shifts from today."""
+
+        def q(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "INSERT OR REPLACE INTO staff(group_id, user_id, full_name) VALUES (?,?,?)",
+                (group_id, user_id, full_name),
+            )
+            _replan_calendar(conn, group_id, user_id)
+
+        await self.write(q)
+
+    async def remove_staff(self, group_id: int, user_id: int) -> None:
+        """Remove a staff member and their planned shifts from today; past days keep their plan."""
+
+        def q(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM staff WHERE group_id=? AND user_id=?", (group_id, user_id))
+            conn.execute(
+                "DELETE FROM shift_calendar WHERE group_id=? AND user_id=? AND day>=?",
+                (group_id, user_id, today_day()),
+            )
+
+        await self.write(q)
+
+    async def sync_staff(self, group_id: int, roster: Dict[int, str], remove: bool = True) -> RosterDiff:
+        """
+        Make the group's staff match `roster` ({user_id: full_name}) in one transaction:
+        new ids are added, changed names renamed and, when `remove`, staff missing from
+        `roster` deleted; the shift calendar is replanned once if the roster changed.
+        Returns the applied diff.
+        """
+
+        def q(conn: sqlite3.Connection) -> RosterDiff:
+            current = dict(conn.execute("SELECT user_id, full_name FROM staff WHERE group_id=?", (group_id,)))
+            diff = RosterDiff(
+                added=[(uid, name) for uid, name in roster.items() if uid not in current],
+                renamed=[(uid, current[uid], name) for uid, name in roster.items()
+                         if uid in current and current[uid] != name],
+                removed=[(uid, name) for uid, name in current.items() if remove and uid not in roster],
+            )
+            conn.executemany(
+                "INSERT INTO staff(group_id, user_id, full_name) VALUES (?,?,?)",
+                [(group_id, uid, name) for uid, name in diff.added],
+            )
+            conn.executemany(
+                "UPDATE staff SET full_name=? WHERE group_id=? AND user_id=?",
+                [(name, group_id, uid) for uid, _, name in diff.renamed],
+            )
+            conn.executemany(
+                "DELETE FROM staff WHERE group_id=? AND user_id=?",
+                [(group_id, uid) for uid, _ in diff.removed],
+            )
+            if diff.added or diff.removed:
+                _replan_calendar(conn, group_id)
+            return diff
+
+        return await self.write(q)
+
+    # ---- attendance ----
+    # Dates are stored as day numbers (days since 1970-01-01 on the GMT+5 calendar) and
+    # clock times as minutes after local midnight of that day, so range filters are plain
+    # BETWEEN scans on integer index keys and worked time is clock_out - clock_in.
+    # Every query is scoped to one group; (group_id, day) and (group_id, user_id, day)
+    # are the leading index keys, so a group's queries never scan other groups' rows.
+    async def load_day(self, group_id: int, day: int) -> Tuple[List[Tuple[int, str]], List[tuple], List[tuple]]:
+        """
+        Return the group's staff roster plus the attendance and planned shifts of `day` and
+        the day before (whose overnight shifts may still be running) in a single read:
+        ([(user_id, full_name)],
+         [(user_id, day, full_name, clock_in, clock_out, status, late, overtime)],
+         [(user_id, day, start_minute, end_minute)]).
+        """
+
+        def q(conn: sqlite3.Connection) -> Tuple[List[Tuple[int, str]], List[tuple], List[tuple]]:
+            staff = conn.execute("SELECT user_id, full_name FROM staff WHERE group_id=?", (group_id,)).fetchall()
+            rows = conn.execute(
+                """
+                SELECT user_id, day, full_name, clock_in, clock_out, status, late_minutes, overtime_minutes
+                FROM attendance
+                WHERE group_id=? AND day BETWEEN ? AND ?
+                """,
+                (group_id, day - 1, day),
+            ).fetchall()
+            shifts = conn.execute(
+                """
+                SELECT user_id, day, start_minute, end_minute
+                FROM shift_calendar
+                WHERE group_id=? AND day BETWEEN ? AND ?
+                """,
+                (group_id, day - 1, day),
+            ).fetchall()
+            return staff, rows, shifts
+
+        return await self.read(q)
+
+    # Writes append an event and return the day's projected attendance row
+    # (full_name, clock_in, clock_out, status, late_minutes, overtime_minutes), None = no record.
+    async def clock_in(self, group_id: int, user_id: int, full_name: str, day: int, minute: int,
+                       late_minutes: int) -> Optional[tuple]:
+        return await self.write(
+            lambda conn: _append(conn, group_id, user_id, day, "clockin", user_id,
+                                 full_name=full_name, clock_in=minute, late_minutes=late_minutes)
+        )
+
+    async def clock_out(self, group_id: int, user_id: int, day: int, minute: int, overtime_minutes: int) -> Optional[tuple]:
+        return await self.write(
+            lambda conn: _append(conn, group_id, user_id, day, "clockout", user_id,
+                                 clock_out=minute, overtime_minutes=overtime_minutes)
+        )
+
+    async def mark_day(self, group_id: int, user_id: int, full_name: str, day: int, status: str) -> Optional[tuple]:
+        """Mark a whole day as `status` (Sick/Off), clearing clock times."""
+        return await self.write(lambda conn: _append(conn, group_id, user_id, day, status.lower(), user_id, full_name=full_name))
+
+    async def undo_clock_out(self, group_id: int, user_id: int, day: int,
+                             actor: Optional[int] = None) -> Tuple[bool, Optional[tuple]]:
+        """
+        Cancel the user's latest clock-out of `day` that is not undone yet; the day is refolded
+        without it. Rows imported from before the event store carry no clock-out event, so for
+        them the undo clears the clock-out as recorded. Returns (whether anything was undone, row).
+        """
+
+        def q(conn: sqlite3.Connection) -> Tuple[bool, Optional[tuple]]:
+            if day <= _archived_through(conn):
+                return False, None
+            target = conn.execute(
+                """
+                SELECT seq FROM events e
+                WHERE group_id=? AND user_id=? AND day=? AND kind='clockout'
+                  AND NOT EXISTS (SELECT 1 FROM events u WHERE u.group_id=e.group_id AND u.user_id=e.user_id
+                                  AND u.day=e.day AND u.kind='undone' AND u.ref=e.seq)
+                ORDER BY seq DESC LIMIT 1
+                """,
+                (group_id, user_id, day),
+            ).fetchone()
+            if target is None:
+                row = conn.execute(
+                    "SELECT clock_out FROM attendance WHERE group_id=? AND user_id=? AND day=?", (group_id, user_id, day)
+                ).fetchone()
+                if row is None or row[0] is None:
+                    return False, None
+            return True, _append(conn, group_id, user_id, day, "undone", actor, ref=target[0] if target else None)
+
+        return await self.write(q)
+
+    async def mark_absent(self, group_id: int, start: int, end: int, actor: Optional[int] = None) -> int:
+        """
+        Record an absence for every (staff, day) pair of the group in [start, end] that has
+        no row, in one INSERT…SELECT. Returns the number of absences recorded.
+        """
+        return await self.write(_mark_absent, group_id, start, end, actor)
+
+    async def absent_sweep(self, group_id: int, through: int) -> Tuple[Optional[int], int]:
+        """
+        Mark the group's absences for every day after its last sweep up to `through`
+        (inclusive) and remember how far we got, so days missed during downtime are
+        backfilled. Returns (first day swept or None, rows inserted).
+        """
+
+        def q(conn: sqlite3.Connection) -> Tuple[Optional[int], int]:
+            row = conn.execute("SELECT absent_swept_through FROM groups WHERE group_id=?", (group_id,)).fetchone()
+            start = row[0] + 1 if row and row[0] is not None else through
+            if start > through:
+                return None, 0
+            n = _mark_absent(conn, group_id, start, through)
+            conn.execute("UPDATE groups SET absent_swept_through=? WHERE group_id=?", (through, group_id))
+            return start, n
+
+        return await self.write(q)
+
+    async def month_summary(self, group_id: int, user_id: int, month: str) -> Optional[tuple]:
+        """
+        Return precomputed (late, overtime, worked_minutes, days, absent, sick, off) totals
+        for a YYYY-MM month, or None when the user has no rows that month.
+        """
+        return await self.read(
+            lambda conn: conn.execute(
+                """
+                SELECT late_minutes, overtime_minutes, worked_minutes, days, absent_days, sick_days, off_days
+                FROM monthly_summary
+                WHERE group_id=? AND user_id=? AND month=? AND days > 0
+                """,
+                (group_id, user_id, month),
+            ).fetchone()
+        )
+
+    async def month_expected(self, group_id: int, user_id: int, month: str, through: int) -> int:
+        """Return the planned shift minutes for a YYYY-MM month, counting days up to `through`."""
+        start, end = month_days(month)
+
+        def q(conn: sqlite3.Connection) -> int:
+            total = 0
+            for schema, lo, hi in _day_parts(conn, start, min(end, through)):
+                total += conn.execute(
+                    f"""
+                    SELECT COALESCE(SUM(end_minute - start_minute), 0)
+                    FROM {schema}.shift_calendar
+                    WHERE group_id=? AND user_id=? AND day BETWEEN ? AND ?
+                    """,
+                    (group_id, user_id, lo, hi),
+                ).fetchone()[0]
+            return total
+
+        return await self.read(q)
+
+    async def month_attendance(self, group_id: int, user_id: int, month: str, cursor: Optional[int] = None,
+                               backward: bool = False, limit: int = -1) -> List[tuple]:
+        """
+        Return (day, clock_in, clock_out, status, late, overtime) rows for a YYYY-MM month by day.
+        Keyset paging: at most `limit` rows, after day `cursor` (before it when `backward`).
+        """
+        start, end = month_days(month)
+        if cursor is not None:
+            start, end = (start, cursor - 1) if backward else (cursor + 1, end)
+        order = "DESC" if backward else "ASC"
+
+        def q(conn: sqlite3.Connection) -> List[tuple]:
+            rows: List[tuple] = []
+            for schema, lo, hi in _day_parts(conn, start, end):
+                rows += conn.execute(
+                    f"""
+                    SELECT day, clock_in, clock_out, status, late_minutes, overtime_minutes
+                    FROM {schema}.attendance
+                    WHERE group_id=? AND user_id=? AND day BETWEEN ? AND ?
+                    ORDER BY day {order} LIMIT ?
+                    """,
+                    (group_id, user_id, lo, hi, limit),
+                ).fetchall()
+            rows.sort()
+            if limit >= 0:
+                rows = rows[-limit:] if backward else rows[:limit]
+            return rows
+
+        return await self.read(q)
+
+    async def export_report(self, group_id: int, start: int, end: int, fmt: str, path: str) -> int:
+        """Stream the group's attendance rows for days [start, end] into a report file at `path`. Returns the row count."""
+        return await self.read(write_report, group_id, start, end, fmt, path)
+
+    async def analytics(self, group_id: int, start: int, end: int, label: str,
+                        chart_path: Optional[str] = None) -> Tuple[Optional[str], bool]:
+        """Compute the group's /analytics summary for days [start, end] on a reader thread (see build_analytics)."""
+        return await self.read(build_analytics, group_id, start, end, label, chart_path)
+
+    async def reset_all(self, group_id: int, actor: Optional[int] = None) -> None:
+        """
+        Clear all of the group's attendance: every row, live or archived, gets a 'reset'
+        event in the events table next to it and is deleted; monthly totals are dropped.
+        The live table and totals go in one transaction, then each archive file in its own
+        (ATTACH cannot run inside a transaction). If a file fails, earlier ones stay reset
+        and later ones keep their rows; running the reset again finishes the job.
+        """
+
+        def q(conn: sqlite3.Connection) -> None:
+            _reset_rows(conn, group_id, actor, "1", ())
+            conn.execute("DELETE FROM monthly_summary WHERE group_id=?", (group_id,))
+            conn.commit()
+            at = int(time.time())
+            for path in archive_files():
+                _attach(conn, path)
+                try:
+                    if not _has_table(conn, "arc", "events"):  # archived before events existed
+                        conn.execute("CREATE TABLE arc.events AS SELECT * FROM main.events WHERE 0")
+                        conn.execute("CREATE INDEX arc.idx_events_key ON events(group_id, user_id, day, seq)")
+                    # arc.events has no rowid alias, so number the new events past every seq in use
+                    base = conn.execute(
+                        "SELECT MAX(COALESCE((SELECT MAX(seq) FROM main.events), 0), COALESCE((SELECT MAX(seq) FROM arc.events), 0))"
+                    ).fetchone()[0]
+                    conn.execute(
+                        """
+                        INSERT INTO arc.events(seq, group_id, user_id, day, kind, actor, at)
+                        SELECT ? + ROW_NUMBER() OVER (ORDER BY day, user_id), group_id, user_id, day, 'reset', ?, ?
+                        FROM arc.attendance WHERE group_id=?
+                        """,
+                        (base, actor, at, group_id),
+                    )
+                    conn.execute("DELETE FROM arc.attendance WHERE group_id=?", (group_id,))
+                    conn.execute("DELETE FROM arc.shift_calendar WHERE group_id=?", (group_id,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE arc")
+
+        await self.write(q)
+
+    # ---- archival ----
+    def _archive_month(self, month: str) -> int:
+        """
+        Move every group's attendance, shift_calendar and events rows of a YYYY-MM month into
+        its archive file. The file is built next to its final name and renamed into place,
+        then one transaction deletes the live rows and advances archived_through, so
+        readers see each month in exactly one place. Returns the number of rows moved.
+        """
+        conn = self._connection()
+        start, end = month_days(month)
+        path = archive_path(month)
+        tmp = f"{path}.tmp"
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _attach(conn, tmp)
+        try:
+            conn.execute(
+                "CREATE TABLE arc.attendance AS SELECT * FROM main.attendance WHERE day BETWEEN ? AND ? ORDER BY group_id, day",
+                (start, end),
+            )
+            conn.execute("CREATE INDEX arc.idx_att_group_day ON attendance(group_id, day)")
+            conn.execute(
+                """
+                CREATE TABLE arc.shift_calendar AS SELECT * FROM main.shift_calendar
+                WHERE day BETWEEN ? AND ? ORDER BY group_id, user_id, day
+                """,
+                (start, end),
+            )
+            conn.execute("CREATE UNIQUE INDEX arc.idx_cal_key ON shift_calendar(group_id, user_id, day)")
+            conn.execute(
+                "CREATE TABLE arc.events AS SELECT * FROM main.events WHERE day BETWEEN ? AND ? ORDER BY seq",
+                (start, end),
+            )
+            conn.execute("CREATE INDEX arc.idx_events_key ON events(group_id, user_id, day, seq)")
+            conn.commit()
+        finally:
+            conn.execute("DETACH DATABASE arc")
+        os.replace(tmp, path)
+        try:
+            totals = conn.execute("SELECT * FROM monthly_summary WHERE month=?", (month,)).fetchall()
+            n = conn.execute("DELETE FROM attendance WHERE day BETWEEN ? AND ?", (start, end)).rowcount
+            conn.execute("DELETE FROM shift_calendar WHERE day BETWEEN ? AND ?", (start, end))
+            conn.execute("DELETE FROM events WHERE day BETWEEN ? AND ?", (start, end))
+            # the delete triggers took these rows out of monthly_summary; archived months keep their totals
+            if totals:
+                marks = ",".join("?" * len(totals[0]))
+                conn.executemany(f"INSERT OR REPLACE INTO monthly_summary VALUES ({marks})", totals)
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('archived_through', ?)", (str(end),))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return n
+
+    async def archive_before(self, cutoff: int) -> List[Tuple[str, int]]:
+        """
+        Archive every not yet archived month that ends on or before day `cutoff`, oldest
+        first, one writer job per month. Returns [(month, rows moved)].
+        """
+
+        def first_live(conn: sqlite3.Connection) -> Optional[int]:
+            return conn.execute("SELECT MIN(day) FROM attendance").fetchone()[0]
+
+        first = await self.read(first_live)
+        if first is None:
+            return []
+        loop = asyncio.get_running_loop()
+        done = []
+        month = day_to_date(first)[:7]
+        while month_days(month)[1] <= cutoff:
+            n = await loop.run_in_executor(self._writer, self._archive_month, month)
+            done.append((month, n))
+            month = day_to_date(month_days(month)[1] + 1)[:7]
+        return done
+
+    async def reset_day(self, group_id: int, day: int, actor: Optional[int] = None) -> int:
+        """Clear the group's attendance of `day` (one 'reset' event per row). Returns the rows cleared."""
+        return await self.write(_reset_rows, group_id, actor, "day = ?", (day,))
+
+    # ---- event store ----
+    async def history(self, group_id: int, user_id: int, day: int) -> List[tuple]:
+        """
+        The user's events of `day`, oldest first, from the live log or the day's archive file:
+        [(seq, kind, full_name, clock_in, clock_out, status, late, overtime, ref, actor, at)].
+        """
+
+        def q(conn: sqlite3.Connection) -> List[tuple]:
+            rows: List[tuple] = []
+            for schema, _, _ in _day_parts(conn, day, day):
+                if _has_table(conn, schema, "events"):
+                    rows += conn.execute(
+                        f"""
+                        SELECT {_EVENT_COLUMNS}, actor, at FROM {schema}.events
+                        WHERE group_id=? AND user_id=? AND day=? ORDER BY seq
+                        """,
+                        (group_id, user_id, day),
+                    ).fetchall()
+            return rows
+
+        return await self.read(q)
+
+    async def rebuild_attendance(self, group_id: int) -> Tuple[int, int]:
+        """
+        Rebuild the group's live attendance projection by replaying its events (archived
+        months stay as their snapshot). Returns (rows rebuilt, rows that had drifted).
+        """
+
+        def q(conn: sqlite3.Connection) -> Tuple[int, int]:
+            start = _archived_through(conn) + 1
+            before = {
+                r[:3]: r[3:] for r in conn.execute(
+                    f"SELECT group_id, user_id, day, {_ATTENDANCE_ROW} FROM attendance WHERE group_id=? AND day>=?",
+                    (group_id, start),
+                )
+            }
+            rows = list(_replay(conn, group_id, start))
+            drifted = len(before.keys() ^ {r[:3] for r in rows}) + sum(
+                1 for r in rows if r[:3] in before and before[r[:3]] != r[3:]
+            )
+            if drifted:
+                conn.execute("DELETE FROM attendance WHERE group_id=? AND day>=?", (group_id, start))
+                conn.executemany(
+                    f"INSERT INTO attendance(group_id, user_id, day, {_ATTENDANCE_ROW}) VALUES (?,?,?,?,?,?,?,?,?)", rows
+                )
+            return len(rows), drifted
+
+        return await self.write(q)
+
+
+db = Database(DB_FILE, readers=DB_READERS)
+
+
+# -------------------- ARCHIVE --------------------
+# Closed months move out of the live attendance table into one SQLite file per month
+# (ARCHIVE_DIR/attendance-YYYY-MM.db, holding that month's attendance, shift_calendar and
+# events rows of every group). meta.archived_through is the last archived day: days up to it
+# are read from the archive files, later days from the live table.
+def archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"attendance-{month}.db")
+
+
+def archive_files() -> List[str]:
+    """Paths of every archive file, oldest month first."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    names = sorted(n for n in os.listdir(ARCHIVE_DIR) if n.startswith("attendance-") and n.endswith(".db"))
+    return [os.path.join(ARCHIVE_DIR, n) for n in names]
+
+
+def archive_cutoff(keep_months: int) -> int:
+    """Last day of the newest month to archive: everything before the current month and `keep_months` closed ones."""
+    y, m = map(int, gmt5_now().strftime("%Y-%m").split("-"))
+    y, m = divmod(y * 12 + m - 1 - keep_months, 12)
+    return date_to_day(f"{y:04d}-{m + 1:02d}-01") - 1
+
+
+def _archived_through(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM meta WHERE key='archived_through'").fetchone()
+    return int(row[0]) if row else -1
+
+
+def _has_table(conn: sqlite3.Connection, schema: str, table: str) -> bool:
+    """Whether `schema` has `table` (archive files written before a table existed lack it)."""
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def _attach(conn: sqlite3.Connection, path: str) -> None:
+    conn.execute("ATTACH DATABASE ? AS arc", (path,))
+
+
+def _day_parts(conn: sqlite3.Connection, start: int, end: int) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yield (schema, first, last) pieces covering days [start, end]: each archived month
+    that has a file, attached as `arc` only while its piece is being read, then the rest
+    from the live `main` tables. Consume each piece's query before asking for the next.
+    """
+    through = _archived_through(conn)
+    day = start
+    while day <= min(end, through):
+        month = day_to_date(day)[:7]
+        last = month_days(month)[1]
+        path = archive_path(month)
+        if os.path.exists(path):
+            _attach(conn, path)
+            try:
+                yield "arc", day, min(end, last)
+            finally:
+                conn.execute("DETACH DATABASE arc")
+        day = last + 1
+    if end > through:
+        yield "main", max(start, through + 1), end
+
+
+def _mark_absent(conn: sqlite3.Connection, group_id: int, start: int, end: int,
+                 actor: Optional[int] = None) -> int:
+    """
+    Record an 'absent' event for every (staff, day) pair of the group in [start, end] that
+    has no attendance row and no day off planned, and project them, set-based (an absence
+    only ever fills an empty day, so no per-row replay is needed). Returns the count.
+    """
+    start = max(start, _archived_through(conn) + 1)  # archived months are closed
+    if start > end:
+        return 0
+    before = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+    n = conn.execute(
+        """
+        INSERT INTO events(group_id, user_id, day, kind, full_name, actor, at)
+        WITH RECURSIVE days(d) AS (
+            SELECT ?
+            UNION ALL
+            SELECT d + 1 FROM days WHERE d < ?
+        )
+        SELECT s.group_id, s.user_id, days.d, 'absent', s.full_name, ?, ?
+        FROM staff s CROSS JOIN days
+        WHERE s.group_id = ?
+          AND NOT EXISTS (
+              SELECT 1 FROM attendance a WHERE a.group_id = s.group_id AND a.user_id = s.user_id AND a.day = days.d
+          )
+          AND NOT EXISTS (
+              SELECT 1 FROM shift_calendar c
+              WHERE c.group_id = s.group_id AND c.user_id = s.user_id AND c.day = days.d AND c.start_minute IS NULL
+          )
+        """,
+        (start, end, actor, int(time.time()), group_id),
+    ).rowcount
+    if n:
+        conn.execute(
+            """
+            INSERT INTO attendance(group_id, user_id, full_name, day, status)
+            SELECT group_id, user_id, full_name, day, 'Absent' FROM events WHERE seq > ?
+            """,
+            (before,),
+        )
+    return n
+
+
+def _sql_shift_end(start: str, end: str) -> str:
+    """SQL for a shift's end in minutes after its start day's midnight (past 1440 when it ends next day)."""
+    s, e = _sql_minutes(start), _sql_minutes(end)
+    return f"(CASE WHEN {e} <= {s} THEN {e} + 1440 ELSE {e} END)"
+
+
+def _build_calendar(conn: sqlite3.Connection, group_id: int, start: int, end: int,
+                    user_id: Optional[int] = None) -> None:
+    """
+    Materialize the group's shift_calendar for days [start, end] (only user_id's rows, if
+    given): one row per roster member for days from today on, plus one per attendance row
+    in the range. Each gets the most specific definition in `shifts` (the user's for that
+    weekday, the user's for every day, the group's for that weekday, the group's for
+    every day), falling back to the shift times on the groups row.
+    """
+    params = {"gid": group_id, "start": start, "end": end, "today": today_day(), "uid": user_id}
+    conn.execute(
+        """
+        DELETE FROM shift_calendar
+        WHERE group_id = :gid AND day BETWEEN :start AND :end AND (:uid IS NULL OR user_id = :uid)
+        """,
+        params,
+    )
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO shift_calendar(group_id, user_id, day, start_minute, end_minute)
+        WITH RECURSIVE days(d) AS (
+            SELECT :start
+            UNION ALL
+            SELECT d + 1 FROM days WHERE d < :end
+        ),
+        people(user_id, day) AS (
+            SELECT s.user_id, days.d FROM staff s CROSS JOIN days
+            WHERE s.group_id = :gid AND days.d >= :today AND (:uid IS NULL OR s.user_id = :uid)
+            UNION
+            SELECT user_id, day FROM attendance
+            WHERE group_id = :gid AND day BETWEEN :start AND :end AND (:uid IS NULL OR user_id = :uid)
+        )
+        SELECT g.group_id, p.user_id, p.day,
+               CASE WHEN sh.rowid IS NULL THEN {_sql_minutes("g.shift_start")} ELSE sh.start_minute END,
+               CASE WHEN sh.rowid IS NULL THEN {_sql_shift_end("g.shift_start", "g.shift_end")} ELSE sh.end_minute END
+        FROM people p
+        JOIN groups g ON g.group_id = :gid
+        LEFT JOIN shifts sh ON sh.rowid = (
+            SELECT rowid FROM shifts
+            WHERE group_id = :gid AND user_id IN (0, p.user_id) AND weekday IN (-1, (p.day + 3) % 7)
+            ORDER BY user_id = 0, weekday = -1
+            LIMIT 1
+        )
+        """,
+        params,
+    )
+
+
+def _replan_calendar(conn: sqlite3.Connection, group_id: int, user_id: Optional[int] = None) -> int:
+    """
+    Rebuild the group's shift calendar (only user_id's rows, if given) from today, or from
+    the first unplanned day if that is earlier, through at least SHIFT_CALENDAR_DAYS ahead.
+    Days before today keep the plan they had. Returns the calendar's last day.
+    """
+    today = today_day()
+    row = conn.execute("SELECT calendar_through FROM groups WHERE group_id=?", (group_id,)).fetchone()
+    planned = row[0] if row and row[0] is not None else None
+    start = today if planned is None else min(today, planned + 1)
+    through = max(planned or 0, today + SHIFT_CALENDAR_DAYS - 1)
+    _build_calendar(conn, group_id, start, through, user_id)
+    conn.execute("UPDATE groups SET calendar_through=? WHERE group_id=?", (through, group_id))
+    return through
+
+
+# -------------------- ATTENDANCE EVENTS --------------------
+# Attendance is event-sourced: every change (a clock-in, a sick day, an admin's undo or
+# reset...) is appended to `events` and never rewritten, and the `attendance` table is a
+# projection of them, folded per (group, user, day) in the same transaction as the append.
+# Closed months are frozen in their archive files (the snapshot, events included); the
+# live days can be rebuilt from their events at any time (Database.rebuild_attendance).
+#
+# kinds: import (a row as it stood when the event store was introduced), clockin,
+# clockout, sick, off, absent, undone (cancels the clockout in `ref`; with no ref, it
+# clears whatever clock-out the row has), reset (clears the day).
+_EVENT_COLUMNS = "seq, kind, full_name, clock_in, clock_out, status, late_minutes, overtime_minutes, ref"
+_ATTENDANCE_ROW = "full_name, clock_in, clock_out, status, late_minutes, overtime_minutes"
+
+
+def fold_events(events: List[tuple]) -> Optional[tuple]:
+    """
+    Replay one (group, user, day)'s events (_EVENT_COLUMNS tuples, oldest first) into its
+    attendance row (full_name, clock_in, clock_out, status, late_minutes, overtime_minutes),
+    or None when the day has no record. Undone clock-outs are skipped as if they never
+    happened, so an undo restores exactly the state before the clock-out.
+    """
+    cancelled = {e[8] for e in events if e[1] == "undone" and e[8] is not None}
+    row: Optional[list] = None
+    for seq, kind, name, clock_in, clock_out, status, late, overtime, ref in events:
+        if seq in cancelled:
+            continue
+        if kind == "import":
+            row = [name, clock_in, clock_out, status, late, overtime]
+        elif kind == "clockin":
+            row = row or [name, None, None, None, 0, 0]
+            row[1], row[3], row[4] = clock_in, "Clocked In", late
+        elif kind == "clockout":
+            if row:
+                row[2], row[3], row[5] = clock_out, "Clocked Out", overtime
+        elif kind in ("sick", "off"):
+            row = [row[0] if row else name, None, None, kind.capitalize(), 0, 0]
+        elif kind == "absent":
+            row = row or [name, None, None, "Absent", 0, 0]
+        elif kind == "undone":
+            if row and ref is None and row[2] is not None:
+                row[2], row[3], row[5] = None, "Clocked In", 0
+        elif kind == "reset":
+            row = None
+    return tuple(row) if row else None
+
+
+def _project(conn: sqlite3.Connection, group_id: int, user_id: int, day: int) -> Optional[tuple]:
+    """Refold one (group, user, day) from its events into `attendance`; returns the row (None = no record)."""
+    key = (group_id, user_id, day)
+    events = conn.execute(
+        f"SELECT {_EVENT_COLUMNS} FROM events WHERE group_id=? AND user_id=? AND day=? ORDER BY seq", key
+    ).fetchall()
+    row = fold_events(events)
+    current = conn.execute(
+        f"SELECT {_ATTENDANCE_ROW} FROM attendance WHERE group_id=? AND user_id=? AND day=?", key
+    ).fetchone()
+    if row == current:
+        return row  # unchanged: leave monthly_summary and the report cache version alone
+    if row is None:
+        conn.execute("DELETE FROM attendance WHERE group_id=? AND user_id=? AND day=?", key)
+    else:
+        conn.execute(
+            f"""
+            INSERT INTO attendance(group_id, user_id, day, {_ATTENDANCE_ROW}) VALUES (?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(group_id, user_id, day) DO UPDATE SET
+                full_name=excluded.full_name, clock_in=excluded.clock_in, clock_out=excluded.clock_out,
+                status=excluded.status, late_minutes=excluded.late_minutes, overtime_minutes=excluded.overtime_minutes
+            """,
+            key + row,
+        )
+    return row
+
+
+def _append(conn: sqlite3.Connection, group_id: int, user_id: int, day: int, kind: str,
+            actor: Optional[int] = None, **fields: Any) -> Optional[tuple]:
+    """Append one event (extra columns in `fields`) and project its day; returns the new attendance row."""
+    cols = ["group_id", "user_id", "day", "kind", "actor", "at", *fields]
+    conn.execute(
+        f"INSERT INTO events({', '.join(cols)}) VALUES ({','.join('?' * len(cols))})",
+        (group_id, user_id, day, kind, actor, int(time.time()), *fields.values()),
+    )
+    return _project(conn, group_id, user_id, day)
+
+
+def _reset_rows(conn: sqlite3.Connection, group_id: int, actor: Optional[int], where: str, params: tuple) -> int:
+    """Append a 'reset' event for every live attendance row of the group matching `where`, then clear them."""
+    conn.execute(
+        f"""
+        INSERT INTO events(group_id, user_id, day, kind, actor, at)
+        SELECT group_id, user_id, day, 'reset', ?, ? FROM attendance WHERE group_id = ? AND {where}
+        """,
+        (actor, int(time.time()), group_id, *params),
+    )
+    return conn.execute(f"DELETE FROM attendance WHERE group_id = ? AND {where}", (group_id, *params)).rowcount
+
+
+def _replay(conn: sqlite3.Connection, group_id: int, start: int) -> Iterator[tuple]:
+    """Attendance rows (group_id, user_id, day, *row) folded from the group's events from `start` on."""
+    cur = conn.execute(
+        f"SELECT user_id, day, {_EVENT_COLUMNS} FROM events WHERE group_id=? AND day>=? ORDER BY user_id, day, seq",
+        (group_id, start),
+    )
+    key, batch = None, []
+    for user_id, day, *event in itertools.chain(cur, [(None, None)]):
+        if (user_id, day) != key:
+            row = fold_events(batch) if batch else None
+            if row is not None:
+                yield (group_id, *key, *row)
+            key, batch = (user_id, day), []
+        if user_id is not None:
+            batch.append(tuple(event))
+
+
+# -------------------- SCHEMA / MIGRATIONS --------------------
+def _migrate_v1(conn: sqlite3.Connection) -> None:
+    """Baseline schema (TEXT date/clock columns); a no-op on databases that predate versioning."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS staff(
+            user_id INTEGER PRIMARY KEY,
+            full_name TEXT
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS attendance(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            full_name TEXT,
+            date TEXT,
+            clock_in TEXT,
+            clock_out TEXT,
+            status TEXT,
+            late_minutes INTEGER DEFAULT 0,
+            overtime_minutes INTEGER DEFAULT 0,
+            UNIQUE(user_id,date)
+        )
+    """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_att_user_date ON attendance(user_id,date)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS meta(
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """
+    )
+
+
+def _sql_minutes(col: str) -> str:
+    """SQL converting an 'HH:MM' TEXT column to minutes after midnight (NULL stays NULL)."""
+    return f"(CAST(substr({col}, 1, 2) AS INTEGER) * 60 + CAST(substr({col}, 4, 2) AS INTEGER))"
+
+
+def _migrate_v2(conn: sqlite3.Connection) -> None:
+    """
+    Integer columns: `date` TEXT becomes `day` (days since 1970-01-01) and clock_in/clock_out
+    become minutes after midnight of that day. The (user_id, day) unique index and a
+    day index serve every range query; monthly_summary is rebuilt on the new columns.
+    """
+    conn.execute(
+        """
+        CREATE TABLE attendance_v2(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            full_name TEXT,
+            day INTEGER NOT NULL,
+            clock_in INTEGER,
+            clock_out INTEGER,
+            status TEXT,
+            late_minutes INTEGER DEFAULT 0,
+            overtime_minutes INTEGER DEFAULT 0,
+            UNIQUE(user_id,day)
+        )
+    """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO attendance_v2(id, user_id, full_name, day, clock_in, clock_out, status, late_minutes, overtime_minutes)
+        SELECT id, user_id, full_name,
+               CAST(julianday(date) - 2440587.5 AS INTEGER),
+               {_sql_minutes("clock_in")}, {_sql_minutes("clock_out")},
+               status, late_minutes, overtime_minutes
+        FROM attendance
+        WHERE date IS NOT NULL
+        """
+    )
+    for trg in ("trg_summary_ins", "trg_summary_del", "trg_summary_upd"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trg}")
+    conn.execute("DROP TABLE IF EXISTS monthly_summary")
+    conn.execute("DROP TABLE attendance")
+    conn.execute("ALTER TABLE attendance_v2 RENAME TO attendance")
+    conn.execute("CREATE INDEX idx_att_day ON attendance(day)")
+    _create_monthly_summary(conn, ("user_id",))
+
+
+def _migrate_v3(conn: sqlite3.Connection) -> None:
+    """
+    Multi-group: a `groups` table holds each group's log channel, shift times and absence
+    sweep progress, and staff, attendance and monthly_summary are keyed by group_id.
+    Existing rows belong to GROUP_ID, which is registered with the configured settings.
+    """
+    conn.execute(
+        """
+        CREATE TABLE groups(
+            group_id INTEGER PRIMARY KEY,
+            title TEXT,
+            log_channel_id INTEGER,
+            shift_start TEXT NOT NULL,
+            shift_end TEXT NOT NULL,
+            absent_swept_through INTEGER
+        )
+    """
+    )
+    swept = conn.execute("SELECT value FROM meta WHERE key='absent_swept_through'").fetchone()
+    conn.execute(
+        """
+        INSERT INTO groups(group_id, log_channel_id, shift_start, shift_end, absent_swept_through)
+        VALUES (?,?,?,?,?)
+        """,
+        (GROUP_ID, LOG_CHANNEL_ID, SHIFT_START, SHIFT_END, date_to_day(swept[0]) if swept else None),
+    )
+    conn.execute("DELETE FROM meta WHERE key='absent_swept_through'")
+
+    conn.execute(
+        """
+        CREATE TABLE staff_v3(
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            full_name TEXT,
+            PRIMARY KEY(group_id, user_id)
+        )
+    """
+    )
+    conn.execute("INSERT INTO staff_v3(group_id, user_id, full_name) SELECT ?, user_id, full_name FROM staff", (GROUP_ID,))
+    conn.execute("DROP TABLE staff")
+    conn.execute("ALTER TABLE staff_v3 RENAME TO staff")
+
+    conn.execute(
+        """
+        CREATE TABLE attendance_v3(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            full_name TEXT,
+            day INTEGER NOT NULL,
+            clock_in INTEGER,
+            clock_out INTEGER,
+            status TEXT,
+            late_minutes INTEGER DEFAULT 0,
+            overtime_minutes INTEGER DEFAULT 0,
+            UNIQUE(group_id,user_id,day)
+        )
+    """
+    )
+    conn.execute(
+        """
+        INSERT INTO attendance_v3(id, group_id, user_id, full_name, day, clock_in, clock_out, status, late_minutes, overtime_minutes)
+        SELECT id, ?, user_id, full_name, day, clock_in, clock_out, status, late_minutes, overtime_minutes
+        FROM attendance
+        """,
+        (GROUP_ID,),
+    )
+    for trg in ("trg_summary_ins", "trg_summary_del", "trg_summary_upd"):
+        conn.execute(f"DROP TRIGGER {trg}")
+    conn.execute("DROP TABLE monthly_summary")
+    conn.execute("DROP TABLE attendance")
+    conn.execute("ALTER TABLE attendance_v3 RENAME TO attendance")
+    conn.execute("CREATE INDEX idx_att_group_day ON attendance(group_id, day)")
+    _create_monthly_summary(conn, ("group_id", "user_id"))
+
+
+def _migrate_v4(conn: sqlite3.Connection) -> None:
+    """
+    Shift schedules: `shifts` holds per-group and per-staff, per-weekday shift definitions
+    (times in minutes after the start day's midnight, so overnight shifts end past 1440)
+    and shift_calendar materializes the shift planned for each (group, user, day).
+    Existing attendance gets its calendar rows, planned from the group's shift times.
+    """
+    conn.execute(
+        """
+        CREATE TABLE shifts(
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL DEFAULT 0,
+            weekday INTEGER NOT NULL DEFAULT -1,
+            start_minute INTEGER,
+            end_minute INTEGER,
+            PRIMARY KEY(group_id, user_id, weekday)
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE shift_calendar(
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            start_minute INTEGER,
+            end_minute INTEGER,
+            PRIMARY KEY(group_id, user_id, day)
+        ) WITHOUT ROWID
+    """
+    )
+    conn.execute("ALTER TABLE groups ADD COLUMN calendar_through INTEGER")
+    today = today_day()
+    through = today + SHIFT_CALENDAR_DAYS - 1
+    first_days = conn.execute(
+        "SELECT g.group_id, MIN(a.day) FROM groups g LEFT JOIN attendance a ON a.group_id = g.group_id GROUP BY g.group_id"
+    ).fetchall()
+    for group_id, first in first_days:
+        _build_calendar(conn, group_id, min(first, today) if first is not None else today, through)
+    conn.execute("UPDATE groups SET calendar_through=?", (through,))
 
 
-def escape_md(t: str) -> str:
-    """Escape Markdown special chars for Telegram messages (v2 style)."""
-    if not t:
-        return ""
-    return re.sub(r'([_\*\[\]\(\)\~\>\#\+\-\=\|\{\}\.\!])', r'\\\1', t)
+def _migrate_v5(conn: sqlite3.Connection) -> None:
+    """
+    Report cache versions: data_versions counts the writes to each (group, month) of
+    attendance and shift_calendar, kept by triggers. Counters only ever grow, so a report
+    built when its months summed to N is current for exactly as long as they still do.
+    """
+    conn.execute(
+        """
+        CREATE TABLE data_versions(
+            group_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(group_id, month)
+        ) WITHOUT ROWID
+    """
+    )
+    for table in ("attendance", "shift_calendar"):
+        new, old = _version_bump("NEW"), _version_bump("OLD")
+        conn.execute(f"CREATE TRIGGER trg_version_{table}_ins AFTER INSERT ON {table} BEGIN {new} END")
+        conn.execute(f"CREATE TRIGGER trg_version_{table}_del AFTER DELETE ON {table} BEGIN {old} END")
+        conn.execute(f"CREATE TRIGGER trg_version_{table}_upd AFTER UPDATE ON {table} BEGIN {old} {new} END")
 
 
-# -------------------- DB SETUP --------------------
-_conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-_cur = _conn.cursor()
+def _migrate_v6(conn: sqlite3.Connection) -> None:
+    """Staff listings page through (name, id) keysets: index that order per group."""
+    conn.execute("UPDATE staff SET full_name = '' WHERE full_name IS NULL")  # NULL would drop out of keyset comparisons
+    conn.execute("CREATE INDEX idx_staff_name ON staff(group_id, full_name, user_id)")
 
 
-def init_db() -> None:
-    """Initialize database tables and indexes."""
-    _cur.execute(
+def _migrate_v7(conn: sqlite3.Connection) -> None:
+    """
+    Event-sourced attendance: `events` is the append-only log attendance is projected from
+    (see ATTENDANCE EVENTS). Each live attendance row is carried over as one 'import' event.
+    """
+    conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS staff(
-            user_id INTEGER PRIMARY KEY,
-            full_name TEXT
+        CREATE TABLE events(
+            seq INTEGER PRIMARY KEY,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            full_name TEXT,
+            clock_in INTEGER,
+            clock_out INTEGER,
+            status TEXT,
+            late_minutes INTEGER DEFAULT 0,
+            overtime_minutes INTEGER DEFAULT 0,
+            ref INTEGER,
+            actor INTEGER,
+            at INTEGER NOT NULL
         )
     """
     )
-    _cur.execute(
+    conn.execute("CREATE INDEX idx_events_key ON events(group_id, user_id, day, seq)")
+    conn.execute("CREATE TRIGGER trg_events_append_only BEFORE UPDATE ON events BEGIN SELECT RAISE(ABORT, 'events are append-only'); END")
+    conn.execute(
+        f"""
+        INSERT INTO events(group_id, user_id, day, kind, {_ATTENDANCE_ROW}, at)
+        SELECT group_id, user_id, day, 'import', {_ATTENDANCE_ROW}, CAST(strftime('%s', 'now') AS INTEGER)
+        FROM attendance ORDER BY group_id, user_id, day
         """
-        CREATE TABLE IF NOT EXISTS attendance(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            full_name TEXT,
-            date TEXT,
-            clock_in TEXT,
-            clock_out TEXT,
-            status TEXT,
+    )
+
+
+def _version_bump(r: str) -> str:
+    """SQL bumping the data_versions counter of row r's (group, month); r is NEW or OLD."""
+    month = _SUMMARY_MONTH.format(r=r)
+    match = f"group_id = {r}.group_id AND month = {month}"
+    return (
+        f"INSERT INTO data_versions(group_id, month) SELECT {r}.group_id, {month} "
+        f"WHERE NOT EXISTS (SELECT 1 FROM data_versions WHERE {match});\n"
+        f"UPDATE data_versions SET version = version + 1 WHERE {match};"
+    )
+
+
+# Per-row contribution of an attendance row to monthly_summary; {r} is NEW or OLD.
+_SUMMARY_COLUMNS = {
+    "late_minutes": "COALESCE({r}.late_minutes, 0)",
+    "overtime_minutes": "COALESCE({r}.overtime_minutes, 0)",
+    "worked_minutes": "COALESCE({r}.clock_out - {r}.clock_in, 0)",
+    "days": "1",
+    "absent_days": "({r}.status = 'Absent')",
+    "sick_days": "({r}.status = 'Sick')",
+    "off_days": "({r}.status = 'Off')",
+}
+_SUMMARY_MONTH = "strftime('%Y-%m', {r}.day * 86400, 'unixepoch')"
+
+
+def _summary_apply(r: str, sign: str, keys: Tuple[str, ...]) -> str:
+    """SQL adding (sign '+') or removing (sign '-') row r's contribution to monthly_summary."""
+    month = _SUMMARY_MONTH.format(r=r)
+    sets = ", ".join(f"{c} = {c} {sign} {e.format(r=r)}" for c, e in _SUMMARY_COLUMNS.items())
+    match = " AND ".join(f"{k} = {r}.{k}" for k in keys)
+    return (
+        # not INSERT OR IGNORE: the triggering statement's conflict policy would override it
+        f"INSERT INTO monthly_summary({', '.join(keys)}, month) SELECT {', '.join(f'{r}.{k}' for k in keys)}, {month} "
+        f"WHERE NOT EXISTS (SELECT 1 FROM monthly_summary WHERE {match} AND month = {month});\n"
+        f"UPDATE monthly_summary SET {sets} WHERE {match} AND month = {month};"
+    )
+
+
+def _create_monthly_summary(conn: sqlite3.Connection, keys: Tuple[str, ...]) -> None:
+    """
+    Create the per-(keys..., month) aggregate table, fill it from existing rows and add
+    the triggers that keep it in step with every insert/update/delete on attendance.
+    """
+    key_cols = "".join(f"{k} INTEGER, " for k in keys)
+    conn.execute(
+        f"""
+        CREATE TABLE monthly_summary(
+            {key_cols}month TEXT,
             late_minutes INTEGER DEFAULT 0,
             overtime_minutes INTEGER DEFAULT 0,
-            UNIQUE(user_id,date)
+            worked_minutes INTEGER DEFAULT 0,
+            days INTEGER DEFAULT 0,
+            absent_days INTEGER DEFAULT 0,
+            sick_days INTEGER DEFAULT 0,
+            off_days INTEGER DEFAULT 0,
+            PRIMARY KEY({', '.join(keys)}, month)
         )
     """
     )
-    _cur.execute("CREATE INDEX IF NOT EXISTS idx_att_user_date ON attendance(user_id,date)")
-    _conn.commit()
+    cols = ", ".join(_SUMMARY_COLUMNS)
+    sums = ", ".join(f"SUM({e.format(r='a')})" for e in _SUMMARY_COLUMNS.values())
+    group_by = ", ".join(str(i) for i in range(1, len(keys) + 2))
+    conn.execute(
+        f"""
+        INSERT INTO monthly_summary({', '.join(keys)}, month, {cols})
+        SELECT {', '.join(f'a.{k}' for k in keys)}, {_SUMMARY_MONTH.format(r='a')}, {sums}
+        FROM attendance a
+        GROUP BY {group_by}
+        """
+    )
+    ins, rem = _summary_apply("NEW", "+", keys), _summary_apply("OLD", "-", keys)
+    conn.execute(f"CREATE TRIGGER trg_summary_ins AFTER INSERT ON attendance BEGIN {ins} END")
+    conn.execute(f"CREATE TRIGGER trg_summary_del AFTER DELETE ON attendance BEGIN {rem} END")
+    conn.execute(f"CREATE TRIGGER trg_summary_upd AFTER UPDATE ON attendance BEGIN {rem} {ins} END")
+
+
+# Schema migrations, applied in order; the DB's PRAGMA user_version records how many ran.
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Bring the database up to the latest schema version, one transaction per step.
+    Returns the resulting version.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for v in range(version + 1, len(MIGRATIONS) + 1):
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            MIGRATIONS[v - 1](conn)
+            conn.execute(f"PRAGMA user_version = {v}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"DB migrated to schema v{v}")
+    return max(version, len(MIGRATIONS))
+
+
+def _register_default_group(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO groups(group_id, log_channel_id, shift_start, shift_end) VALUES (?,?,?,?)",
+        (GROUP_ID, LOG_CHANNEL_ID, SHIFT_START, SHIFT_END),
+    )
+
+
+def init_db() -> None:
+    """
+    Initialize database tables and indexes, migrating existing files in place, and make
+    sure the default GROUP_ID is registered.
+    """
+    db.write_sync(migrate)
+    if GROUP_ID:
+        db.write_sync(_register_default_group)
+
+
+# -------------------- GROUPS / HOT STATE --------------------
+@dataclass
+class GroupConfig:
+    """One row of the groups table: a group's log channel, shift times and sweep/calendar progress."""
+
+    group_id: int
+    title: Optional[str] = None
+    log_channel_id: Optional[int] = None
+    shift_start: str = SHIFT_START
+    shift_end: str = SHIFT_END
+    absent_swept_through: Optional[int] = None
+    calendar_through: Optional[int] = None
+
+    def shift(self) -> Tuple[int, int]:
+        """The group's default shift as (start, end) minutes; end > 1440 for overnight shifts."""
+        return shift_minutes(self.shift_start, self.shift_end)
+
+
+# A planned shift: (start, end) minutes after midnight of its day, or (None, None) for a day off.
+Shift = Tuple[Optional[int], Optional[int]]
+
+
+@dataclass
+class DayRecord:
+    """One staff member's attendance row for one day (clock times in minutes)."""
+
+    full_name: str
+    clock_in: Optional[int] = None
+    clock_out: Optional[int] = None
+    status: Optional[str] = None
+    late_minutes: int = 0
+    overtime_minutes: int = 0
+
+
+class HotState:
+    """
+    In-memory staff roster, attendance and planned shifts of one group for today and
+    yesterday (GMT+5 days from today_day()); yesterday is kept because its overnight
+    shifts may still be running. Loaded from SQLite on first use and again whenever the
+    date rolls over; every write goes to the DB first and is then applied here, so the
+    DB stays the source of truth and a restart simply reloads it.
+    """
+
+    def __init__(self, database: Database, group_id: int) -> None:
+        self.db = database
+        self.group_id = group_id
+        self.day: Optional[int] = None
+        self.roster: Dict[int, str] = {}
+        self.days: Dict[int, Dict[int, DayRecord]] = {}
+        self.shifts: Dict[Tuple[int, int], Shift] = {}
+        self._lock = asyncio.Lock()
+        # held across each DB write and its in-memory apply, so concurrent handlers
+        # cannot interleave them (e.g. a reset landing between a clock-in's write and apply)
+        self._write_lock = asyncio.Lock()
+
+    async def _ensure(self) -> None:
+        today = today_day()
+        if self.day == today:
+            return
+        async with self._lock:
+            if self.day == today:
+                return
+            staff, rows, shifts = await self.db.load_day(self.group_id, today)
+            self.roster = dict(staff)
+            self.days = {today - 1: {}, today: {}}
+            for uid, day, *rest in rows:
+                self.days[day][uid] = DayRecord(*rest)
+            self.shifts = {(uid, day): (start, end) for uid, day, start, end in shifts}
+            self.day = today
+
+    def invalidate(self) -> None:
+        """Force a reload from the DB on next access."""
+        self.day = None
+
+    # ---- reads ----
+    async def staff_name(self, user_id: int) -> Optional[str]:
+        await self._ensure()
+        return self.roster.get(user_id)
+
+    async def record(self, user_id: int, day: Optional[int] = None) -> Optional[DayRecord]:
+        """Return the user's record for `day` (today or yesterday; default today), or None."""
+        await self._ensure()
+        return self.days.get(self.day if day is None else day, {}).get(user_id)
+
+    async def today_page(self, cursor: Optional[int] = None, backward: bool = False,
+                         limit: Optional[int] = None) -> Tuple[List[Tuple[int, DayRecord]], int]:
+        """
+        Return (up to `limit` of today's (user_id, record) pairs ordered by name, total).
+        Keyset paging as in Database.staff_page: the pairs after user `cursor` (before it
+        when `backward`); no pairs if `cursor` has no record today.
+        """
+        await self._ensure()
+        today = self.days[self.day]
+        keys = sorted((rec.full_name or "", uid) for uid, rec in today.items())
+        if cursor is None:
+            lo, hi = 0, len(keys)
+        elif cursor not in today:
+            lo = hi = 0
+        else:
+            at = bisect.bisect_left(keys, (today[cursor].full_name or "", cursor))
+            lo, hi = (0, at) if backward else (at + 1, len(keys))
+        if limit is not None:
+            lo, hi = (max(lo, hi - limit), hi) if backward and cursor is not None else (lo, min(hi, lo + limit))
+        return [(uid, today[uid]) for _, uid in keys[lo:hi]], len(keys)
+
+    async def shift_day(self, user_id: int, day: int, minute: int,
+                        closing: bool = False) -> Tuple[int, int, Optional[Shift]]:
+        """
+        Place an event at `minute` after midnight of `day` on the shift it belongs to.
+        Yesterday's overnight shift claims it while the shift is still running, and, when
+        `closing` (clock-out), for as long as the user's record on it is still open.
+        Returns (shift day, minute after that day's midnight, planned shift or None).
+        """
+        await self._ensure()
+        prev = self.shifts.get((user_id, day - 1))
+        if prev and prev[1] is not None and prev[1] > 1440:
+            rel = minute + 1440
+            rec = self.days.get(day - 1, {}).get(user_id)
+            still_open = rec is not None and rec.clock_in is not None and rec.clock_out is None
+            if rel < prev[1] or (closing and still_open):
+                return day - 1, rel, prev
+        return day, minute, self.shifts.get((user_id, day))
+
+    # ---- write-through ----
+    async def add_staff(self, user_id: int, full_name: str) -> None:
+        async with self._write_lock:
+            await self.db.add_staff(self.group_id, user_id, full_name)
+            self.roster[user_id] = full_name
+            self.invalidate()  # picks up the user's newly planned shifts
+
+    async def remove_staff(self, user_id: int) -> None:
+        async with self._write_lock:
+            await self.db.remove_staff(self.group_id, user_id)
+            self.roster.pop(user_id, None)
+            self.invalidate()  # drops the user's cancelled shifts
+
+    async def sync_staff(self, roster: Dict[int, str], remove: bool = True) -> RosterDiff:
+        async with self._write_lock:
+            diff = await self.db.sync_staff(self.group_id, roster, remove)
+            if diff:
+                self.invalidate()  # reloads the roster and the replanned shifts
+            return diff
+
+    def _put(self, user_id: int, day: int, row: Optional[tuple]) -> None:
+        """Store a projected attendance row (None = no record) if `day` is held in memory."""
+        recs = self.days.get(day)
+        if recs is None:
+            return
+        if row is None:
+            recs.pop(user_id, None)
+        else:
+            recs[user_id] = DayRecord(*row)
+
+    async def clock_in(self, user_id: int, full_name: str, day: int, minute: int, late_minutes: int) -> None:
+        async with self._write_lock:
+            self._put(user_id, day, await self.db.clock_in(self.group_id, user_id, full_name, day, minute, late_minutes))
+
+    async def clock_out(self, user_id: int, day: int, minute: int, overtime_minutes: int) -> None:
+        async with self._write_lock:
+            self._put(user_id, day, await self.db.clock_out(self.group_id, user_id, day, minute, overtime_minutes))
+
+    async def mark_day(self, user_id: int, full_name: str, day: int, status: str) -> None:
+        async with self._write_lock:
+            self._put(user_id, day, await self.db.mark_day(self.group_id, user_id, full_name, day, status))
+
+    async def undo_clock_out(self, user_id: int, day: int, actor: Optional[int] = None) -> bool:
+        async with self._write_lock:
+            undone, row = await self.db.undo_clock_out(self.group_id, user_id, day, actor)
+            if undone:
+                self._put(user_id, day, row)
+            return undone
+
+    def _covers(self, start: int, end: int) -> bool:
+        return self.day is not None and start <= self.day and end >= self.day - 1
+
+    async def mark_absent(self, start: int, end: int, actor: Optional[int] = None) -> int:
+        async with self._write_lock:
+            n = await self.db.mark_absent(self.group_id, start, end, actor)
+            if self._covers(start, end):
+                self.invalidate()
+            return n
+
+    async def absent_sweep(self, through: int) -> Tuple[Optional[int], int]:
+        async with self._write_lock:
+            start, n = await self.db.absent_sweep(self.group_id, through)
+            if start is not None and self._covers(start, through):
+                self.invalidate()
+            return start, n
+
+    async def reset_all(self, actor: Optional[int] = None) -> None:
+        async with self._write_lock:
+            await self.db.reset_all(self.group_id, actor)
+            for recs in self.days.values():
+                recs.clear()
+
+    async def reset_day(self, day: int, actor: Optional[int] = None) -> None:
+        async with self._write_lock:
+            await self.db.reset_day(self.group_id, day, actor)
+            self.days.get(day, {}).clear()
+
+    async def rebuild(self) -> Tuple[int, int]:
+        async with self._write_lock:
+            result = await self.db.rebuild_attendance(self.group_id)
+            self.invalidate()
+            return result
+
+
+class Groups:
+    """
+    Registry of the groups the bot serves: every groups row and shift definition, loaded
+    once and updated write-through so resolving a chat's configuration never touches the
+    DB, plus each group's HotState, created on first use.
+    """
+
+    def __init__(self, database: Database) -> None:
+        self.db = database
+        self._configs: Optional[Dict[int, GroupConfig]] = None
+        # group_id -> {(user_id, weekday): shift}; user_id 0 = whole group, weekday -1 = every day
+        self._shifts: Dict[int, Dict[Tuple[int, int], Shift]] = {}
+        self._states: Dict[int, HotState] = {}
+        self._lock = asyncio.Lock()
+
+    async def _ensure(self) -> Dict[int, GroupConfig]:
+        if self._configs is None:
+            async with self._lock:
+                if self._configs is None:
+                    shifts: Dict[int, Dict[Tuple[int, int], Shift]] = {}
+                    for gid, uid, weekday, start, end in await self.db.load_shifts():
+                        shifts.setdefault(gid, {})[(uid, weekday)] = (start, end)
+                    self._shifts = shifts
+                    self._configs = {row[0]: GroupConfig(*row) for row in await self.db.load_groups()}
+        return self._configs
+
+    async def get(self, group_id: int) -> Optional[GroupConfig]:
+        return (await self._ensure()).get(group_id)
+
+    async def all(self) -> List[GroupConfig]:
+        return list((await self._ensure()).values())
+
+    async def save(self, cfg: GroupConfig) -> None:
+        """Insert or update a group's configuration; its calendar is re-planned from today."""
+        configs = await self._ensure()
+        cfg.calendar_through = await self.db.save_group(
+            cfg.group_id, cfg.title, cfg.log_channel_id, cfg.shift_start, cfg.shift_end
+        )
+        configs[cfg.group_id] = cfg
+        self.state(cfg.group_id).invalidate()
+
+    # ---- shift definitions ----
+    async def shifts(self, group_id: int) -> Dict[Tuple[int, int], Shift]:
+        """Return the group's shift definitions keyed by (user_id, weekday)."""
+        await self._ensure()
+        return dict(self._shifts.get(group_id, {}))
+
+    async def set_shift(self, cfg: GroupConfig, user_id: int, weekday: int, shift: Shift) -> None:
+        """Define a shift (or a day off) and re-plan the group's calendar from today."""
+        await self._ensure()
+        cfg.calendar_through = await self.db.save_shift(cfg.group_id, user_id, weekday, *shift)
+        self._shifts.setdefault(cfg.group_id, {})[(user_id, weekday)] = shift
+        self.state(cfg.group_id).invalidate()
+
+    async def clear_shift(self, cfg: GroupConfig, user_id: int, weekday: int) -> bool:
+        """Remove a shift definition; returns False if there was none."""
+        await self._ensure()
+        if (user_id, weekday) not in self._shifts.get(cfg.group_id, {}):
+            return False
+        cfg.calendar_through = await self.db.delete_shift(cfg.group_id, user_id, weekday)
+        del self._shifts[cfg.group_id][(user_id, weekday)]
+        self.state(cfg.group_id).invalidate()
+        return True
+
+    async def latest_end(self, cfg: GroupConfig) -> int:
+        """Latest end (minutes after the start day's midnight) of any shift the group plans."""
+        await self._ensure()
+        ends = [end for _, end in self._shifts.get(cfg.group_id, {}).values() if end is not None]
+        return max([cfg.shift()[1], *ends])
+
+    async def extend_calendar(self, cfg: GroupConfig) -> None:
+        """Plan the group's shifts SHIFT_CALENDAR_DAYS ahead if the calendar falls short."""
+        through = today_day() + SHIFT_CALENDAR_DAYS - 1
+        if cfg.calendar_through is not None and cfg.calendar_through >= through:
+            return
+        await self.db.extend_calendar(cfg.group_id, through)
+        cfg.calendar_through = through
+        self.state(cfg.group_id).invalidate()
+
+    def state(self, group_id: int) -> HotState:
+        st = self._states.get(group_id)
+        if st is None:
+            st = self._states[group_id] = HotState(self.db, group_id)
+        return st
+
+
+groups = Groups(db)
 
 
 # -------------------- HELPER: MESSAGE LINKS --------------------
@@ -98,80 +2124,509 @@ def make_tme_link(chat_id: int, message_id: int) -> str:
 
 
 # -------------------- LOGGING --------------------
-async def bot_log(context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
-    """
-    Send a free-form log message to LOG_CHANNEL_ID.
-    Use parse_mode=MARKDOWN for formatting.
-    """
+async def _send_log(bot: Bot, chat_id: Optional[int], text: str) -> None:
+    if chat_id is None:
+        print(text)
+        return
     try:
-        await context.bot.send_message(LOG_CHANNEL_ID, text, parse_mode=ParseMode.MARKDOWN)
+        await bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN, rate_limit_args=LOG_SEND)
     except Exception as e:
         # Fail gracefully — print to stdout
         print("LOG ERROR:", e)
         print(text)
 
 
-async def log_action_detailed(
-    context: ContextTypes.DEFAULT_TYPE,
-    tag: str,
-    user_id: int,
-    user_name: str,
-    shift_start: str,
-    late_minutes: int,
-    overtime_minutes: int,
-    status: str,
-    conf_chat_id: int,
-    conf_message_id: int,
-) -> None:
+async def bot_log(context: ContextTypes.DEFAULT_TYPE, cfg: GroupConfig, text: str) -> None:
+    """
+    Send a free-form log message to the group's log channel immediately.
+    Use parse_mode=MARKDOWN for formatting. Admin actions use this directly.
+    """
+    await _send_log(context.bot, cfg.log_channel_id, text)
+
+
+def chunk_lines(entries: List[str], sep: str = "\n\n", limit: int = MAX_MESSAGE_LEN) -> List[str]:
+    """Join entries with sep into as few messages as possible, each at most `limit` chars."""
+    chunks: List[str] = []
+    cur = ""
+    for e in entries:
+        e = e[:limit]
+        if cur and len(cur) + len(sep) + len(e) > limit:
+            chunks.append(cur)
+            cur = ""
+        cur = f"{cur}{sep}{e}" if cur else e
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+
+class LogDigest:
+    """
+    Batches attendance log entries and posts them to their log channel as one combined
+    message per channel and window. The first entry of a burst starts the window timer;
+    everything queued before it fires goes out together (split only at the message
+    length limit).
+    """
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self._entries: Dict[Optional[int], List[str]] = {}
+        self._bot: Optional[Bot] = None
+        self._timer: Optional[asyncio.Task] = None
+
+    def add(self, bot: Bot, chat_id: Optional[int], text: str) -> None:
+        self._bot = bot
+        self._entries.setdefault(chat_id, []).append(text)
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Send everything queued so far."""
+        entries, self._entries = self._entries, {}
+        if self._bot is None:
+            return
+        for chat_id, texts in entries.items():
+            for chunk in chunk_lines(texts):
+                await _send_log(self._bot, chat_id, chunk)
+
+    async def close(self) -> None:
+        """Cancel the pending timer and flush what is left (called on shutdown)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+
+log_digest = LogDigest(LOG_DIGEST_WINDOW)
+
+
+async def log_action_detailed(
+    context: ContextTypes.DEFAULT_TYPE,
+    cfg: GroupConfig,
+    tag: str,
+    user_id: int,
+    user_name: str,
+    shift_start: str,
+    late_minutes: int,
+    overtime_minutes: int,
+    status: str,
+    conf_chat_id: int,
+    conf_message_id: int,
+) -> None:
+    """
+    Log the action in Option B detailed format:
+    - includes staff name, user id, date, time, shift start, late minutes, overtime, status, and message link
+    - queued into the log digest when LOG_DIGEST_WINDOW > 0
+    """
+    now = gmt5_now()
+    link = make_tme_link(conf_chat_id, conf_message_id)
+    lines = [
+        f"#{tag}",
+        f"• Staff Name: {escape_md(user_name)} 🍷🍥",
+        f"• User ID: {user_id}",
+        f"• Date: {now.strftime('%Y-%m-%d')}",
+        f"• Time: {now.strftime('%H:%M')}",
+        f"• Shift Start: {shift_start}",
+        f"• Late Minutes: {late_minutes}",
+        f"• Overtime Minutes: {overtime_minutes}",
+        f"• Status: {escape_md(status)}",
+        f"• Message link: Go to message ({link})",
+    ]
+    if LOG_DIGEST_WINDOW > 0:
+        log_digest.add(context.bot, cfg.log_channel_id, "\n".join(lines))
+    else:
+        await bot_log(context, cfg, "\n".join(lines))
+
+
+# -------------------- BACKGROUND TASKS --------------------
+def background(context: ContextTypes.DEFAULT_TYPE, coro: Awaitable[Any]) -> None:
+    """
+    Run non-critical outbound work (deleting the command, logging) without making the
+    user wait for it. The Application tracks the task, awaits it on shutdown and hands
+    any exception to on_error.
+    """
+    context.application.create_task(coro)
+
+
+async def delete_quietly(msg: Message) -> None:
+    """Delete a message, ignoring failures (e.g. the bot lacks delete rights)."""
+    try:
+        await msg.delete()
+    except Exception:
+        pass
+
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Report errors from handlers and background tasks."""
+    print("HANDLER ERROR:", repr(context.error))
+
+
+# -------------------- CONCURRENCY --------------------
+class KeyedLocks:
+    """asyncio.Lock per key, created on first use and dropped once nobody holds or waits on it."""
+
+    def __init__(self) -> None:
+        self._locks: Dict[Any, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Any) -> AsyncIterator[None]:
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+user_locks = KeyedLocks()
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `limit` updates at once, but never two updates from the same user:
+    each user's updates take that user's lock in arrival order, and only then one of the
+    `limit` slots. A burst from one person waits for its turn without holding a slot, so
+    a slow /report does not stall other staff while one person's /clockin and /clockout
+    stay ordered. (PTB takes its own semaphore before do_process_update, so that one is
+    left unbounded.)
+    """
+
+    UNBOUNDED = 1 << 30
+
+    def __init__(self, limit: int) -> None:
+        super().__init__(self.UNBOUNDED)
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._slots:
+                await coroutine
+            return
+        async with user_locks.hold(user.id):
+            async with self._slots:
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+heavy_slots = asyncio.Semaphore(HEAVY_CONCURRENCY)
+
+
+def heavy(handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]):
+    """Limit a handler to HEAVY_CONCURRENCY concurrent runs across all users."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        async with heavy_slots:
+            await handler(update, context)
+
+    return wrapper
+
+
+# -------------------- OUTBOUND RATE LIMITING --------------------
+PRIORITY_USER = 0  # replies and confirmations to whoever sent the command (the default)
+PRIORITY_LOG = 1   # log-channel entries and scheduled backup uploads
+PRIORITY_NAMES = {PRIORITY_USER: "user", PRIORITY_LOG: "log"}
+LOG_SEND = {"priority": PRIORITY_LOG}  # rate_limit_args for log-channel sends
+SEND_PREFIXES = ("send", "edit", "copy", "forward")  # Bot API methods that post into a chat
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`; pause() keeps it empty until a given time."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def ready_at(self, now: float) -> float:
+        """Monotonic time at which a token is available (<= now: available now)."""
+        if self.rate <= 0:
+            return max(now, self.paused_until)
+        if now < self.paused_until:
+            return self.paused_until
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def pause(self, until: float) -> None:
+        """Hand out nothing before `until`, then exactly one token (the retry)."""
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 1
+        self.stamp = self.paused_until
+
+    def idle(self, now: float) -> bool:
+        """Full and not paused: dropping it loses nothing."""
+        return self.ready_at(now) <= now and (self.rate <= 0 or self.tokens >= self.burst)
+
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, int]]):
+    """
+    Central queue for outbound messages, installed as the Application's rate limiter so every
+    send_message/reply_text/edit/send_document passes through it. A send waits for a token
+    from its chat's bucket (RATE_CHAT_PER_SEC for private chats, RATE_GROUP_PER_MIN for groups
+    and channels) and from the global RATE_GLOBAL_PER_SEC bucket; whenever tokens are short,
+    waiting sends go out by priority (PRIORITY_USER before PRIORITY_LOG, chosen with
+    rate_limit_args), then in arrival order. A 429 answer pauses that chat for its retry_after
+    and puts the send back in its old place in the queue, up to SEND_MAX_RETRIES times.
+    Other calls (deleteMessage, answerCallbackQuery, getChatAdministrators...) are not queued.
+    """
+
+    MAX_IDLE_BUCKETS = 4096  # chat buckets kept before idle (full, unpaused) ones are dropped
+
+    def __init__(self, global_per_sec: float, group_per_min: float, chat_per_sec: float, max_retries: int) -> None:
+        self.group_per_min = group_per_min
+        self.chat_per_sec = chat_per_sec
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_per_sec, global_per_sec)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._queue: List[Tuple[int, int, Any, asyncio.Future]] = []  # (priority, seq, chat_id, granted)
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for *_, granted in self._queue:
+            granted.cancel()
+        self._queue.clear()
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if not b.idle(now)}
+            group = isinstance(chat_id, str) or int(chat_id) < 0  # @channel usernames and negative ids
+            rate, burst = (self.group_per_min / 60, self.group_per_min) if group else (self.chat_per_sec, self.chat_per_sec)
+            bucket = self._chats[chat_id] = TokenBucket(rate, max(1.0, burst))
+        return bucket
+
+    async def _dispatch(self) -> None:
+        """Grant tokens to waiting sends, best priority first; sleep until the next token otherwise."""
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            wake_at: Optional[float] = None
+            blocked: Set[Any] = set()  # a chat's later sends queue behind its first waiting one
+            self._queue = [item for item in self._queue if not item[3].done()]
+            self._queue.sort()
+            for _, _, chat_id, granted in self._queue:
+                if chat_id in blocked:
+                    continue
+                bucket = self._bucket(chat_id)
+                at = max(self._global.ready_at(now), bucket.ready_at(now))
+                if at <= now:
+                    self._global.take()
+                    bucket.take()
+                    granted.set_result(None)
+                else:
+                    blocked.add(chat_id)
+                    wake_at = at if wake_at is None else min(wake_at, at)
+            try:
+                await asyncio.wait_for(self._wake.wait(), None if wake_at is None else wake_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire(self, chat_id: Any, priority: int, seq: int) -> None:
+        self._bucket(chat_id)  # a bad chat_id fails here, in the caller, not in the dispatcher
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._dispatch())
+        granted = asyncio.get_running_loop().create_future()
+        self._queue.append((priority, seq, chat_id, granted))
+        self._wake.set()
+        await granted
+
+    async def process_request(
+        self,
+        callback: Callable[..., Awaitable[Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, int]],
+    ) -> Any:
+        chat_id = data.get("chat_id")
+        if chat_id is None or not endpoint.startswith(SEND_PREFIXES):
+            return await callback(*args, **kwargs)
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_USER)
+        seq = next(self._seq)  # kept across retries, so a requeued send keeps its place
+        for attempt in itertools.count():
+            t0 = time.perf_counter()
+            await self._acquire(chat_id, priority, seq)
+            metrics.observe("exc_send_wait_seconds", PRIORITY_NAMES.get(priority, str(priority)), time.perf_counter() - t0)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                wait = e.retry_after
+                wait = wait.total_seconds() if isinstance(wait, timedelta) else float(wait)
+                metrics.inc("exc_send_requeued_total", endpoint)
+                self._bucket(chat_id).pause(time.monotonic() + wait)
+
+
+# -------------------- ADMIN CHECK --------------------
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+
+class AdminCache:
     """
-    Log the action in Option B detailed format:
-    - includes staff name, user id, date, time, shift start, late minutes, overtime, status, and message link
+    In-memory administrator sets, one per group.
+    A group's list is loaded with one get_chat_administrators call and kept for `ttl`
+    seconds; promotions/demotions seen through chat_member updates are applied directly.
+    A failed fetch is not retried for `retry` seconds (or the flood wait Telegram asks
+    for, if longer); lookups meanwhile use the previous set, if there is one.
     """
-    now = gmt5_now()
-    link = make_tme_link(conf_chat_id, conf_message_id)
-    lines = [
-        f"#{tag}",
-        f"• Staff Name: {escape_md(user_name)} 🍷🍥",
-        f"• User ID: {user_id}",
-        f"• Date: {now.strftime('%Y-%m-%d')}",
-        f"• Time: {now.strftime('%H:%M')}",
-        f"• Shift Start: {shift_start}",
-        f"• Late Minutes: {late_minutes}",
-        f"• Overtime Minutes: {overtime_minutes}",
-        f"• Status: {escape_md(status)}",
-        f"• Message link: Go to message ({link})",
-    ]
-    await bot_log(context, "\n".join(lines))
 
+    def __init__(self, ttl: float, retry: float) -> None:
+        self.ttl = ttl
+        self.retry = retry
+        self._ids: Dict[int, Set[int]] = {}
+        self._loaded_at: Dict[int, float] = {}
+        self._retry_at: Dict[int, float] = {}
+        self._locks = KeyedLocks()
 
-# -------------------- ADMIN CHECK --------------------
-async def is_group_admin(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
-    """Return True if user is admin in GROUP_ID (or bot admin list)."""
-    try:
-        m = await context.bot.get_chat_member(GROUP_ID, user_id)
-        return m.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
-    except Exception:
-        return False
+    def _stale(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        if now < self._retry_at.get(chat_id, 0.0):
+            return False
+        loaded_at = self._loaded_at.get(chat_id)
+        return loaded_at is None or now - loaded_at > self.ttl
+
+    async def _refresh(self, bot: Bot, chat_id: int) -> None:
+        try:
+            admins = await bot.get_chat_administrators(chat_id)
+        except Exception as e:
+            wait = self.retry
+            if isinstance(e, RetryAfter):
+                after = e.retry_after
+                wait = max(wait, after.total_seconds() if isinstance(after, timedelta) else float(after))
+            # keep the previous set (if any) until the retry
+            self._retry_at[chat_id] = time.monotonic() + wait
+            print("ADMIN CACHE ERROR:", e)
+            return
+        self._retry_at.pop(chat_id, None)
+        self._ids[chat_id] = {m.user.id for m in admins}
+        self._loaded_at[chat_id] = time.monotonic()
+
+    async def is_admin(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        if self._stale(chat_id):
+            async with self._locks.hold(chat_id):
+                if self._stale(chat_id):
+                    await self._refresh(bot, chat_id)
+        return user_id in self._ids.get(chat_id, ())
+
+    def apply(self, chat_id: int, user_id: int, is_admin: bool) -> None:
+        """Record a promotion/demotion seen in a chat_member update."""
+        ids = self._ids.get(chat_id)
+        if ids is None:
+            return  # not loaded yet; the first lookup fetches the current list
+        if is_admin:
+            ids.add(user_id)
+        else:
+            ids.discard(user_id)
+
+    def invalidate(self, chat_id: int) -> None:
+        self._loaded_at.pop(chat_id, None)
+
+
+admin_cache = AdminCache(ADMIN_CACHE_TTL, ADMIN_CACHE_RETRY)
+
+
+async def is_group_admin(context: ContextTypes.DEFAULT_TYPE, group_id: int, user_id: int) -> bool:
+    """Return True if user is admin in the group (answered from the admin cache)."""
+    return await admin_cache.is_admin(context.bot, group_id, user_id)
+
+
+async def on_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keep the admin cache in sync with promotions/demotions in registered groups."""
+    cmu = update.chat_member
+    if not cmu or await groups.get(cmu.chat.id) is None:
+        return
+    new = cmu.new_chat_member
+    admin_cache.apply(cmu.chat.id, new.user.id, new.status in ADMIN_STATUSES)
+
+
+async def resolve_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[GroupConfig]:
+    """
+    Return the configuration of the group a command applies to: the group it was sent
+    in, or GROUP_ID for private chats. Tells the chat and returns None when that group
+    has not been set up.
+    """
+    chat = update.effective_chat
+    group_id = GROUP_ID if chat.type == ChatType.PRIVATE else chat.id
+    cfg = await groups.get(group_id)
+    if cfg is None:
+        try:
+            await context.bot.send_message(chat.id, "❌ This group is not set up. A bot admin can register it with /setup.")
+        except Exception:
+            pass
+    return cfg
 
 
-async def admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+async def admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE, group_id: int) -> bool:
     """
-    Check if caller is admin (BOT_ADMINS or group admin).
+    Check if caller is admin (BOT_ADMINS or admin of the group).
     Replies with denial when not allowed. Returns True if allowed.
     """
     uid = update.effective_user.id
     if uid in BOT_ADMINS:
         return True
-    if await is_group_admin(context, uid):
+    if await is_group_admin(context, group_id, uid):
         return True
     try:
-        await update.message.reply_text("❌ You are not allowed to use this command.")
+        if update.callback_query:
+            await update.callback_query.answer("❌ You are not allowed to use this command.", show_alert=True)
+        else:
+            await update.message.reply_text("❌ You are not allowed to use this command.")
     except Exception:
         # message may be None/unsupported — ignore
         pass
     return False
 
 
+async def bot_admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Like admin_only, but for commands that span every group: only BOT_ADMINS pass."""
+    if update.effective_user.id in BOT_ADMINS:
+        return True
+    try:
+        await update.message.reply_text("❌ You are not allowed to use this command.")
+    except Exception:
+        pass
+    return False
+
+
 # -------------------- STAFF COMMANDS --------------------
 async def cmd_clockin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
@@ -179,55 +2634,46 @@ async def cmd_clockin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     - Auto-delete the user command (if possible)
     - Record clock in time and late minutes
     - Send confirmation message
-    - Log detailed information to LOG_CHANNEL_ID (Option B)
+    - Log detailed information to the group's log channel (Option B)
     """
     msg = update.message
     if not msg:
         return
+    cfg = await resolve_group(update, context)
+    if cfg is None:
+        return
+    st = groups.state(cfg.group_id)
 
     user = msg.from_user
     uid = user.id
     name = user.full_name or user.username or str(uid)
-    today = today_str()
     now = gmt5_now()
     now_s = now.strftime("%H:%M")
 
-    # Attempt to delete the user's command message (requires bot admin)
-    try:
-        await msg.delete()
-    except Exception:
-        # ignore if bot can't delete
-        pass
+    # Delete the user's command message in the background (requires bot admin)
+    background(context, delete_quietly(msg))
 
     # Ensure staff exists
-    _cur.execute("SELECT user_id FROM staff WHERE user_id=?", (uid,))
-    if not _cur.fetchone():
+    if await st.staff_name(uid) is None:
         # If we cannot reply to the deleted message, send a new ephemeral reply
         await context.bot.send_message(msg.chat_id, "❌ You are not registered as staff.")
         return
 
+    # The shift this clock-in belongs to (yesterday's, while an overnight shift runs)
+    day, minute, shift = await st.shift_day(uid, *day_and_minute(now))
+    start, _ = shift or cfg.shift()
+
     # Check if already clocked in
-    _cur.execute("SELECT clock_in FROM attendance WHERE user_id=? AND date=?", (uid, today))
-    rec = _cur.fetchone()
-    if rec and rec[0]:
+    rec = await st.record(uid, day)
+    if rec and rec.clock_in is not None:
         await context.bot.send_message(msg.chat_id, "❌ You already clocked in.")
         return
 
-    # Compute late minutes relative to SHIFT_START
-    shift_start_dt = hhmm_to_dt(SHIFT_START, now)
-    late_m = max(0, int((now - shift_start_dt).total_seconds() // 60))
+    # Compute late minutes relative to the planned shift start (none on a day off)
+    late_m = max(0, minute - start) if start is not None else 0
 
     # Insert or update attendance
-    _cur.execute(
-        """
-        INSERT INTO attendance (user_id, full_name, date, clock_in, status, late_minutes)
-        VALUES (?,?,?,?,?,?)
-        ON CONFLICT(user_id,date)
-        DO UPDATE SET clock_in=excluded.clock_in, status='Clocked In', late_minutes=excluded.late_minutes
-        """,
-        (uid, name, today, now_s, "Clocked In", late_m),
-    )
-    _conn.commit()
+    await st.clock_in(uid, name, day, minute, late_m)
 
     # Send confirmation message
     conf_msg = await context.bot.send_message(
@@ -236,19 +2682,20 @@ async def cmd_clockin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         parse_mode=ParseMode.MARKDOWN,
     )
 
-    # Log detailed action
-    await log_action_detailed(
+    # Log detailed action (after the user already has their confirmation)
+    background(context, log_action_detailed(
         context=context,
+        cfg=cfg,
         tag="clockin",
         user_id=uid,
         user_name=name,
-        shift_start=SHIFT_START,
+        shift_start=fmt_minutes(start) or "off",
         late_minutes=late_m,
         overtime_minutes=0,
         status="Clocked In",
         conf_chat_id=conf_msg.chat.id,
         conf_message_id=conf_msg.message_id,
-    )
+    ))
 
 
 async def cmd_clockout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -261,40 +2708,33 @@ async def cmd_clockout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     msg = update.message
     if not msg:
         return
+    cfg = await resolve_group(update, context)
+    if cfg is None:
+        return
+    st = groups.state(cfg.group_id)
 
     user = msg.from_user
     uid = user.id
     name = user.full_name or user.username or str(uid)
-    today = today_str()
     now = gmt5_now()
     now_s = now.strftime("%H:%M")
 
-    try:
-        await msg.delete()
-    except Exception:
-        pass
+    background(context, delete_quietly(msg))
 
-    _cur.execute("SELECT clock_in, clock_out, late_minutes FROM attendance WHERE user_id=? AND date=?", (uid, today))
-    rec = _cur.fetchone()
-    if not rec or not rec[0]:
+    day, minute, shift = await st.shift_day(uid, *day_and_minute(now), closing=True)
+    start, end = shift or cfg.shift()
+
+    rec = await st.record(uid, day)
+    if not rec or rec.clock_in is None:
         await context.bot.send_message(msg.chat_id, "❌ You haven't clocked in.")
         return
-    if rec[1]:
+    if rec.clock_out is not None:
         await context.bot.send_message(msg.chat_id, "❌ You already clocked out.")
         return
 
-    shift_end_dt = hhmm_to_dt(SHIFT_END, now)
-    overtime = max(0, int((now - shift_end_dt).total_seconds() // 60)) if now > shift_end_dt else 0
+    overtime = max(0, minute - end) if end is not None else 0
 
-    _cur.execute(
-        """
-        UPDATE attendance
-        SET clock_out=?, status='Clocked Out', overtime_minutes=?
-        WHERE user_id=? AND date=?
-        """,
-        (now_s, overtime, uid, today),
-    )
-    _conn.commit()
+    await st.clock_out(uid, day, minute, overtime)
 
     conf_msg = await context.bot.send_message(
         chat_id=msg.chat_id,
@@ -303,20 +2743,21 @@ async def cmd_clockout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
 
     # read late minutes (if present)
-    late_minutes = rec[2] or 0
+    late_minutes = rec.late_minutes or 0
 
-    await log_action_detailed(
+    background(context, log_action_detailed(
         context=context,
+        cfg=cfg,
         tag="clockout",
         user_id=uid,
         user_name=name,
-        shift_start=SHIFT_START,
+        shift_start=fmt_minutes(start) or "off",
         late_minutes=late_minutes,
         overtime_minutes=overtime,
         status="Clocked Out",
         conf_chat_id=conf_msg.chat.id,
         conf_message_id=conf_msg.message_id,
-    )
+    ))
 
 
 async def cmd_sick(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -328,27 +2769,20 @@ async def cmd_sick(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg = update.message
     if not msg:
         return
+    cfg = await resolve_group(update, context)
+    if cfg is None:
+        return
+    st = groups.state(cfg.group_id)
 
     user = msg.from_user
     uid = user.id
     name = user.full_name or user.username or str(uid)
-    today = today_str()
+    day, _, shift = await st.shift_day(uid, *day_and_minute(gmt5_now()))
+    start, _ = shift or cfg.shift()
 
-    try:
-        await msg.delete()
-    except Exception:
-        pass
+    background(context, delete_quietly(msg))
 
-    _cur.execute(
-        """
-        INSERT INTO attendance (user_id, full_name, date, status)
-        VALUES (?,?,?,?)
-        ON CONFLICT(user_id,date)
-        DO UPDATE SET status='Sick', clock_in=NULL, clock_out=NULL, late_minutes=0, overtime_minutes=0
-        """,
-        (uid, name, today, "Sick"),
-    )
-    _conn.commit()
+    await st.mark_day(uid, name, day, "Sick")
 
     conf_msg = await context.bot.send_message(
         chat_id=msg.chat_id,
@@ -356,18 +2790,19 @@ async def cmd_sick(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         parse_mode=ParseMode.MARKDOWN,
     )
 
-    await log_action_detailed(
+    background(context, log_action_detailed(
         context=context,
+        cfg=cfg,
         tag="sick",
         user_id=uid,
         user_name=name,
-        shift_start=SHIFT_START,
+        shift_start=fmt_minutes(start) or "off",
         late_minutes=0,
         overtime_minutes=0,
         status="Sick",
         conf_chat_id=conf_msg.chat.id,
         conf_message_id=conf_msg.message_id,
-    )
+    ))
 
 
 async def cmd_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -379,77 +2814,767 @@ async def cmd_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     msg = update.message
     if not msg:
         return
+    cfg = await resolve_group(update, context)
+    if cfg is None:
+        return
+    st = groups.state(cfg.group_id)
 
     user = msg.from_user
     uid = user.id
     name = user.full_name or user.username or str(uid)
-    today = today_str()
+    day, _, shift = await st.shift_day(uid, *day_and_minute(gmt5_now()))
+    start, _ = shift or cfg.shift()
+
+    background(context, delete_quietly(msg))
+
+    await st.mark_day(uid, name, day, "Off")
+
+    conf_msg = await context.bot.send_message(
+        chat_id=msg.chat_id,
+        text=f"📘 Marked Off for [{escape_md(name)}](tg://user?id={uid})",
+        parse_mode=ParseMode.MARKDOWN,
+    )
+
+    background(context, log_action_detailed(
+        context=context,
+        cfg=cfg,
+        tag="off",
+        user_id=uid,
+        user_name=name,
+        shift_start=fmt_minutes(start) or "off",
+        late_minutes=0,
+        overtime_minutes=0,
+        status="Off",
+        conf_chat_id=conf_msg.chat.id,
+        conf_message_id=conf_msg.message_id,
+    ))
+
+
+# -------------------- REPORTS --------------------
+REPORT_COLUMNS = [
+    "user_id", "full_name", "date", "clock_in", "clock_out", "status", "late_minutes", "overtime_minutes",
+    "shift_start", "shift_end", "expected_minutes", "worked_minutes",
+]
+
+
+def _sql_hhmm(col: str) -> str:
+    """SQL rendering a minutes-after-midnight column as HH:MM, wrapping past midnight (NULL stays NULL)."""
+    return f"CASE WHEN {col} IS NULL THEN NULL ELSE printf('%02d:%02d', {col} / 60 % 24, {col} % 60) END"
+
+
+# Late and overtime minutes of attendance row `a` against its planned shift `c`, where
+# there is one, so whole reports need no per-row Python.
+_SQL_LATE = """CASE WHEN a.clock_in IS NOT NULL AND c.start_minute IS NOT NULL
+         THEN MAX(0, a.clock_in - c.start_minute) ELSE a.late_minutes END"""
+_SQL_OVERTIME = """CASE WHEN a.clock_out IS NOT NULL AND c.end_minute IS NOT NULL
+         THEN MAX(0, a.clock_out - c.end_minute) ELSE a.overtime_minutes END"""
+# Report columns as SQL over attendance `a` joined to its planned shift `c` (dates and
+# clock times rendered as text).
+_REPORT_SELECT = f"""
+    a.user_id, a.full_name, date(a.day * 86400, 'unixepoch'),
+    {_sql_hhmm("a.clock_in")}, {_sql_hhmm("a.clock_out")}, a.status,
+    {_SQL_LATE},
+    {_SQL_OVERTIME},
+    {_sql_hhmm("c.start_minute")}, {_sql_hhmm("c.end_minute")},
+    COALESCE(c.end_minute - c.start_minute, 0),
+    COALESCE(a.clock_out - a.clock_in, 0)
+"""
+REPORT_FORMATS = {"xlsx": "xlsx", "csv": "csv", "gz": "csv.gz", "csv.gz": "csv.gz"}
+XLSX_MAX_ROWS = 1_048_576  # Excel's per-sheet row limit (including the header)
+
+
+def parse_range(args: List[str]) -> Tuple[str, str, str]:
+    """
+    Parse a date range argument list: [YYYY-MM | YYYY-MM-DD YYYY-MM-DD].
+    Returns (start, end, label); defaults to the current month.
+    Raises ValueError on malformed input.
+    """
+    if not args:
+        month = gmt5_now().strftime("%Y-%m")
+        start, end = month_bounds(month)
+        return start, end, month
+    if len(args) == 1:
+        datetime.strptime(args[0], "%Y-%m")
+        start, end = month_bounds(args[0])
+        return start, end, args[0]
+    if len(args) == 2:
+        start, end = args
+        datetime.strptime(start, "%Y-%m-%d")
+        datetime.strptime(end, "%Y-%m-%d")
+        if start > end:
+            raise ValueError("start after end")
+        return start, end, f"{start}_{end}"
+    raise ValueError("too many arguments")
+
+
+def parse_report_args(args: List[str]) -> Tuple[str, str, str, str]:
+    """
+    Parse /report arguments: [YYYY-MM | YYYY-MM-DD YYYY-MM-DD] [xlsx|csv|gz].
+    Returns (start, end, format, label); defaults to the current month as xlsx.
+    Raises ValueError on malformed input.
+    """
+    args = list(args)
+    fmt = "xlsx"
+    if args and args[-1].lower() in REPORT_FORMATS:
+        fmt = REPORT_FORMATS[args.pop().lower()]
+    start, end, label = parse_range(args)
+    return start, end, fmt, label
+
+
+def _iter_report_rows(conn: sqlite3.Connection, group_id: int, start: int, end: int):
+    # archived months first, then the live table, so rows still come out in day order
+    for schema, lo, hi in _day_parts(conn, start, end):
+        cur = conn.execute(
+            f"""
+            SELECT {_REPORT_SELECT}
+            FROM {schema}.attendance a
+            LEFT JOIN {schema}.shift_calendar c ON c.group_id = a.group_id AND c.user_id = a.user_id AND c.day = a.day
+            WHERE a.group_id = ? AND a.day BETWEEN ? AND ?
+            ORDER BY a.day, a.full_name
+            """,
+            (group_id, lo, hi),
+        )
+        while True:
+            batch = cur.fetchmany(REPORT_CHUNK_ROWS)
+            if not batch:
+                break
+            yield from batch
 
+
+def write_report(conn: sqlite3.Connection, group_id: int, start: int, end: int, fmt: str, path: str) -> int:
+    """
+    Write the group's report for days [start, end] to `path` in constant memory.
+    Rows are pulled from SQLite (live table and archive files alike) in REPORT_CHUNK_ROWS batches; xlsx uses xlsxwriter's
+    constant_memory mode (rows are flushed to temp files in a private directory next to
+    `path`, removed afterwards), csv/csv.gz
+    are written row by row. Returns the number of data rows written.
+    """
+    rows = _iter_report_rows(conn, group_id, start, end)
+    n = 0
+    if fmt == "xlsx":
+        import xlsxwriter
+
+        # a directory of its own, so nothing else in the report cache directory sees its temp files
+        tmpdir = tempfile.mkdtemp(prefix="xlsx_", dir=os.path.dirname(path) or None)
+        try:
+            wb = xlsxwriter.Workbook(path, {"constant_memory": True, "tmpdir": tmpdir})
+            ws = None
+            r = XLSX_MAX_ROWS
+            for row in rows:
+                if r >= XLSX_MAX_ROWS:
+                    ws = wb.add_worksheet("Attendance" if ws is None else f"Attendance {len(wb.worksheets()) + 1}")
+                    ws.write_row(0, 0, REPORT_COLUMNS)
+                    r = 1
+                ws.write_row(r, 0, row)
+                r += 1
+                n += 1
+            if ws is None:
+                wb.add_worksheet("Attendance").write_row(0, 0, REPORT_COLUMNS)
+            wb.close()
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        return n
+
+    opener = gzip.open if fmt == "csv.gz" else open
+    with opener(path, "wt", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(REPORT_COLUMNS)
+        for row in rows:
+            w.writerow(row)
+            n += 1
+    return n
+
+
+def _data_version(conn: sqlite3.Connection, group_id: int, start: int, end: int) -> int:
+    """Sum of the group's data_versions counters over the months days [start, end] touch."""
+    return conn.execute(
+        "SELECT COALESCE(SUM(version), 0) FROM data_versions WHERE group_id=? AND month BETWEEN ? AND ?",
+        (group_id, day_to_date(start)[:7], day_to_date(end)[:7]),
+    ).fetchone()[0]
+
+
+def _init_report_worker(db_file: str, archive_dir: str) -> None:
+    """Report worker process initializer: use the bot's database and archive directory."""
+    global DB_FILE, ARCHIVE_DIR
+    DB_FILE, ARCHIVE_DIR = db_file, archive_dir
+
+
+def build_report_file(group_id: int, start: int, end: int, fmt: str, path: str) -> int:
+    """Report worker process entry point: write_report() over a private read-only connection."""
+    conn = sqlite3.connect(DB_FILE, timeout=30)
     try:
-        await msg.delete()
-    except Exception:
-        pass
+        conn.execute("PRAGMA query_only=ON")
+        return write_report(conn, group_id, start, end, fmt, path)
+    finally:
+        conn.close()
+
+
+class ReportCache:
+    """
+    Finished /report files on disk, keyed by (group, range, format, data version), where
+    the version is _data_version() of the range. Any write to the range's attendance or
+    shift calendar bumps it, so a file is served for as long as it is current and is
+    never asked for again afterwards. Files are built in a pool of spawned processes (no
+    locks inherited from the bot's threads, no GIL shared with the event loop), and
+    concurrent requests for the same file share one build.
+    """
+
+    def __init__(self, database: Database, directory: str, workers: int, keep: int) -> None:
+        self.db = database
+        self.directory = directory
+        self._workers = workers
+        self._keep = keep
+        self._pool: Optional[Executor] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._prewarmed: Set[Tuple[int, str]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _executor(self) -> Executor:
+        if self._pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._pool = ProcessPoolExecutor(
+                self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_report_worker,
+                initargs=(os.path.abspath(self.db.path), os.path.abspath(ARCHIVE_DIR)),
+            )
+        return self._pool
+
+    def path(self, group_id: int, start: int, end: int, fmt: str, version: int) -> str:
+        return os.path.join(self.directory, f"report_{group_id}_{start}_{end}_v{version}.{fmt}")
+
+    async def get(self, group_id: int, start: int, end: int, fmt: str) -> Optional[str]:
+        """Path of the group's current report for days [start, end], built on a miss; None when there is no data."""
+        version = await self.db.read(_data_version, group_id, start, end)
+        path = self.path(group_id, start, end, fmt, version)
+        if os.path.exists(path):
+            metrics.inc("exc_report_cache_total", "hit")
+            return path
+        build = self._pending.get(path)
+        if build is None:
+            metrics.inc("exc_report_cache_total", "miss")
+            build = self._pending[path] = asyncio.ensure_future(self._build(group_id, start, end, fmt, path))
+            build.add_done_callback(lambda _: self._pending.pop(path, None))
+        else:
+            metrics.inc("exc_report_cache_total", "shared")
+        return await asyncio.shield(build)
+
+    async def _build(self, group_id: int, start: int, end: int, fmt: str, path: str) -> Optional[str]:
+        # the version was read before the worker reads any rows, so the file is at least that current
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{path}.tmp"
+        loop = asyncio.get_running_loop()
+        try:
+            n = await loop.run_in_executor(self._executor(), build_report_file, group_id, start, end, fmt, tmp)
+        except Exception as e:
+            if isinstance(e, BrokenExecutor):
+                self._pool = None  # a worker died; start a fresh pool next time
+            try:
+                os.remove(tmp)  # _evict() never touches .tmp files, so a failed build's would stay forever
+            except FileNotFoundError:
+                pass
+            raise
+        if not n:
+            os.remove(tmp)
+            return None
+        os.replace(tmp, path)
+        self._evict(path)  # on the loop, so no file is removed between get() returning and the caller opening it
+        return path
 
-    _cur.execute(
+    def _evict(self, fresh: str) -> None:
         """
-        INSERT INTO attendance (user_id, full_name, date, status)
-        VALUES (?,?,?,?)
-        ON CONFLICT(user_id,date)
-        DO UPDATE SET status='Off', clock_in=NULL, clock_out=NULL, late_minutes=0, overtime_minutes=0
-        """,
-        (uid, name, today, "Off"),
+        Delete superseded versions of `fresh` and all but the newest `keep` cached files.
+        Only finished report files count; builds still writing (.tmp files, xlsxwriter
+        temp directories) are left alone, and files gone meanwhile are skipped.
+        """
+        stem = fresh.rsplit("_v", 1)[0] + "_v"
+        ext = os.path.splitext(fresh)[1]
+        stamped = []
+        for n in os.listdir(self.directory):
+            if n.startswith("report_") and not n.endswith(".tmp"):
+                f = os.path.join(self.directory, n)
+                try:
+                    stamped.append((os.path.getmtime(f), f))
+                except FileNotFoundError:
+                    continue
+        stamped.sort(reverse=True)
+        for i, (_, f) in enumerate(stamped):
+            if f != fresh and (i >= self._keep or (f.startswith(stem) and f.endswith(ext))):
+                try:
+                    os.remove(f)
+                except FileNotFoundError:
+                    pass
+
+    def prewarm(self, group_id: int, month: str, fmt: str = "xlsx") -> None:
+        """Build the group's report for a closed YYYY-MM month in the background (once per month)."""
+        if (group_id, month) in self._prewarmed:
+            return
+        self._prewarmed.add((group_id, month))
+        task = asyncio.ensure_future(self.get(group_id, *month_days(month), fmt))
+        self._tasks.add(task)
+        task.add_done_callback(self._prewarm_done)
+
+    def _prewarm_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Report prewarm failed: {task.exception()!r}")
+
+    async def close(self) -> None:
+        """Cancel background builds and stop the worker processes."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, True, cancel_futures=True)
+            self._pool = None
+
+
+reports = ReportCache(db, REPORT_CACHE_DIR, REPORT_WORKERS, REPORT_CACHE_FILES)
+
+
+# -------------------- ANALYTICS --------------------
+# One attendance row per staff-day, integers only so it loads straight into a numpy array;
+# lateness and overtime are measured against the planned shift exactly as in /report.
+# `kind` packs the status: 0 = on leave (off/sick), 1 = absent, 2 = clocked in, 3 = other.
+_ANALYTICS_SELECT = f"""
+    a.user_id, a.day,
+    CASE WHEN a.clock_in IS NOT NULL THEN 2 WHEN a.status = 'Absent' THEN 1
+         WHEN a.status IN ('Off', 'Sick') THEN 0 ELSE 3 END,
+    COALESCE({_SQL_LATE}, 0),
+    COALESCE({_SQL_OVERTIME}, 0),
+    COALESCE(c.end_minute - c.start_minute, 0),
+    COALESCE(a.clock_out - a.clock_in, 0)
+"""
+_ANALYTICS_COLUMNS = ["user_id", "day", "kind", "late", "overtime", "expected", "worked"]
+
+
+def _analytics_rows(conn: sqlite3.Connection, group_id: int, start: int, end: int) -> List[tuple]:
+    rows: List[tuple] = []
+    for schema, lo, hi in _day_parts(conn, start, end):
+        rows += conn.execute(
+            f"""
+            SELECT {_ANALYTICS_SELECT}
+            FROM {schema}.attendance a
+            LEFT JOIN {schema}.shift_calendar c ON c.group_id = a.group_id AND c.user_id = a.user_id AND c.day = a.day
+            WHERE a.group_id = ? AND a.day BETWEEN ? AND ?
+            """,
+            (group_id, lo, hi),
+        ).fetchall()
+    return rows
+
+
+def _staff_names(conn: sqlite3.Connection, group_id: int, user_ids: List[int]) -> Dict[int, str]:
+    """Latest known name of each user: live attendance first, then the staff list, else the id."""
+    marks = ",".join("?" * len(user_ids))
+    names = {uid: str(uid) for uid in user_ids}
+    names.update(conn.execute(f"SELECT user_id, full_name FROM staff WHERE group_id=? AND user_id IN ({marks})",
+                              (group_id, *user_ids)))
+    for uid, name, _ in conn.execute(
+        f"SELECT user_id, full_name, MAX(day) FROM attendance WHERE group_id=? AND user_id IN ({marks}) GROUP BY user_id",
+        (group_id, *user_ids),
+    ):
+        if name:
+            names[uid] = name
+    return names
+
+
+def _pct(part: float, whole: float) -> str:
+    return f"{100 * part / whole:.1f}%" if whole else "—"
+
+
+def _draw_trends(weekly, path: str) -> bool:
+    """Draw weekly late-arrival rate and overtime hours to a PNG at `path`; False without matplotlib."""
+    try:
+        from matplotlib.figure import Figure
+    except ImportError:
+        return False
+
+    weeks = [EPOCH + timedelta(days=int(w) * 7 - 3) for w in weekly.index]  # Monday of each week
+    fig = Figure(figsize=(8, 5), dpi=100)
+    late_ax, ot_ax = fig.subplots(2, 1, sharex=True)
+    late_ax.plot(weeks, weekly["late_rate"] * 100, marker=".")
+    late_ax.set_ylabel("Late arrivals %")
+    late_ax.grid(alpha=0.3)
+    ot_ax.bar(weeks, weekly["overtime"] / 60, width=5)
+    ot_ax.set_ylabel("Overtime h")
+    ot_ax.grid(alpha=0.3)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(path, format="png")
+    return True
+
+
+def build_analytics(conn: sqlite3.Connection, group_id: int, start: int, end: int, label: str,
+                    chart_path: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    """
+    Lateness, overtime, absence and punctuality analytics for the group over days [start, end].
+    Rows come from one pass over attendance joined to the shift calendar (archive files
+    included); every statistic is a vectorized pandas groupby over that frame. Returns
+    (Markdown summary or None without data, whether a trend chart was written to `chart_path`).
+    """
+    import numpy as np
+    import pandas as pd
+
+    rows = _analytics_rows(conn, group_id, start, end)
+    if not rows:
+        return None, False
+    df = pd.DataFrame(np.array(rows, dtype=np.int64), columns=_ANALYTICS_COLUMNS)
+    del rows
+
+    uid = df["user_id"]
+    clocked = df["kind"].eq(2)
+    df["absent"] = df["kind"].eq(1)
+    df["owed"] = df["kind"].gt(0)
+    late = clocked & (df["late"] > 0)
+    late_minutes = df.loc[late, "late"]
+    by_user = df.groupby("user_id")
+
+    # per-staff totals
+    per = pd.DataFrame({
+        "shifts": clocked.groupby(uid).sum(),
+        "late_days": late.groupby(uid).sum(),
+        "late_p90": late_minutes.groupby(uid[late]).quantile(0.9),
+        "absent": by_user["absent"].sum(),
+        "owed": by_user["owed"].sum(),
+        "overtime": by_user["overtime"].sum(),
+    })
+    per["absence_rate"] = per["absent"] / per["owed"].where(per["owed"] > 0)
+
+    # punctuality streaks: consecutive owed days clocked in on time (a late day or an absence
+    # ends one; days off and sick leave are skipped)
+    owed = df[df["owed"]].sort_values(["user_id", "day"])
+    on_time = owed["kind"].eq(2) & owed["late"].eq(0)
+    run = (~on_time).groupby(owed["user_id"]).cumsum()
+    streak = on_time.astype(np.int64).groupby([owed["user_id"], run]).cumsum()
+    per["best_streak"] = streak.groupby(owed["user_id"]).max()
+    per["streak"] = streak.groupby(owed["user_id"]).last()
+    per = per.fillna({"best_streak": 0, "streak": 0})
+
+    # weekly team trend (weeks start on Monday; day 0 was a Thursday)
+    week = (df["day"] + 3) // 7
+    weekly = pd.DataFrame({
+        "overtime": df.groupby(week)["overtime"].sum(),
+        "late_rate": late.groupby(week).sum() / clocked.groupby(week).sum().where(lambda n: n > 0),
+        "days": df.groupby(week)["day"].nunique(),
+    }).fillna(0)
+
+    shifts = int(clocked.sum())
+    lines = [
+        f"*Analytics {escape_md(label)}* — {len(per)} staff, {len(df)} staff-days",
+        f"• Absence rate: {_pct(df['absent'].sum(), df['owed'].sum())}",
+        f"• Late arrivals: {_pct(late.sum(), shifts)} of {shifts} shifts",
+    ]
+    if len(late_minutes):
+        p50, p90, p99 = late_minutes.quantile([0.5, 0.9, 0.99])
+        lines.append(f"• Lateness when late: p50 {p50:.0f}m, p90 {p90:.0f}m, p99 {p99:.0f}m")
+    expected, worked = df["expected"].sum(), df["worked"].sum()
+    lines.append(f"• Hours worked: {worked / 60:.1f}h of {expected / 60:.1f}h planned ({_pct(worked, expected)})")
+    trend = ""
+    full = weekly[weekly["days"] == 7]  # partial weeks at the range edges would skew the slope
+    if len(full) > 1:
+        trend = f", trend {int(round(np.polyfit(full.index, full['overtime'], 1)[0])):+d} min/week"
+    recent = ", ".join(f"{m / 60:.1f}h" for m in weekly["overtime"].tail(4))
+    lines.append(f"• Overtime: {df['overtime'].sum() / 60:.1f}h{trend} (last weeks: {recent})")
+
+    rankings = [
+        ("Most often late", per[per["late_days"] > 0].nlargest(ANALYTICS_TOP, ["late_days", "late_p90"]),
+         lambda r: f"{r.late_days} of {r.shifts} shifts, p90 {r.late_p90:.0f}m"),
+        ("Highest absence", per[per["absent"] > 0].nlargest(ANALYTICS_TOP, "absence_rate"),
+         lambda r: f"{r.absence_rate * 100:.1f}% ({r.absent} days)"),
+        ("Most overtime", per[per["overtime"] > 0].nlargest(ANALYTICS_TOP, "overtime"),
+         lambda r: f"{r.overtime / 60:.1f}h"),
+        ("Punctuality streaks", per[per["best_streak"] > 0].nlargest(ANALYTICS_TOP, ["best_streak", "streak"]),
+         lambda r: f"best {r.best_streak:.0f}, current {r.streak:.0f}"),
+    ]
+    names = _staff_names(conn, group_id, sorted({int(u) for _, top, _ in rankings for u in top.index}))
+    for title, top, fmt in rankings:
+        if len(top):
+            lines.append(f"*{title}:*")
+            lines.extend(f"  {i}. {escape_md(names[int(r.Index)])} — {fmt(r)}" for i, r in enumerate(top.itertuples(), 1))
+
+    charted = chart_path is not None and _draw_trends(weekly, chart_path)
+    return "\n".join(lines), charted
+
+
+# -------------------- ADMIN HELPERS --------------------
+async def run_absent_sweep() -> None:
+    """
+    Plan each group's shift calendar ahead, then mark every staff member without a record
+    as 'Absent' for all closed days since the group's last sweep (days off excepted). A
+    group's day counts as closed ABSENT_SWEEP_DELAY minutes after the latest shift it
+    plans ends; groups already swept through that day are skipped without a query.
+    Once a group's previous month is swept through, its report is built into the cache.
+    Runs every ABSENT_SWEEP_INTERVAL minutes and once at startup to backfill downtime.
+    With WORKERS, each worker sweeps only the groups it owns.
+    """
+    last_month_end = month_days(gmt5_now().strftime("%Y-%m"))[0] - 1
+    for cfg in await groups.all():
+        if not owns(cfg.group_id):
+            continue
+        await groups.extend_calendar(cfg)
+        through = last_closed_day(await groups.latest_end(cfg), ABSENT_SWEEP_DELAY)
+        if cfg.absent_swept_through is None or cfg.absent_swept_through < through:
+            start, n = await groups.state(cfg.group_id).absent_sweep(through)
+            cfg.absent_swept_through = through
+            if start is not None:
+                print(f"Absent sweep {cfg.group_id} {day_to_date(start)}..{day_to_date(through)}: {n} rows")
+        if cfg.absent_swept_through >= last_month_end:
+            reports.prewarm(cfg.group_id, day_to_date(last_month_end)[:7])
+
+
+async def absent_sweep_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """JobQueue callback for the periodic absence sweep."""
+    await run_absent_sweep()
+
+
+async def archive_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """JobQueue callback: move months older than ARCHIVE_KEEP_MONTHS closed ones into ARCHIVE_DIR."""
+    for month, n in await db.archive_before(archive_cutoff(ARCHIVE_KEEP_MONTHS)):
+        print(f"Archived {month}: {n} rows")
+
+
+def backup_name() -> str:
+    """File name for a backup taken now, e.g. exc_bot-20240131-2300.db.gz (sorts by time)."""
+    stem = os.path.splitext(os.path.basename(DB_FILE))[0]
+    return f"{stem}-{gmt5_now().strftime('%Y%m%d-%H%M')}.db.gz"
+
+
+def rotate_backups(directory: str, keep: int) -> List[str]:
+    """Delete all but the newest `keep` backups in `directory`; returns the deleted names."""
+    stem = os.path.splitext(os.path.basename(DB_FILE))[0]
+    names = sorted(n for n in os.listdir(directory) if n.startswith(f"{stem}-") and n.endswith(".db.gz"))
+    stale = names[:-keep] if keep > 0 else names
+    for n in stale:
+        os.remove(os.path.join(directory, n))
+    return stale
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """JobQueue callback for scheduled backups: snapshot into BACKUP_DIR, rotate, optionally upload."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    fname = backup_name()
+    path = os.path.join(BACKUP_DIR, fname)
+    size = await db.backup(path)
+    stale = await asyncio.to_thread(rotate_backups, BACKUP_DIR, BACKUP_KEEP)
+    print(f"Backup {path}: {size} bytes, {len(stale)} old backup(s) removed")
+    if BACKUP_CHAT_ID:
+        with open(path, "rb") as f:
+            await context.bot.send_document(BACKUP_CHAT_ID, InputFile(f, filename=fname), rate_limit_args=LOG_SEND)
+
+
+def parse_hhmm(s: str) -> str:
+    """Validate an HH:MM time and return it zero-padded. Raises ValueError on bad input."""
+    return datetime.strptime(s, "%H:%M").strftime("%H:%M")
+
+
+# -------------------- PAGINATION --------------------
+# Long listings are sent PAGE_SIZE rows at a time with Prev/Next buttons whose data is
+# "<kind>:<n|p>:<offset>:<cursor>[:<arg>...]". The cursor is the id of the row a page
+# continues from (keyset paging, so each tap fetches one page); the offset only numbers
+# the rows. PAGERS maps each kind to its renderer.
+Pager = Callable[[GroupConfig, Optional[int], bool, int, List[str]], Awaitable[Tuple[str, Optional[InlineKeyboardMarkup]]]]
+
+
+async def fetch_page(fetch: Callable[[Optional[int], bool], Awaitable[Tuple[list, int]]],
+                     cursor: Optional[int], backward: bool, offset: int) -> Tuple[list, int, int]:
+    """
+    Run fetch(cursor, backward) -> (rows, total) for the page after (or before) `cursor`
+    and return (rows, total, offset of the first row). Starts over at the first page when
+    the cursor row is gone or fewer than a page of rows precede it.
+    """
+    rows, total = await fetch(cursor, backward)
+    if cursor is not None and (not rows or (backward and len(rows) < PAGE_SIZE)):
+        rows, total = await fetch(None, False)
+        offset = 0
+    elif backward:
+        offset = max(0, offset - len(rows))
+    return rows, total, offset
+
+
+def page_buttons(kind: str, rows: list, key: Callable[[Any], int], offset: int, total: int,
+                 args: Tuple[str, ...] = ()) -> Optional[InlineKeyboardMarkup]:
+    """Prev/Next buttons for a page of `rows` starting at `offset`; key(row) is a row's cursor."""
+    tail = "".join(f":{a}" for a in args)
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"{kind}:p:{offset}:{key(rows[0])}{tail}"))
+    if offset + len(rows) < total:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"{kind}:n:{offset + len(rows)}:{key(rows[-1])}{tail}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def page_footer(offset: int, rows: list, total: int) -> str:
+    return f"\n_{offset + 1}–{offset + len(rows)} of {total}_" if total > len(rows) else ""
+
+
+async def on_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Prev/Next button of a paginated listing: render the requested page into the same message."""
+    query = update.callback_query
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
+
+    kind, direction, offset, cursor, *args = query.data.split(":")
+    text, markup = await PAGERS[kind](cfg, int(cursor), direction == "p", int(offset), args)
+    await query.answer()
+    try:
+        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):  # a repeated tap renders the same page
+            raise
+
+
+# -------------------- ADMIN COMMANDS --------------------
+async def cmd_setup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Bot admin: /setup [HH:MM HH:MM] [log_channel_id]  (sent in the group)
+    Register the group, or update its shift times and log channel. New groups get
+    SHIFT_START/SHIFT_END and LOG_CHANNEL_ID unless given.
+    """
+    if not await bot_admin_only(update, context):
+        return
+
+    msg = update.message
+    if not msg:
+        return
+
+    chat = update.effective_chat
+    if chat.type == ChatType.PRIVATE:
+        await msg.reply_text("❌ Send /setup in the group you want to register.")
+        return
+
+    args = list(context.args or [])
+    old = await groups.get(chat.id)
+    cfg = GroupConfig(chat.id, log_channel_id=LOG_CHANNEL_ID) if old is None else replace(old)
+    cfg.title = chat.title
+    try:
+        if len(args) in (1, 3):
+            cfg.log_channel_id = int(args.pop())
+        if len(args) == 2:
+            cfg.shift_start, cfg.shift_end = parse_hhmm(args[0]), parse_hhmm(args[1])
+        elif args:
+            raise ValueError("too many arguments")
+    except ValueError:
+        await msg.reply_text("Usage: /setup [HH:MM HH:MM] [log_channel_id]")
+        return
+
+    await groups.save(cfg)
+    verb = "Registered" if old is None else "Updated"
+    await msg.reply_text(
+        f"✅ {verb} this group: shift {cfg.shift_start}–{cfg.shift_end}, log channel {cfg.log_channel_id}."
     )
-    _conn.commit()
+    await bot_log(
+        context, cfg,
+        f"#setup\n• Admin: {escape_md(update.effective_user.full_name)}\n• {verb} group: {escape_md(chat.title or '')} "
+        f"({chat.id}), shift {cfg.shift_start}–{cfg.shift_end}",
+    )
+
+
+async def cmd_groups(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Bot admin: /groups
+    List every registered group with its shift times and log channel.
+    """
+    if not await bot_admin_only(update, context):
+        return
+
+    # other workers of a sharded bot may have registered groups since this one loaded them
+    configs = [GroupConfig(*row) for row in await db.load_groups()] if WORKERS else await groups.all()
+    rows = sorted(configs, key=lambda c: (c.title or "", c.group_id))
+    if not rows:
+        await update.message.reply_text("No groups.")
+        return
+
+    lines = [
+        f"• {escape_md(c.title or str(c.group_id))} — `{c.group_id}` {c.shift_start}–{c.shift_end} log `{c.log_channel_id}`"
+        for c in rows
+    ]
+    await update.message.reply_text("*Groups:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+
+def describe_shift(shift: Shift) -> str:
+    """Human-readable shift times, e.g. '22:00–06:00 (next day)' or 'off'."""
+    start, end = shift
+    if start is None or end is None:
+        return "off"
+    return f"{fmt_minutes(start)}–{fmt_minutes(end)}" + (" (next day)" if end > 1440 else "")
+
+
+def describe_scope(user_id: int, weekday: int) -> str:
+    """Who and when a shift definition applies to, e.g. 'all staff, every day' or 'user 42, Fri'."""
+    who = "all staff" if user_id == 0 else f"user {user_id}"
+    when = "every day" if weekday < 0 else WEEKDAYS[weekday].capitalize()
+    return f"{who}, {when}"
 
-    conf_msg = await context.bot.send_message(
-        chat_id=msg.chat_id,
-        text=f"📘 Marked Off for [{escape_md(name)}](tg://user?id={uid})",
-        parse_mode=ParseMode.MARKDOWN,
-    )
 
-    await log_action_detailed(
-        context=context,
-        tag="off",
-        user_id=uid,
-        user_name=name,
-        shift_start=SHIFT_START,
-        late_minutes=0,
-        overtime_minutes=0,
-        status="Off",
-        conf_chat_id=conf_msg.chat.id,
-        conf_message_id=conf_msg.message_id,
-    )
+async def cmd_shift(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin: /shift [HH:MM HH:MM | off | clear] [mon..sun] [user_id]  OR reply for one staff member
+    Without arguments, list the group's shift definitions. Otherwise define the shift for
+    the whole group or one staff member, every day or on one weekday; an end at or before
+    the start runs past midnight. `off` plans a day off, `clear` drops a definition.
+    The shift calendar is re-planned from today.
+    """
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
 
+    msg = update.message
+    if not msg:
+        return
 
-# -------------------- ADMIN HELPERS --------------------
-def auto_absent() -> None:
-    """
-    For every staff member, insert an 'Absent' record for today if nothing exists.
-    Run before monthly checks to ensure missing days are marked.
-    """
-    today = today_str()
-    _cur.execute("SELECT user_id, full_name FROM staff")
-    staff_rows = _cur.fetchall()
-    for uid, name in staff_rows:
-        _cur.execute("SELECT id FROM attendance WHERE user_id=? AND date=?", (uid, today))
-        if not _cur.fetchone():
-            _cur.execute(
-                """
-                INSERT OR IGNORE INTO attendance(user_id, full_name, date, status)
-                VALUES (?, ?, ?, 'Absent')
-                """,
-                (uid, name, today),
-            )
-    _conn.commit()
+    args = list(context.args or [])
+    if not args:
+        defs = await groups.shifts(cfg.group_id)
+        lines = [f"• Default ({describe_scope(0, -1)}): {describe_shift(cfg.shift())}"]
+        lines += [f"• {describe_scope(uid, wd)}: {describe_shift(sh)}" for (uid, wd), sh in sorted(defs.items())]
+        await msg.reply_text("Shifts:\n" + "\n".join(lines))
+        return
+
+    uid = msg.reply_to_message.from_user.id if msg.reply_to_message else 0
+    try:
+        action = args[0].lower()
+        if action in ("off", "clear"):
+            args.pop(0)
+            shift: Shift = (None, None)
+        else:
+            action = "set"
+            shift = shift_minutes(parse_hhmm(args[0]), parse_hhmm(args[1]))
+            del args[:2]
+        weekday = -1
+        if args and args[0].lower() in WEEKDAYS + ["all"]:
+            day_name = args.pop(0).lower()
+            weekday = -1 if day_name == "all" else WEEKDAYS.index(day_name)
+        if args:
+            uid = int(args.pop(0))
+        if args:
+            raise ValueError("too many arguments")
+    except (ValueError, IndexError):
+        await msg.reply_text("Usage: /shift [HH:MM HH:MM | off | clear] [mon..sun] [user_id] OR reply")
+        return
+
+    scope = describe_scope(uid, weekday)
+    if action == "clear":
+        if not await groups.clear_shift(cfg, uid, weekday):
+            await msg.reply_text(f"No shift defined for {scope}.")
+            return
+        text = f"Cleared shift for {scope}"
+    else:
+        await groups.set_shift(cfg, uid, weekday, shift)
+        text = f"Shift for {scope}: {describe_shift(shift)}"
+    await msg.reply_text(f"✅ {text}.")
+    await bot_log(context, cfg, f"#shift\n• Admin: {escape_md(update.effective_user.full_name)}\n• {escape_md(text)}")
 
 
-# -------------------- ADMIN COMMANDS --------------------
 async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /add <id> <Full Name>  OR reply to user
-    Adds staff to staff table.
+    Adds staff to the group's staff table.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
     msg = update.message
@@ -466,19 +3591,19 @@ async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         uid = int(context.args[0])
         name = " ".join(context.args[1:])
 
-    _cur.execute("INSERT OR REPLACE INTO staff(user_id, full_name) VALUES (?,?)", (uid, name))
-    _conn.commit()
+    await groups.state(cfg.group_id).add_staff(uid, name)
     await msg.reply_text(f"✅ Added staff: {name}")
     # Log admin action (not as detailed as staff logs)
-    await bot_log(context, f"#add\n• Admin: {escape_md(update.effective_user.full_name)}\n• Added staff: {escape_md(name)} ({uid})")
+    await bot_log(context, cfg, f"#add\n• Admin: {escape_md(update.effective_user.full_name)}\n• Added staff: {escape_md(name)} ({uid})")
 
 
 async def cmd_rm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /rm <id> OR reply
-    Remove staff from staff table.
+    Remove staff from the group's staff table.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
     msg = update.message
@@ -493,223 +3618,493 @@ async def cmd_rm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             return
         uid = int(context.args[0])
 
-    _cur.execute("DELETE FROM staff WHERE user_id=?", (uid,))
-    _conn.commit()
+    await groups.state(cfg.group_id).remove_staff(uid)
     await msg.reply_text("✅ Removed staff.")
-    await bot_log(context, f"#rm\n• Admin: {escape_md(update.effective_user.full_name)}\n• Removed staff: {uid}")
+    await bot_log(context, cfg, f"#rm\n• Admin: {escape_md(update.effective_user.full_name)}\n• Removed staff: {uid}")
+
+
+ROSTER_ID_COLUMNS = ("user_id", "id", "user id", "telegram id")
+ROSTER_NAME_COLUMNS = ("full_name", "name", "full name", "staff name")
+ROSTER_MAX_ERRORS = 10  # problems listed when a roster file is rejected
+
+
+def _xlsx_first_sheet(z: zipfile.ZipFile) -> str:
+    """
+    Archive path of the workbook's first visible worksheet, in the order the workbook lists
+    its sheets (sheetN.xml numbers do not follow it once sheets are moved or deleted).
+    """
+    from xml.etree import ElementTree
+
+    ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    rel = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+    try:
+        book = ElementTree.fromstring(z.read("xl/workbook.xml"))
+        rels = ElementTree.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+    except KeyError:
+        raise ValueError("not an .xlsx workbook")
+    targets = {r.get("Id"): r.get("Target", "") for r in rels.iter("{http://schemas.openxmlformats.org/package/2006/relationships}Relationship")}
+    for sheet in book.iter(f"{ns}sheet"):
+        if sheet.get("state") in ("hidden", "veryHidden"):
+            continue
+        target = targets.get(sheet.get(rel), "")
+        path = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+        if path in z.namelist():
+            return path
+    raise ValueError("no worksheet in the file")
+
+
+def _xlsx_rows(data: bytes) -> Iterator[List[str]]:
+    """
+    Cell text of the first visible worksheet of an .xlsx file, row by row. Reads the sheet XML
+    directly (shared and inline strings, numbers), so importing a roster needs no
+    spreadsheet library.
+    """
+    from xml.etree import ElementTree
+
+    ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        names = ["xl/sharedStrings.xml", _xlsx_first_sheet(z)]
+        if sum(z.getinfo(n).file_size for n in names if n in z.namelist()) > 20 * ROSTER_MAX_BYTES:
+            raise ValueError("the worksheet is too large")
+        strings = []
+        if names[0] in z.namelist():
+            for si in ElementTree.fromstring(z.read(names[0])).iter(f"{ns}si"):
+                strings.append("".join(t.text or "" for t in si.iter(f"{ns}t")))
+        emitted = 0
+        for row in ElementTree.fromstring(z.read(names[1])).iter(f"{ns}row"):
+            for _ in range(emitted + 1, int(row.get("r", emitted + 1))):
+                emitted += 1
+                yield []  # blank rows are not stored; keep row numbers as the sheet shows them
+            emitted += 1
+            cells: Dict[int, str] = {}
+            for i, c in enumerate(row.iter(f"{ns}c")):
+                ref = re.match(r"[A-Z]+", c.get("r", ""))
+                col = functools.reduce(lambda n, ch: n * 26 + ord(ch) - 64, ref.group(0), 0) - 1 if ref else i
+                if c.get("t") == "inlineStr":
+                    cells[col] = "".join(t.text or "" for t in c.iter(f"{ns}t"))
+                else:
+                    v = c.find(f"{ns}v")
+                    text = (v.text or "") if v is not None else ""
+                    cells[col] = strings[int(text)] if c.get("t") == "s" and text else text
+            yield [cells.get(i, "") for i in range(max(cells) + 1)] if cells else []
+
+
+def _csv_rows(data: bytes) -> Iterator[List[str]]:
+    """Rows of a CSV file (UTF-8, optional BOM); the delimiter (, ; or tab) is sniffed."""
+    text = data.decode("utf-8-sig")
+    try:
+        dialect: Any = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text, newline=""), dialect)  # quoted fields may span lines
+
+
+def _roster_user_id(text: str) -> int:
+    """A Telegram user id from a cell; spreadsheets may hand it over as 123.0 or 1.23E+8."""
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+        if not value.is_integer():
+            raise
+        return int(value)
+
+
+def read_roster(data: bytes, filename: str) -> Tuple[Dict[int, str], List[str]]:
+    """
+    Parse a roster file (.csv or .xlsx) into ({user_id: full_name}, problems).
+    Columns are user_id and full_name, found by header (a /report export works too) or,
+    without a header row, taken as the first two. Repeated ids must carry the same name.
+    The roster is only usable when the problem list is empty.
+    """
+    try:
+        rows = list(_xlsx_rows(data) if filename.lower().endswith(".xlsx") else _csv_rows(data))
+    except (ValueError, KeyError, UnicodeDecodeError, csv.Error, zipfile.BadZipFile) as e:
+        return {}, [f"Cannot read {filename}: {e}"]
+    rows = [(n, [cell.strip() for cell in row]) for n, row in enumerate(rows, 1) if any(c.strip() for c in row)]
+    if not rows:
+        return {}, ["The file has no rows."]
+
+    id_col, name_col = 0, 1
+    header = [cell.lower() for cell in rows[0][1]]
+    try:
+        _roster_user_id(header[0])
+    except (ValueError, IndexError):
+        id_col = next((i for i, c in enumerate(header) if c in ROSTER_ID_COLUMNS), -1)
+        name_col = next((i for i, c in enumerate(header) if c in ROSTER_NAME_COLUMNS), -1)
+        if id_col < 0 or name_col < 0:
+            return {}, ["The header needs a user_id and a full_name column."]
+        rows = rows[1:]
+
+    roster: Dict[int, str] = {}
+    problems: List[str] = []
+    for n, row in rows:
+        cells = row + [""] * (max(id_col, name_col) + 1 - len(row))
+        name = " ".join(cells[name_col].split())
+        try:
+            uid = _roster_user_id(cells[id_col])
+        except ValueError:
+            problems.append(f"Row {n}: bad user id {cells[id_col]!r}.")
+            continue
+        if not name:
+            problems.append(f"Row {n}: no name for {uid}.")
+        elif roster.setdefault(uid, name) != name:
+            problems.append(f"Row {n}: {uid} is listed as both {roster[uid]!r} and {name!r}.")
+    if not roster and not problems:
+        problems.append("The file lists no staff.")
+    return roster, problems
+
+
+def describe_roster_diff(diff: RosterDiff, limit: int = 10) -> List[str]:
+    """Bullet lines for a roster diff: a count per change kind, naming up to `limit` staff each."""
+
+    def names(items: List[str]) -> str:
+        more = f", … +{len(items) - limit}" if len(items) > limit else ""
+        return ", ".join(items[:limit]) + more
+
+    lines = []
+    if diff.added:
+        lines.append(f"• Added {len(diff.added)}: " + names([f"{escape_md(n)} ({u})" for u, n in diff.added]))
+    if diff.renamed:
+        lines.append(f"• Renamed {len(diff.renamed)}: "
+                     + names([f"{escape_md(o)} → {escape_md(n)} ({u})" for u, o, n in diff.renamed]))
+    if diff.removed:
+        lines.append(f"• Removed {len(diff.removed)}: " + names([f"{escape_md(n)} ({u})" for u, n in diff.removed]))
+    return lines
+
+
+async def cmd_roster(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin: /roster [merge] as the caption of a CSV/XLSX file, or in reply to one
+    Syncs the group's staff with the file in one transaction: new ids are added, changed
+    names renamed and (unless `merge`) staff missing from the file removed. Nothing is
+    applied if any row is invalid; the whole sync is logged as one entry.
+    """
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
+
+    msg = update.message
+    if not msg:
+        return
+
+    # captions are not parsed by CommandHandler, so context.args is only set for the reply form
+    args = context.args if context.args is not None else (msg.caption or "").split()[1:]
+    doc = msg.document or (msg.reply_to_message.document if msg.reply_to_message else None)
+    if doc is None or args not in ([], ["merge"]):
+        await msg.reply_text("Usage: send a CSV/XLSX file (user_id, full_name) with caption /roster [merge], "
+                             "or reply /roster [merge] to one")
+        return
+    name = doc.file_name or "roster.csv"
+    if not name.lower().endswith((".csv", ".xlsx")):
+        await msg.reply_text("❌ The roster must be a .csv or .xlsx file.")
+        return
+    if (doc.file_size or 0) > ROSTER_MAX_BYTES:
+        await msg.reply_text(f"❌ The roster file is larger than {ROSTER_MAX_BYTES // 1000} KB.")
+        return
+
+    data = bytes(await (await doc.get_file()).download_as_bytearray())
+    roster, problems = await asyncio.to_thread(read_roster, data, name)
+    if problems:
+        more = f"\n… and {len(problems) - ROSTER_MAX_ERRORS} more" if len(problems) > ROSTER_MAX_ERRORS else ""
+        await msg.reply_text("❌ Roster not applied:\n" + "\n".join(problems[:ROSTER_MAX_ERRORS]) + more)
+        return
+
+    diff = await groups.state(cfg.group_id).sync_staff(roster, remove=not args)
+    if not diff:
+        await msg.reply_text(f"✅ Staff already match {name} ({len(roster)} staff).")
+        return
+    await msg.reply_text(
+        f"✅ Roster applied: {len(diff.added)} added, {len(diff.renamed)} renamed, {len(diff.removed)} removed."
+    )
+    text = "\n".join([
+        "#roster",
+        f"• Admin: {escape_md(update.effective_user.full_name)}",
+        f"• File: {escape_md(name)} ({len(roster)} staff{', merge' if args else ''})",
+        *describe_roster_diff(diff),
+    ])
+    await bot_log(context, cfg, text)
 
 
 async def cmd_staff(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /staff
-    List all staff members.
+    List all staff members of the group.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
-    _cur.execute("SELECT user_id, full_name FROM staff ORDER BY full_name")
-    rows = _cur.fetchall()
+    text, markup = await staff_page(cfg, None, False, 0, [])
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+
+async def staff_page(cfg: GroupConfig, cursor: Optional[int], backward: bool, offset: int,
+                     args: List[str]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Pager for /staff: one page of the staff list by name."""
+    rows, total, offset = await fetch_page(
+        lambda c, b: db.staff_page(cfg.group_id, c, b, PAGE_SIZE), cursor, backward, offset
+    )
     if not rows:
-        await update.message.reply_text("No staff.")
-        return
+        return "No staff.", None
 
     lines = [f"• [{escape_md(n)}](tg://user?id={uid}) — `{uid}`" for uid, n in rows]
-    await update.message.reply_text("*Staff List:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+    text = "*Staff List:*\n" + "\n".join(lines) + page_footer(offset, rows, total)
+    return text, page_buttons("staff", rows, lambda r: r[0], offset, total)
 
 
 async def cmd_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Admin: /check <id> or reply
-    Show monthly attendance summary for the user (current month).
+    Admin: /check <id> [days]  OR reply with /check [days]
+    Show monthly attendance summary for the user (current month) from the precomputed
+    monthly totals; the per-day breakdown is only fetched when `days` is given, a page at a time.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
-    auto_absent()
     msg = update.message
     if not msg:
         return
 
-    now = gmt5_now()
-    month = now.strftime("%Y-%m")
+    month = gmt5_now().strftime("%Y-%m")
+
+    args = list(context.args or [])
+    want_days = "days" in args
+    if want_days:
+        args.remove("days")
 
     if msg.reply_to_message:
         uid = msg.reply_to_message.from_user.id
     else:
-        if not context.args:
-            await msg.reply_text("Usage: reply or /check <id>")
+        if not args:
+            await msg.reply_text("Usage: reply or /check <id> [days]")
             return
-        uid = int(context.args[0])
+        uid = int(args[0])
 
-    _cur.execute("SELECT full_name FROM staff WHERE user_id=?", (uid,))
-    row = _cur.fetchone()
-    if not row:
+    name = await groups.state(cfg.group_id).staff_name(uid)
+    if name is None:
         await msg.reply_text("Staff not found.")
         return
-    name = row[0]
 
-    _cur.execute(
-        """
-        SELECT date, clock_in, clock_out, status, late_minutes, overtime_minutes
-        FROM attendance
-        WHERE user_id=? AND date LIKE ?
-        ORDER BY date
-        """,
-        (uid, f"{month}%"),
-    )
-    rows = _cur.fetchall()
-    if not rows:
-        await msg.reply_text("No records this month.")
-        return
+    if want_days:
+        text, markup = await check_page(cfg, None, False, 0, [str(uid), month])
+    else:
+        found = await check_summary(cfg, uid, month)
+        text, markup = found[0] if found else "No records this month.", None
+    await msg.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
 
-    total_late = sum((r[4] or 0) for r in rows)
-    total_ot = sum((r[5] or 0) for r in rows)
-    total_hours = 0.0
-    details = []
 
-    for d, cin, cout, st, late, ot in rows:
-        worked = 0.0
-        if cin and cout:
-            try:
-                t1 = datetime.strptime(f"{d} {cin}", "%Y-%m-%d %H:%M")
-                t2 = datetime.strptime(f"{d} {cout}", "%Y-%m-%d %H:%M")
-                worked = round((t2 - t1).total_seconds() / 3600, 2)
-                total_hours += worked
-            except Exception:
-                worked = 0.0
-        details.append(f"• {d} — In:{cin or '-'} Out:{cout or '-'} {st} Late:{late or 0}m OT:{ot or 0}m Worked:{worked}h")
+async def check_summary(cfg: GroupConfig, uid: int, month: str) -> Optional[Tuple[str, int]]:
+    """The /check summary text for a YYYY-MM month and its number of days on record; None without records."""
+    summary = await db.month_summary(cfg.group_id, uid, month)
+    if not summary:
+        return None
+    total_late, total_ot, worked_m, days, absent, sick, off = summary
+    expected_m = await db.month_expected(cfg.group_id, uid, month, today_day())
+    name = await groups.state(cfg.group_id).staff_name(uid) or str(uid)
 
     text = (
-        f"*Summary for {escape_md(name)} — {now.strftime('%B %Y')}*\n"
+        f"*Summary for {escape_md(name)} — {datetime.strptime(month, '%Y-%m').strftime('%B %Y')}*\n"
         f"• Total Late: {total_late} minutes\n"
         f"• Total OT: {total_ot} minutes\n"
-        f"• Total Hours: {round(total_hours,2)}\n\n"
-        "*Daily:* \n" + "\n".join(details)
+        f"• Total Hours: {round(worked_m / 60, 2)} (Expected: {round(expected_m / 60, 2)})\n"
+        f"• Days: {days} (Absent: {absent}, Sick: {sick}, Off: {off})"
     )
-    await msg.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+    return text, days
+
+
+async def check_page(cfg: GroupConfig, cursor: Optional[int], backward: bool, offset: int,
+                     args: List[str]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Pager for /check <id> days (args: user id, month): the summary and one page of days."""
+    uid, month = int(args[0]), args[1]
+    found = await check_summary(cfg, uid, month)
+    if found is None:
+        return "No records this month.", None
+    text, days = found
+
+    async def fetch(c: Optional[int], b: bool) -> Tuple[list, int]:
+        return await db.month_attendance(cfg.group_id, uid, month, c, b, PAGE_SIZE), days
+
+    rows, total, offset = await fetch_page(fetch, cursor, backward, offset)
+    details = []
+    for d, cin, cout, st, late, ot in rows:
+        worked = round((cout - cin) / 60, 2) if cin is not None and cout is not None else 0.0
+        details.append(
+            f"• {day_to_date(d)} — In:{fmt_minutes(cin) or '-'} Out:{fmt_minutes(cout) or '-'} "
+            f"{st} Late:{late or 0}m OT:{ot or 0}m Worked:{worked}h"
+        )
+    text += "\n\n*Daily:* \n" + "\n".join(details) + page_footer(offset, rows, total)
+    return text, page_buttons("check", rows, lambda r: r[0], offset, total, (str(uid), month))
 
 
 async def cmd_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Admin: /report
-    Generate an Excel monthly report for all attendance and send as file.
+    Admin: /report [YYYY-MM | YYYY-MM-DD YYYY-MM-DD] [xlsx|csv|gz]
+    Generate the group's attendance report for a month (default: current) or date range and send as file.
+    Files are built in a worker process and cached until the range's data changes, so a repeat is instant.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
-    # Optionally fill absent for today before generating aggregate
-    auto_absent()
-    df = pd.read_sql_query(
-        """
-        SELECT user_id, full_name, date, clock_in, clock_out, status, late_minutes, overtime_minutes
-        FROM attendance
-        ORDER BY date
-        """,
-        _conn,
-    )
+    try:
+        start, end, fmt, label = parse_report_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text("Usage: /report [YYYY-MM | YYYY-MM-DD YYYY-MM-DD] [xlsx|csv|gz]")
+        return
 
-    if df.empty:
+    fname = f"exc_report_{label}.{fmt}"
+    path = await reports.get(cfg.group_id, date_to_day(start), date_to_day(end), fmt)
+    if path is None:
         await update.message.reply_text("No data.")
         return
+    with open(path, "rb") as f:
+        await update.message.reply_document(InputFile(f, filename=fname))
+    await bot_log(context, cfg, f"#report\n• Admin: {escape_md(update.effective_user.full_name)}\n• Report: {fname} sent.")
+
 
-    bio = io.BytesIO()
-    fname = f"exc_report_{gmt5_now().strftime('%Y-%m')}.xlsx"
-    bio.name = fname
+async def cmd_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin: /analytics [YYYY-MM | YYYY-MM-DD YYYY-MM-DD] [chart]
+    Summarize lateness percentiles, absence rates, overtime trend and punctuality streaks for a
+    month (default: current) or date range, optionally with a weekly trend chart.
+    """
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
 
-    # Write excel to memory
-    with pd.ExcelWriter(bio, engine="xlsxwriter") as w:
-        df.to_excel(w, index=False, sheet_name="Attendance")
+    args = list(context.args or [])
+    chart = bool(args) and args[-1].lower() == "chart"
+    if chart:
+        args.pop()
+    try:
+        start, end, label = parse_range(args)
+    except ValueError:
+        await update.message.reply_text("Usage: /analytics [YYYY-MM | YYYY-MM-DD YYYY-MM-DD] [chart]")
+        return
 
-    bio.seek(0)
-    await update.message.reply_document(InputFile(bio, filename=fname))
-    await bot_log(context, f"#report\n• Admin: {escape_md(update.effective_user.full_name)}\n• Report: {fname} sent.")
+    tmpdir = tempfile.mkdtemp(prefix="exc_analytics_") if chart else None
+    try:
+        path = os.path.join(tmpdir, f"exc_analytics_{label}.png") if tmpdir else None
+        text, charted = await db.analytics(cfg.group_id, date_to_day(start), date_to_day(end), label, path)
+        if text is None:
+            await update.message.reply_text("No data.")
+            return
+        if chart and not charted:
+            text += "\n_Chart unavailable: matplotlib is not installed._"
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        if charted:
+            with open(path, "rb") as f:
+                await update.message.reply_photo(f)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
 
 async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /status
-    Show today's attendance (summarized).
+    Show the group's attendance today (summarized).
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
-    today = today_str()
-    _cur.execute(
-        """
-        SELECT full_name, user_id, clock_in, clock_out, status
-        FROM attendance
-        WHERE date=?
-        ORDER BY full_name
-        """,
-        (today,),
+    text, markup = await status_page(cfg, None, False, 0, [])
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+
+async def status_page(cfg: GroupConfig, cursor: Optional[int], backward: bool, offset: int,
+                      args: List[str]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Pager for /status: one page of today's attendance by name."""
+    st = groups.state(cfg.group_id)
+    rows, total, offset = await fetch_page(
+        lambda c, b: st.today_page(c, b, PAGE_SIZE), cursor, backward, offset
     )
-    rows = _cur.fetchall()
     if not rows:
-        await update.message.reply_text("No attendance today.")
-        return
+        return "No attendance today.", None
 
     lines = []
-    for name, uid, cin, cout, st in rows:
+    for uid, rec in rows:
+        name, cin, cout, status = rec.full_name, fmt_minutes(rec.clock_in), fmt_minutes(rec.clock_out), rec.status
         if cin and cout:
             lines.append(f"• [{escape_md(name)}](tg://user?id={uid}) In:`{cin}` Out:`{cout}`")
         elif cin:
             lines.append(f"• [{escape_md(name)}](tg://user?id={uid}) In:`{cin}`")
         else:
-            lines.append(f"• [{escape_md(name)}](tg://user?id={uid}) — {st}")
+            lines.append(f"• [{escape_md(name)}](tg://user?id={uid}) — {status}")
+
+    text = "*Today's attendance:*\n" + "\n".join(lines) + page_footer(offset, rows, total)
+    return text, page_buttons("status", rows, lambda r: r[0], offset, total)
 
-    await update.message.reply_text("*Today's attendance:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+PAGERS: Dict[str, Pager] = {"staff": staff_page, "status": status_page, "check": check_page}
 
 
 async def cmd_backup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Admin: /backup
-    Send the sqlite DB file to admin.
+    Bot admin: /backup
+    Send a consistent, gzip-compressed snapshot of the DB (every group's data) to the admin.
+    The snapshot is taken online on the DB maintenance thread, so the bot keeps serving.
     """
-    if not await admin_only(update, context):
+    if not await bot_admin_only(update, context):
         return
 
-    if os.path.exists(DB_FILE):
-        await update.message.reply_document(InputFile(DB_FILE))
-        await bot_log(context, f"#backup\n• Admin: {escape_md(update.effective_user.full_name)}\n• Backup sent.")
-    else:
+    if not os.path.exists(DB_FILE):
         await update.message.reply_text("DB file not found.")
+        return
+
+    fname = backup_name()
+    tmpdir = tempfile.mkdtemp(prefix="exc_backup_")
+    try:
+        path = os.path.join(tmpdir, fname)
+        await db.backup(path)
+        with open(path, "rb") as f:
+            await update.message.reply_document(InputFile(f, filename=fname))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    await _send_log(context.bot, LOG_CHANNEL_ID, f"#backup\n• Admin: {escape_md(update.effective_user.full_name)}\n• Backup sent.")
 
 
 async def cmd_reset(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /reset
-    Delete all attendance records (use with caution).
+    Delete all of the group's attendance records (use with caution).
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
-    _cur.execute("DELETE FROM attendance")
-    _conn.commit()
+    await groups.state(cfg.group_id).reset_all(update.effective_user.id)
     await update.message.reply_text("✅ All attendance records cleared.")
-    await bot_log(context, f"#reset\n• Admin: {escape_md(update.effective_user.full_name)}\n• Cleared all attendance.")
+    await bot_log(context, cfg, f"#reset\n• Admin: {escape_md(update.effective_user.full_name)}\n• Cleared all attendance.")
 
 
 async def cmd_reset_clock(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /reset_clock
-    Delete attendance records for today only.
+    Delete the group's attendance records for today only.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
     t = today_str()
-    _cur.execute("DELETE FROM attendance WHERE date=?", (t,))
-    _conn.commit()
+    await groups.state(cfg.group_id).reset_day(date_to_day(t), update.effective_user.id)
     await update.message.reply_text("✅ Today's attendance cleared.")
-    await bot_log(context, f"#reset_clock\n• Admin: {escape_md(update.effective_user.full_name)}\n• Reset today's attendance ({t}).")
+    await bot_log(context, cfg, f"#reset_clock\n• Admin: {escape_md(update.effective_user.full_name)}\n• Reset today's attendance ({t}).")
 
 
 async def cmd_undone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Admin: /undone <user_id> <date?>  OR reply
-    Undo clock_out (clear clock_out, reset overtime, set status to Clocked In).
+    Undo the user's latest clock-out of the day: the day is replayed without it, so it
+    returns to exactly the state it had before that clock-out.
     """
-    if not await admin_only(update, context):
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
         return
 
     msg = update.message
@@ -733,20 +4128,420 @@ async def cmd_undone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await msg.reply_text("❌ Invalid date format. Use YYYY-MM-DD.")
         return
 
-    _cur.execute(
-        """
-        UPDATE attendance
-        SET clock_out=NULL, overtime_minutes=0, status='Clocked In'
-        WHERE user_id=? AND date=?
-        """,
-        (uid, date_s),
-    )
-    _conn.commit()
+    if not await groups.state(cfg.group_id).undo_clock_out(uid, date_to_day(date_s), update.effective_user.id):
+        await msg.reply_text(f"ℹ️ No clock-out to undo for user {uid} on {date_s}.")
+        return
     await msg.reply_text(f"↩️ Clock-out undone for user {uid} on {date_s}.")
-    await bot_log(context, f"#undone\n• Admin: {escape_md(update.effective_user.full_name)}\n• Undone clock-out for {uid} on {date_s}")
+    await bot_log(context, cfg, f"#undone\n• Admin: {escape_md(update.effective_user.full_name)}\n• Undone clock-out for {uid} on {date_s}")
+
+
+async def cmd_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin: /history <user_id> <date?>  OR reply
+    List every recorded change to the user's attendance on the day (default today),
+    oldest first, with who made it and when.
+    """
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
+
+    msg = update.message
+    if not msg:
+        return
+
+    args = list(context.args)
+    try:
+        uid = msg.reply_to_message.from_user.id if msg.reply_to_message else int(args.pop(0))
+        date_s = args.pop(0) if args else today_str()
+        day = date_to_day(date_s)
+    except (ValueError, IndexError):
+        await msg.reply_text("Usage: /history <user_id> <date YYYY-MM-DD (optional)> OR reply")
+        return
+
+    events = await db.history(cfg.group_id, uid, day)
+    if not events:
+        await msg.reply_text(f"No attendance history for user {uid} on {date_s}.")
+        return
+    undone = {e[8] for e in events if e[1] == "undone"}
+    lines = [f"*History of {uid} on {date_s}:*"]
+    for seq, kind, name, cin, cout, status, late, overtime, ref, actor, at in events:
+        detail = {
+            "import": f"{status or '-'} {fmt_minutes(cin) or '-'}–{fmt_minutes(cout) or '-'}",
+            "clockin": f"{fmt_minutes(cin)}, late {late}m",
+            "clockout": f"{fmt_minutes(cout)}, overtime {overtime}m",
+            "undone": "clock-out" if ref is None else f"clock-out #{ref}",
+        }.get(kind, "")
+        by = "" if actor in (None, uid) else f" by {actor}"
+        when = datetime.fromtimestamp(at, GMT5).strftime("%m-%d %H:%M")
+        strike = " (undone)" if seq in undone else ""
+        lines.append(f"• #{seq} `{when}` {kind} {escape_md(detail)}{strike}{by}")
+    for chunk in chunk_lines(lines, sep="\n"):
+        await msg.reply_text(chunk, parse_mode=ParseMode.MARKDOWN)
+
+
+async def cmd_rebuild(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin: /rebuild
+    Rebuild the group's live attendance from its event log and report any rows that had drifted.
+    """
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
+
+    rows, drifted = await groups.state(cfg.group_id).rebuild()
+    await update.message.reply_text(f"✅ Rebuilt {rows} attendance rows from the event log; {drifted} had drifted.")
+    if drifted:
+        await bot_log(context, cfg, f"#rebuild\n• Admin: {escape_md(update.effective_user.full_name)}\n• {drifted} drifted rows repaired")
+
+
+async def cmd_backfill(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin: /backfill <from YYYY-MM-DD> <to YYYY-MM-DD (optional)>
+    Mark the group's staff without a record as Absent for every day in the range. The
+    range ends at the last closed day at the latest (staff can still clock in after that)
+    and spans at most BACKFILL_MAX_DAYS days.
+    """
+    cfg = await resolve_group(update, context)
+    if cfg is None or not await admin_only(update, context, cfg.group_id):
+        return
+
+    msg = update.message
+    if not msg:
+        return
+
+    if not context.args:
+        await msg.reply_text("Usage: /backfill <from YYYY-MM-DD> <to YYYY-MM-DD (optional)>")
+        return
+    closed = last_closed_day(await groups.latest_end(cfg))
+    start = context.args[0]
+    end = context.args[1] if len(context.args) > 1 else day_to_date(closed)
+    try:
+        start_day, end_day = date_to_day(start), date_to_day(end)
+    except Exception:
+        await msg.reply_text("❌ Invalid date format. Use YYYY-MM-DD.")
+        return
+    if start_day > end_day:
+        await msg.reply_text("❌ The start date is after the end date.")
+        return
+    if end_day > closed:
+        end_day, end = closed, day_to_date(closed)
+        if start_day > end_day:
+            await msg.reply_text(f"❌ Nothing to backfill: the last closed day is {end}.")
+            return
+    if end_day - start_day + 1 > BACKFILL_MAX_DAYS:
+        await msg.reply_text(f"❌ At most {BACKFILL_MAX_DAYS} days can be backfilled at once.")
+        return
+
+    n = await groups.state(cfg.group_id).mark_absent(start_day, end_day, update.effective_user.id)
+    await msg.reply_text(f"✅ Marked {n} absences between {start} and {end}.")
+    await bot_log(context, cfg, f"#backfill\n• Admin: {escape_md(update.effective_user.full_name)}\n• {start} → {end}: {n} absences")
+
+
+async def cmd_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Bot admin: /metrics
+    Show p50/p95/p99 latency per command since the last shift started, plus Bot API and SQL totals.
+    """
+    if not await bot_admin_only(update, context):
+        return
+
+    since = last_shift_start()
+    rows = metrics.percentiles(since.timestamp())
+    lines = [f"*Command latency since {since.strftime('%Y-%m-%d %H:%M')}:*"]
+    if not rows:
+        lines.append("No commands handled yet.")
+    for cmd, n, p50, p95, p99 in rows:
+        lines.append(f"• /{escape_md(cmd)} ×{n} — p50 `{p50 * 1000:.0f}ms` p95 `{p95 * 1000:.0f}ms` p99 `{p99 * 1000:.0f}ms`")
+
+    api_calls, api_time = metrics.total("exc_api_seconds")
+    sql_calls, sql_time = metrics.total("exc_sql_seconds")
+    lines.append("")
+    lines.append(f"*Since start:* {api_calls} Bot API calls ({api_time:.1f}s), "
+                 f"{metrics.total('exc_api_errors_total')[0]} failed, "
+                 f"{metrics.total('exc_api_retry_after_total')[0]} retry-after; "
+                 f"{sql_calls} SQL statements ({sql_time:.1f}s), "
+                 f"{metrics.total('exc_handler_errors_total')[0]} handler errors.")
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
 
 
 # -------------------- STARTUP / MAIN --------------------
+async def on_start(app: Application) -> None:
+    """Start the metrics endpoint and catch up on absence sweeps missed while the bot was down."""
+    if METRICS_PORT:  # worker N of a sharded bot serves on METRICS_PORT + N
+        await metrics_endpoint.start(METRICS_LISTEN, METRICS_PORT + worker_shard[0])
+    await run_absent_sweep()
+
+
+async def on_stop(app: Application) -> None:
+    """Flush queued log entries while the bot can still send, then close the metrics endpoint."""
+    await log_digest.close()
+    await metrics_endpoint.stop()
+
+
+async def on_shutdown(app: Application) -> None:
+    """Stop report workers, then drain pending DB work and close connections when the bot stops."""
+    await reports.close()
+    db.close()
+
+
+def build_app() -> Application:
+    """
+    Build the Telegram Application with all handlers and jobs wired up. As a worker of a
+    sharded bot it gets its share of the global send rate, and only worker 0 runs the
+    archival and backup jobs.
+    """
+    index, count = worker_shard
+    global_rate = RATE_GLOBAL_PER_SEC and max(1.0, RATE_GLOBAL_PER_SEC / count)
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(BOT_API_URL)
+        .base_file_url(BOT_FILE_URL)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .rate_limiter(OutboundScheduler(global_rate, RATE_GROUP_PER_MIN, RATE_CHAT_PER_SEC, SEND_MAX_RETRIES))
+        .post_init(on_start)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Staff commands (auto-deleting commands + confirmation + detailed logging)
+    app.add_handler(command("clockin", cmd_clockin))
+    app.add_handler(command("clockout", cmd_clockout))
+    app.add_handler(command("sick", cmd_sick))
+    app.add_handler(command("off", cmd_off))
+
+    # Admin commands
+    app.add_handler(command("setup", cmd_setup))
+    app.add_handler(command("groups", cmd_groups))
+    app.add_handler(command("shift", cmd_shift))
+    app.add_handler(command("add", cmd_add))
+    app.add_handler(command("rm", cmd_rm))
+    app.add_handler(command("roster", cmd_roster))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/roster(@\w+)?(\s|$)"),
+                                   timed("roster", cmd_roster)))
+    app.add_handler(command("staff", cmd_staff))
+    app.add_handler(command("check", cmd_check))
+    app.add_handler(command("report", heavy(cmd_report)))
+    app.add_handler(command("analytics", heavy(cmd_analytics)))
+    app.add_handler(command("status", cmd_status))
+    app.add_handler(command("backup", heavy(cmd_backup)))
+    app.add_handler(command("reset", cmd_reset))
+    app.add_handler(command("reset_clock", cmd_reset_clock))
+    app.add_handler(command("undone", cmd_undone))
+    app.add_handler(command("history", cmd_history))
+    app.add_handler(command("rebuild", heavy(cmd_rebuild)))
+    app.add_handler(command("backfill", cmd_backfill))
+    app.add_handler(command("metrics", cmd_metrics))
+    app.add_handler(CallbackQueryHandler(timed("page", on_page), pattern=rf"^({'|'.join(PAGERS)}):[np]:"))
+
+    # Admin cache invalidation (requires chat_member updates, see allowed_updates below)
+    app.add_handler(ChatMemberHandler(on_chat_member, ChatMemberHandler.CHAT_MEMBER))
+    app.add_error_handler(on_error)
+
+    # Periodic absence sweep; each group's day is swept once its shift end + ABSENT_SWEEP_DELAY has passed
+    interval = ABSENT_SWEEP_INTERVAL * 60
+    app.job_queue.run_repeating(absent_sweep_job, interval=interval, first=interval, name="absent_sweep")
+
+    # Daily archival of closed months (GMT+5)
+    if ARCHIVE_KEEP_MONTHS > 0 and index == 0:
+        archive_at = hhmm_to_dt(ARCHIVE_AT, datetime.now(GMT5))
+        app.job_queue.run_daily(archive_job, time=archive_at.timetz(), name="archive")
+
+    # Optional scheduled backups with rotation
+    if BACKUP_INTERVAL_HOURS > 0 and index == 0:
+        every = BACKUP_INTERVAL_HOURS * 3600
+        app.job_queue.run_repeating(backup_job, interval=every, first=every, name="backup")
+    return app
+
+
+def run_app(app: Application) -> None:
+    """
+    Serve updates until stopped: via the built-in webhook server when WEBHOOK_URL is set,
+    otherwise via long polling. Both stop gracefully on SIGINT/SIGTERM.
+    """
+    if WEBHOOK_URL:
+        # Telegram echoes the secret in X-Telegram-Bot-Api-Secret-Token; requests
+        # without it are rejected by the webhook server with 403.
+        secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        print(f"EXC-bot serving webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}. Press Ctrl+C to stop.")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        print("EXC-bot running. Press Ctrl+C to stop.")
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+# -------------------- SCALE-OUT --------------------
+# With WORKERS > 0 the bot runs as one ingress process plus WORKERS worker processes.
+# The ingress receives updates (webhook or polling, as above) and forwards each one, in
+# arrival order, to the worker owning the group it acts on; a worker runs the full
+# Application on the updates it is sent. A group's updates, caches (HotState, admins)
+# and absence sweeps therefore live in exactly one process, and the SQLite file is the
+# state they all share: WAL lets every process read alongside the writers, and writes to
+# one group only ever come from its owner. Archival and backups run on worker 0.
+worker_shard: Tuple[int, int] = (0, 1)  # (index, count) of this process; (0, 1) owns every group
+
+
+def shard_of(group_id: int, count: int) -> int:
+    """The worker (0..count-1) that owns group_id."""
+    return group_id % count
+
+
+def owns(group_id: int) -> bool:
+    """True if this process handles group_id's updates and sweeps."""
+    index, count = worker_shard
+    return shard_of(group_id, count) == index
+
+
+def shard_key(update: Update) -> int:
+    """
+    The group an update acts on: its chat in groups and channels, GROUP_ID in private
+    chats (where commands apply to the default group) and for updates without a chat.
+    """
+    chat = update.effective_chat
+    if chat is None or chat.type == ChatType.PRIVATE:
+        return GROUP_ID
+    return chat.id
+
+
+def config_snapshot() -> Dict[str, Any]:
+    """The CONFIG_KEYS values as this process sees them, overrides made at runtime included."""
+    return {k: globals()[k] for k in CONFIG_KEYS}
+
+
+async def serve_inbox(app: Application, inbox: Any) -> None:
+    """Process the updates the ingress puts in `inbox` until it sends None, then stop the app."""
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        while (data := await loop.run_in_executor(None, inbox.get)) is not None:
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def reconfigure() -> None:
+    """
+    Rebuild the module's singletons (DB, caches, metrics...) from the current CONFIG values.
+    They are built from the file's values on import, so call this after changing CONFIG at
+    runtime, before the bot starts. Each worker of a sharded bot gets its own report cache
+    directory, so no other process evicts a file between get() returning it and the caller
+    opening it.
+    """
+    global metrics, db, groups, log_digest, heavy_slots, admin_cache, reports
+    index, count = worker_shard
+    metrics = Metrics(METRICS_SAMPLES)
+    db.close()
+    db = Database(DB_FILE, readers=DB_READERS)
+    groups = Groups(db)
+    log_digest = LogDigest(LOG_DIGEST_WINDOW)
+    heavy_slots = asyncio.Semaphore(HEAVY_CONCURRENCY)
+    admin_cache = AdminCache(ADMIN_CACHE_TTL, ADMIN_CACHE_RETRY)
+    cache_dir = REPORT_CACHE_DIR if count == 1 else os.path.join(REPORT_CACHE_DIR, f"worker{index}")
+    reports = ReportCache(db, cache_dir, REPORT_WORKERS, REPORT_CACHE_FILES)
+
+
+def run_worker(index: int, count: int, inbox: Any, config: Dict[str, Any]) -> None:
+    """Entry point of worker process `index` of `count`; `config` is the ingress's config_snapshot()."""
+    import signal
+
+    # Ctrl+C reaches the whole process group; workers stop when the ingress tells them to
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global worker_shard
+    globals().update((k, config[k]) for k in CONFIG_KEYS if k in config)
+    worker_shard = (index, count)
+    reconfigure()
+    print(f"EXC-bot worker {index}/{count} started (pid {os.getpid()})")
+    asyncio.run(serve_inbox(build_app(), inbox))
+
+
+class Ingress:
+    """
+    Front process of a sharded bot: spawns the workers, forwards every update to the one
+    owning its group (so each group's updates, and so each user's, stay in order) and
+    restarts a worker that died. Updates forwarded meanwhile wait in its inbox.
+    """
+
+    def __init__(self, count: int) -> None:
+        import multiprocessing
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self._config = config_snapshot()
+        self.inboxes = [self._ctx.Queue() for _ in range(count)]
+        self.procs: List[Any] = [None] * count
+
+    def _spawn(self, index: int) -> None:
+        proc = self._ctx.Process(target=run_worker, name=f"exc-worker-{index}",
+                                 args=(index, len(self.inboxes), self.inboxes[index], self._config))
+        proc.start()
+        self.procs[index] = proc
+
+    def start(self) -> None:
+        for index in range(len(self.inboxes)):
+            self._spawn(index)
+
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        index = shard_of(shard_key(update), len(self.inboxes))
+        if not self.procs[index].is_alive():
+            print(f"Worker {index} exited with code {self.procs[index].exitcode}; restarting it")
+            self._spawn(index)
+        self.inboxes[index].put(update.to_dict())
+
+    def stop(self) -> None:
+        """Let every worker finish the updates already forwarded, killing any that overrun WORKER_STOP_TIMEOUT."""
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for proc in self.procs:
+            proc.join(WORKER_STOP_TIMEOUT)
+            if proc.is_alive():
+                print(f"Worker {proc.name} did not stop in {WORKER_STOP_TIMEOUT}s; killing it")
+                proc.kill()
+                proc.join()
+
+    def build_app(self) -> Application:
+        """An Application that only receives updates and hands them to forward(), one at a time."""
+        app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .base_url(BOT_API_URL)
+            .base_file_url(BOT_FILE_URL)
+            .request(InstrumentedRequest(connection_pool_size=8))
+            .get_updates_request(InstrumentedRequest(connection_pool_size=1))
+            .job_queue(None)
+            .build()
+        )
+        app.add_handler(TypeHandler(Update, self.forward))
+        return app
+
+
+def run_sharded(count: int) -> None:
+    """Serve updates with `count` worker processes behind one ingress until stopped."""
+    db.close()  # the ingress never touches the DB; init_db() has migrated it for the workers
+    ingress = Ingress(count)
+    ingress.start()
+    try:
+        run_app(ingress.build_app())
+    finally:
+        ingress.stop()
+
+
 def main() -> None:
     """
     Initialize DB and start the Telegram Application with all handlers wired up.
@@ -754,30 +4549,10 @@ def main() -> None:
     """
     print("EXC-bot starting...")
     init_db()
-
-    app = Application.builder().token(BOT_TOKEN).build()
-
-    # Staff commands (auto-deleting commands + confirmation + detailed logging)
-    app.add_handler(CommandHandler("clockin", cmd_clockin))
-    app.add_handler(CommandHandler("clockout", cmd_clockout))
-    app.add_handler(CommandHandler("sick", cmd_sick))
-    app.add_handler(CommandHandler("off", cmd_off))
-
-    # Admin commands
-    app.add_handler(CommandHandler("add", cmd_add))
-    app.add_handler(CommandHandler("rm", cmd_rm))
-    app.add_handler(CommandHandler("staff", cmd_staff))
-    app.add_handler(CommandHandler("check", cmd_check))
-    app.add_handler(CommandHandler("report", cmd_report))
-    app.add_handler(CommandHandler("status", cmd_status))
-    app.add_handler(CommandHandler("backup", cmd_backup))
-    app.add_handler(CommandHandler("reset", cmd_reset))
-    app.add_handler(CommandHandler("reset_clock", cmd_reset_clock))
-    app.add_handler(CommandHandler("undone", cmd_undone))
-
-    # Run the bot
-    print("EXC-bot running. Press Ctrl+C to stop.")
-    app.run_polling()
+    if WORKERS > 0:
+        run_sharded(WORKERS)
+    else:
+        run_app(build_app())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,397 @@
+"""
+Local stand-in for the Telegram Bot API, for exercising EXC-bot end to end offline.
+
+FakeTelegram serves the Bot API methods the bot calls (answers are minimal but valid),
+records every call, and can push update JSON to the webhook the bot registers with
+setWebhook — including the secret token header, exactly as Telegram does.
+
+Run directly to drive the real bot in webhook mode through a short scenario, either as
+one process or as an ingress sharding updates across worker processes:
+
+    python tools/fake_telegram.py
+    python tools/fake_telegram.py --workers 3
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "EXC", "username": "exc_bot"}
+
+
+def _parse_params(content_type: str, body: bytes) -> Dict[str, Any]:
+    """Decode a Bot API request body (JSON, urlencoded or multipart) into a dict."""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser(policy=email_policy).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+        )
+        params: Dict[str, Any] = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True))}
+            else:
+                params[name] = part.get_content()
+        return params
+    return dict(parse_qsl(body.decode()))
+
+
+class FakeTelegram:
+    """Threaded fake Bot API server; see the module docstring."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self._cond = threading.Condition()
+        self._message_id = 1000
+        self._update_id = 0
+        self.files: Dict[str, bytes] = {}
+        self.flood: Dict[str, int] = {}  # method -> calls still to answer with 429 retry_after=1
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:  # noqa: N802 - http.server API
+                length = int(self.headers.get("Content-Length") or 0)
+                params = _parse_params(self.headers.get("Content-Type", ""), self.rfile.read(length))
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                if fake._flooded(method):
+                    status, answer = 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1},
+                                           "description": "Too Many Requests: retry after 1"}
+                else:
+                    status, answer = 200, {"ok": True, "result": fake._answer(method, params)}
+                body = json.dumps(answer).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:  # noqa: N802 - http.server API
+                if not self.path.startswith("/file/"):
+                    self.do_POST()
+                    return
+                body = fake.files.get(self.path.rsplit("/", 1)[-1])
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+                self.wfile.write(body or b"")
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_url(self) -> str:
+        """Value for main.BOT_API_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    @property
+    def file_url(self) -> str:
+        """Value for main.BOT_FILE_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/file/bot"
+
+    def start(self) -> "FakeTelegram":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ---- Bot API ----
+    def _message(self, chat_id: Any, **extra: Any) -> Dict[str, Any]:
+        with self._cond:
+            self._message_id += 1
+            message_id = self._message_id
+        chat = {"id": int(chat_id), "type": "supergroup" if int(chat_id) < 0 else "private"}
+        return {"message_id": message_id, "date": int(time.time()), "chat": chat, "from": BOT_USER, **extra}
+
+    def _flooded(self, method: str) -> bool:
+        """Consume one pending flood-control answer for method; rejected calls are not recorded."""
+        with self._cond:
+            if self.flood.get(method, 0) <= 0:
+                return False
+            self.flood[method] -= 1
+            return True
+
+    def _answer(self, method: str, params: Dict[str, Any]) -> Any:
+        with self._cond:
+            self.calls.append((method, params))
+            if method == "setWebhook":
+                self.webhook_url = params.get("url")
+                self.webhook_secret = params.get("secret_token")
+            elif method == "deleteWebhook":
+                self.webhook_url = None
+            self._cond.notify_all()
+        if method == "getMe":
+            return BOT_USER
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getUpdates":
+            time.sleep(min(float(params.get("timeout") or 0), 1.0))
+            return []
+        if method == "getChatAdministrators":
+            return []
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")),
+                    "file_path": f"documents/{file_id}"}
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params.get("chat_id"), text=params.get("text", ""))
+        if method in ("sendDocument", "sendPhoto"):
+            return self._message(params.get("chat_id"))
+        return True
+
+    def wait_for(self, predicate: Callable[[str, Dict[str, Any]], bool], timeout: float = 10.0) -> Tuple[str, Dict[str, Any]]:
+        """Block until a recorded call matches predicate(method, params); return it."""
+        deadline = time.monotonic() + timeout
+        seen = 0
+        with self._cond:
+            while True:
+                for call in self.calls[seen:]:
+                    if predicate(*call):
+                        return call
+                seen = len(self.calls)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("no matching Bot API call")
+                self._cond.wait(remaining)
+
+    def wait_webhook_ready(self, timeout: float = 15.0) -> None:
+        """Block until the bot has registered its webhook and the endpoint accepts connections."""
+        self.wait_for(lambda m, p: m == "setWebhook", timeout=timeout)
+        parts = urlsplit(self.webhook_url)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection((parts.hostname, parts.port), timeout=1).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("webhook endpoint not listening")
+                time.sleep(0.05)
+
+    # ---- updates ----
+    def command_update(self, user_id: int, name: str, text: str, chat_id: int) -> Dict[str, Any]:
+        """Build the Update JSON for a /command sent by user_id in chat_id."""
+        self._update_id += 1
+        self._message_id += 1
+        cmd_len = len(text.split()[0])
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private", "title": "EXC"},
+                "from": {"id": user_id, "is_bot": False, "first_name": name},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": cmd_len}],
+            },
+        }
+
+    def document_update(self, user_id: int, name: str, filename: str, data: bytes, caption: str,
+                        chat_id: int) -> Dict[str, Any]:
+        """Build the Update JSON for user_id sending file `data` with `caption` in chat_id; getFile serves it."""
+        update = self.command_update(user_id, name, caption, chat_id)
+        message = update["message"]
+        file_id = f"file{self._update_id}"
+        self.files[file_id] = data
+        message["caption"] = message.pop("text")
+        message["caption_entities"] = message.pop("entities")
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": filename,
+                               "file_size": len(data)}
+        return update
+
+    def callback_update(self, user_id: int, name: str, data: str, chat_id: int) -> Dict[str, Any]:
+        """Build the Update JSON for user_id tapping an inline button carrying `data` on a bot message in chat_id."""
+        self._update_id += 1
+        message = self._message(chat_id, text="")
+        return {
+            "update_id": self._update_id,
+            "callback_query": {
+                "id": str(self._update_id),
+                "from": {"id": user_id, "is_bot": False, "first_name": name},
+                "chat_instance": str(chat_id),
+                "message": message,
+                "data": data,
+            },
+        }
+
+    def post_update(self, update: Dict[str, Any], secret: Optional[str] = None) -> int:
+        """POST update JSON to the registered webhook; returns the HTTP status."""
+        if not self.webhook_url:
+            raise RuntimeError("bot has not called setWebhook")
+        req = urllib.request.Request(
+            self.webhook_url,
+            data=json.dumps(update).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": self.webhook_secret if secret is None else secret,
+            },
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def _scenario(fake: FakeTelegram, bot: Any, failures: List[str]) -> None:
+    """Drive a short clock-in/out scenario through the webhook, then stop the bot."""
+    try:
+        fake.wait_webhook_ready()
+        admin = bot.BOT_ADMINS[0]
+        group = bot.GROUP_ID
+
+        if fake.post_update(fake.command_update(admin, "Admin", "/add 42 Test User", group), secret="wrong") != 403:
+            failures.append("update with a wrong secret token was not rejected")
+
+        other = group - 1  # a second team served by the same bot
+        steps = [
+            (admin, "Admin", "/add 42 Test User", group, "Added staff"),
+            (42, "Test User", "/clockin", group, "clocked in"),
+            (42, "Test User", "/clockout", group, "clocked out"),
+            (admin, "Admin", "/undone 42", group, "Clock-out undone"),
+            (admin, "Admin", "/history 42", group, "(undone)"),
+            (admin, "Admin", "/rebuild", group, "0 had drifted"),
+            (admin, "Admin", "/status", group, "Today's attendance"),
+            (admin, "Admin", "/analytics", group, "Late arrivals"),
+            (admin, "Admin", "/metrics", group, "Command latency"),
+            (42, "Test User", "/clockin", other, "not set up"),
+            (admin, "Admin", "/setup 08:00 17:00", other, "Registered this group"),
+            (42, "Test User", "/clockin", other, "not registered as staff"),
+            (admin, "Admin", "/add 42 Test User", other, "Added staff"),
+            (admin, "Admin", "/shift 22:00 06:00", other, "22:00–06:00 (next day)"),
+            (admin, "Admin", "/shift off sun 42", other, "user 42, Sun: off"),
+            (admin, "Admin", "/shift", other, "user 42, Sun: off"),
+            (42, "Test User", "/clockin", other, "clocked in"),
+            (admin, "Admin", "/groups", group, "08:00"),
+        ]
+        for uid, name, text, chat, expect in steps:
+            if text == "/status":
+                fake.flood["sendMessage"] = 1  # the reply (or a log line) is answered 429 once and requeued
+            status = fake.post_update(fake.command_update(uid, name, text, chat))
+            if status != 200:
+                failures.append(f"{text}: webhook returned {status}")
+                continue
+            try:
+                fake.wait_for(lambda m, p: m == "sendMessage" and str(p.get("chat_id")) == str(chat)
+                              and expect in str(p.get("text", "")))
+                print(f"ok    {text} ({chat})")
+            except TimeoutError:
+                failures.append(f"{text}: no reply containing {expect!r}")
+
+        fake.post_update(fake.command_update(admin, "Admin", "/analytics chart", group))
+        try:
+            fake.wait_for(lambda m, p: m == "sendPhoto" or (m == "sendMessage" and "Chart unavailable" in str(p.get("text", ""))))
+            print("ok    /analytics chart")
+        except TimeoutError:
+            failures.append("/analytics chart: no chart or notice sent")
+
+        # PAGE_SIZE is 1 here: /staff pages through two staff with its Next button
+        fake.post_update(fake.command_update(admin, "Admin", "/add 43 Another User", group))
+        fake.post_update(fake.command_update(admin, "Admin", "/staff", group))
+        try:
+            _, sent = fake.wait_for(lambda m, p: m == "sendMessage" and "Staff List" in str(p.get("text", "")))
+            markup = sent["reply_markup"]
+            markup = json.loads(markup) if isinstance(markup, str) else markup
+            data = markup["inline_keyboard"][0][0]["callback_data"]
+            fake.post_update(fake.callback_update(admin, "Admin", data, group))
+            fake.wait_for(lambda m, p: m == "editMessageText" and "Test User" in str(p.get("text", "")))
+            print("ok    /staff Next »")
+        except (TimeoutError, KeyError) as e:
+            failures.append(f"/staff paging: {e!r}")
+
+        # /roster as a document caption: 44 joins, 43 (not in the file) leaves, all in one sync
+        roster = b"user_id,full_name\n42,Test User\n44,New Hire\n"
+        fake.post_update(fake.document_update(admin, "Admin", "team.csv", roster, "/roster", group))
+        try:
+            fake.wait_for(lambda m, p: m == "sendMessage" and "1 added, 0 renamed, 1 removed" in str(p.get("text", "")))
+            print("ok    /roster team.csv")
+        except TimeoutError:
+            failures.append("/roster: roster not applied")
+
+        for sent, attempt in enumerate(("built", "cached"), 1):
+            fake.post_update(fake.command_update(admin, "Admin", "/report csv", group))
+            try:
+                fake.wait_for(lambda m, p: sum(c[0] == "sendDocument" for c in fake.calls) >= sent, timeout=30)
+                print(f"ok    /report csv ({attempt})")
+            except TimeoutError:
+                failures.append(f"/report csv ({attempt}): no document sent")
+
+        exposition = ""
+        for index in range(max(1, bot.WORKERS)):  # each worker serves its own metrics
+            with urllib.request.urlopen(f"http://127.0.0.1:{bot.METRICS_PORT + index}/metrics", timeout=5) as resp:
+                exposition += resp.read().decode()
+        for needle in ('exc_handler_seconds_count{command="clockin"}', 'exc_api_seconds_count{method="sendMessage"}',
+                       'exc_sql_seconds_count{statement="INSERT"}', 'exc_report_cache_total{result="hit"} 1',
+                       'exc_send_requeued_total{method="sendMessage"} 1'):
+            if needle not in exposition:
+                failures.append(f"/metrics endpoint lacks {needle}")
+        print("ok    GET /metrics")
+    except Exception as e:  # report instead of hanging the bot
+        failures.append(repr(e))
+    finally:
+        os.kill(os.getpid(), signal.SIGINT)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=0, help="worker processes to shard updates across (0 = one process)")
+    args = ap.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.chdir(tempfile.mkdtemp(prefix="exc_fake_tg_"))  # the bot's DB_FILE is relative
+    import main as bot
+
+    fake = FakeTelegram().start()
+    bot.BOT_TOKEN = "123456:FAKE"
+    bot.BOT_API_URL = fake.api_url
+    bot.BOT_FILE_URL = fake.file_url
+    bot.WEBHOOK_URL = "http://127.0.0.1:18443"
+    bot.WEBHOOK_LISTEN = "127.0.0.1"
+    bot.WEBHOOK_PORT = 18443
+    bot.LOG_DIGEST_WINDOW = 0
+    bot.METRICS_PORT = 19108
+    bot.PAGE_SIZE = 1
+    bot.DB_FILE = "fake_telegram.db"  # not the default: workers must pick up overridden config
+    bot.WORKERS = args.workers
+    bot.reconfigure()
+
+    failures: List[str] = []
+    threading.Thread(target=_scenario, args=(fake, bot, failures), daemon=True).start()
+    bot.init_db()
+    if bot.WORKERS:
+        bot.run_sharded(bot.WORKERS)
+    else:
+        bot.run_app(bot.build_app())
+    fake.stop()
+
+    for f in failures:
+        print("FAIL ", f)
+    print("PASS" if not failures else f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())